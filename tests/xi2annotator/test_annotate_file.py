@@ -0,0 +1,60 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+import io
+import json
+import os
+import pytest
+from xi2annotator import create_app
+from xi2annotator.annotate_file import annotate_file
+from xi2annotator.bench import load_bench_requests
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../fixtures', 'load_test')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_annotate_file(workers):
+    output = io.BytesIO()
+    stats = annotate_file(os.path.join(DATA_DIR, '1_HSA_SDA_AB_load_test_small.mgf'),
+                          os.path.join(DATA_DIR, 'HSA-S_good_cl_xi1_results.csv'),
+                          os.path.join(DATA_DIR, '1_HSA_SDA_AB_xi2_config.json'),
+                          output, workers)
+    assert stats == {'annotated': 10, 'missing_spectra': 0}
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(responses) == 10
+    assert all(r['id'].startswith('Scan: ') for r in responses)
+
+    # same annotations as the FULL route
+    app = create_app()
+    client = app.test_client()
+    expected = {}
+    for request in load_bench_requests('crosslinked', DATA_DIR):
+        response = client.post('/xiAnnotator/annotate/FULL', json=request).get_json()
+        expected[response['annotation']['precursorMZ']] = response
+    for response in responses:
+        response.pop('id')
+        assert response == expected[response['annotation']['precursorMZ']]
+
+
+def test_annotate_file_missing_spectra():
+    output = io.BytesIO()
+    stats = annotate_file(os.path.join(DATA_DIR, '1_HSA_SDA_AB_load_test_small.mgf'),
+                          os.path.join(DATA_DIR, '../190410_5psm_PSM_xiFDR1.2.30.59dev.csv'),
+                          os.path.join(DATA_DIR, '1_HSA_SDA_AB_xi2_config.json'),
+                          output, 1)
+    assert stats == {'annotated': 0, 'missing_spectra': 144}
+    assert output.getvalue() == b''
@@ -2852,3 +2852,870 @@ def test_annotate_with_composition_modification(client):
     # check that the modifications has been written out with a mass
     exp_mods = [{'aminoAcids': ['M'], 'id': 'ox', 'mass': 15.99491461956}]
     assert res.json['annotation']['modifications'] == exp_mods
+
+
+def test_annotate_batch(client):
+    """
+    Test the batch annotation of several spectra sharing one config.
+
+    Each item response should be the same as the FULL response for the item and failing items
+    should be reported without failing the whole batch.
+    """
+    url = url_for('xi2annotator.annotate_batch')
+    full_url = url_for('xi2annotator.annotate')
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    # split the request into the shared annotation block and the item
+    annotation = copy.deepcopy(request['annotation'])
+    precursor = {k: annotation.pop(k) for k in ['precursorMZ', 'precursorCharge']}
+    item = {
+        'Peptides': request['Peptides'],
+        'LinkSite': request['LinkSite'],
+        'peaks': request['peaks'],
+        'annotation': precursor
+    }
+    # item with 3 peptides is not supported
+    failing_item = copy.deepcopy(item)
+    failing_item['Peptides'].append(failing_item['Peptides'][0])
+    batch_request = {'annotation': annotation, 'items': [item, failing_item, item]}
+
+    res = client.post(url, json=batch_request)
+    assert res._status_code == 200
+    assert res.mimetype == 'application/json'
+    responses = res.json['responses']
+    assert len(responses) == 3
+
+    full_res = client.post(full_url, json=request)
+    assert responses[0] == full_res.json
+    assert responses[2] == full_res.json
+    assert responses[1]['error'] == 'Unsupported number of peptides given!'
+
+    # items that aren't objects only fail themselves
+    res = client.post(url, json={'annotation': annotation, 'items': [item, ['peaks'], item]})
+    assert res._status_code == 200
+    responses = res.json['responses']
+    assert responses[0] == full_res.json
+    assert 'error' in responses[1]
+    assert responses[2] == full_res.json
+
+
+def test_annotate_batch_item_overrides(client):
+    """Test that items overriding crosslinkerID or returnModSyntax are annotated with them."""
+    from xi2annotator.routes import response_cache
+    response_cache.resize(0)
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    request['annotation']['config']['crosslinker'] = ['BS3', 'DSSO']
+    request['annotation']['crosslinkerID'] = 0
+
+    item = {'Peptides': request['Peptides'], 'LinkSite': request['LinkSite'],
+            'peaks': request['peaks']}
+    dsso_item = dict(item, annotation={'crosslinkerID': 1})
+    modx_item = dict(item, annotation={'returnModSyntax': 'modX'})
+    batch_request = {'annotation': request['annotation'], 'items': [item, dsso_item, modx_item]}
+    res = client.post(url_for('xi2annotator.annotate_batch'), json=batch_request)
+    assert res._status_code == 200
+    responses = res.json['responses']
+
+    full_url = url_for('xi2annotator.annotate')
+    assert responses[0] == client.post(full_url, json=request).json
+    for response, override in [(responses[1], {'crosslinkerID': 1}),
+                               (responses[2], {'returnModSyntax': 'modX'})]:
+        full_request = copy.deepcopy(request)
+        full_request['annotation'].update(override)
+        assert response == client.post(full_url, json=full_request).json
+    assert responses[1]['annotation']['crosslinker'] != responses[0]['annotation']['crosslinker']
+
+
+def test_annotation_setup_cache(client):
+    """Test that repeated requests with the same config reuse the cached AnnotationSetup."""
+    from xi2annotator.annotation import setup_cache
+    from xi2annotator.routes import response_cache
+    url = url_for('xi2annotator.annotate')
+    # don't answer from the response cache
+    response_cache.resize(0)
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    setup_cache.clear()
+    res1 = client.post(url, json=request)
+    res2 = client.post(url, json=request)
+    assert res1._status_code == 200
+    assert res2._status_code == 200
+    assert setup_cache.stats()['misses'] == 1
+    assert setup_cache.stats()['hits'] == 1
+    assert res1.json == res2.json
+    # default losses are echoed in the config on cache hits as well
+    assert [loss['name'] for loss in res2.json['annotation']['config']['fragmentation'][
+        'losses']] == ['H2O', 'NH3']
+    assert res2.json['annotation']['losses'] == default_losses
+
+    # a different precursor charge uses the same setup
+    request['annotation']['precursorCharge'] = 2
+    client.post(url, json=request)
+    assert setup_cache.stats()['hits'] == 2
+    # a different config doesn't
+    request['annotation']['config']['ms2_tol'] = '20 ppm'
+    client.post(url, json=request)
+    assert setup_cache.stats()['misses'] == 2
+
+
+def test_annotation_setup_response_blocks(client):
+    """Test that mutating a response doesn't change the cached setup of later requests."""
+    from xi2annotator.annotation import annotate_json
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    first = annotate_json(copy.deepcopy(request))['annotation']
+    expected = copy.deepcopy(first)
+    first['crosslinker']['specificity'].append('S')
+    first['crosslinker']['modMass'] = 0
+    first['modifications'].clear()
+    first['losses'][0]['specificity'].append('X')
+    first['config']['fragmentation']['losses'].clear()
+    second = annotate_json(copy.deepcopy(request))['annotation']
+    assert second == expected
+
+
+def test_fragment_cache(client):
+    """Test that the fragment table is reused for the same peptides, link sites and charge."""
+    from xi2annotator.annotation import fragment_cache
+    from xi2annotator.routes import response_cache
+    url = url_for('xi2annotator.annotate')
+    # don't answer from the response cache
+    response_cache.resize(0)
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi1_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    fragment_cache.clear()
+    res1 = client.post(url, json=request)
+    res2 = client.post(url, json=request)
+    assert fragment_cache.stats()['misses'] == 1
+    assert fragment_cache.stats()['hits'] == 1
+    assert res1.json == res2.json
+    check_result(res2.json, exp_simple_synthetic)
+
+    # different link site
+    request['LinkSite'][1]['linkSite'] = 1
+    client.post(url, json=request)
+    assert fragment_cache.stats()['misses'] == 2
+    # different precursor charge reuses the singly charged fragments
+    request['annotation']['precursorCharge'] = 2
+    client.post(url, json=request)
+    assert fragment_cache.stats()['misses'] == 2
+    assert fragment_cache.stats()['hits'] == 2
+    # different ions
+    request['annotation']['ions'] = [{'type': 'BIon'}, {'type': 'YIon'}]
+    client.post(url, json=request)
+    assert fragment_cache.stats()['misses'] == 3
+    assert fragment_cache.stats()['hits'] == 2
+
+
+@pytest.mark.parametrize('charge', [1, 3, 6])
+def test_spread_fragment_charges(charge):
+    """Test that the vectorized charge spreading matches xicommon's spread_charges."""
+    import numpy as np
+    from xicommon.fragmentation import spread_charges
+    from xi2annotator.annotation import AnnotationSetup, request_peptides, \
+        setup_exact_peptide_db, create_fragments, spread_fragment_charges
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(
+        current_dir, '../fixtures', 'annotation_requests',
+        'xi2_format_QNCcmELFEQLGEYKFQNALLVR-KQTALVELVK_12-0_z4_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    setup = AnnotationSetup(request['annotation'])
+    ctx = setup.create_context()
+    setup_exact_peptide_db(ctx, *request_peptides(setup, request['Peptides']))
+    fragments = create_fragments(setup, ctx, [0, 1], (11, 0))
+
+    expected = spread_charges(fragments, ctx, charge)
+    charged = spread_fragment_charges(fragments, charge)
+    assert charged.dtype == expected.dtype
+    np.testing.assert_array_equal(charged, expected)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_base64_peaks(client, dtype):
+    """Test the base64 encoded peaks request format and the matching response peaks."""
+    import base64
+    import numpy as np
+    from xi2annotator.annotation import PEAK_DTYPES
+    url = url_for('xi2annotator.annotate')
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi1_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    expected = client.post(url, json=copy.deepcopy(request)).json
+
+    def encode(values):
+        return base64.b64encode(np.array(values, dtype=PEAK_DTYPES[dtype]).tobytes()).decode()
+
+    request['peaks'] = {
+        'encoding': 'base64',
+        'dtype': dtype,
+        'mz': encode([p['mz'] for p in request['peaks']]),
+        'intensity': encode([p['intensity'] for p in request['peaks']]),
+    }
+    res = client.post(url, json=request)
+    assert res.status_code == 200
+    peaks = res.json['peaks']
+    assert peaks['encoding'] == 'base64'
+    assert peaks['dtype'] == dtype
+    mz_values = np.frombuffer(base64.b64decode(peaks['mz']), dtype=PEAK_DTYPES[dtype])
+    int_values = np.frombuffer(base64.b64decode(peaks['intensity']), dtype=PEAK_DTYPES[dtype])
+    np.testing.assert_array_equal(
+        mz_values, np.array([p['mz'] for p in expected['peaks']], dtype=PEAK_DTYPES[dtype]))
+    np.testing.assert_array_equal(
+        int_values,
+        np.array([p['intensity'] for p in expected['peaks']], dtype=PEAK_DTYPES[dtype]))
+    assert peaks['clusterIds'] == [p['clusterIds'] for p in expected['peaks']]
+    assert res.json['clusters'] == expected['clusters']
+    assert [f['name'] for f in res.json['fragments']] == \
+        [f['name'] for f in expected['fragments']]
+    if dtype == 'float64':
+        assert res.json['fragments'] == expected['fragments']
+
+
+def test_base64_peaks_invalid():
+    """Test that invalid base64 encoded peaks are rejected."""
+    from xi2annotator.annotation import decode_peaks
+    with pytest.raises(ValueError, match='encoding'):
+        decode_peaks({'encoding': 'hex', 'mz': '', 'intensity': ''})
+    with pytest.raises(ValueError, match='dtype'):
+        decode_peaks({'encoding': 'base64', 'dtype': 'int8', 'mz': '', 'intensity': ''})
+    with pytest.raises(ValueError, match='differ'):
+        decode_peaks({'encoding': 'base64', 'mz': 'AAAAAAAAAAA=', 'intensity': ''})
+
+
+def test_decoded_peaks():
+    """Test that in-process requests can pass the peaks as decoded arrays."""
+    import numpy as np
+    from xi2annotator.annotation import decode_peaks
+    peaks = [{'mz': 100.5, 'intensity': 10}, {'mz': 200.25, 'intensity': 20}]
+    mz_array, int_array, dtype = decode_peaks((np.array([100.5, 200.25]), np.array([10, 20])))
+    assert dtype is None
+    assert mz_array.dtype == int_array.dtype == np.float64
+    expected = decode_peaks(peaks)
+    assert mz_array.tolist() == expected[0].tolist()
+    assert int_array.tolist() == expected[1].tolist()
+    with pytest.raises(ValueError, match='differ'):
+        decode_peaks((np.array([100.5]), np.array([])))
+
+
+def test_peaks_format(client):
+    """Test the compact and omitted peaks blocks of the response."""
+    url = url_for('xi2annotator.annotate')
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi1_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    full = client.post(url, json=copy.deepcopy(request))
+
+    request['annotation']['peaksFormat'] = 'compact'
+    compact = client.post(url, json=copy.deepcopy(request))
+    assert compact.status_code == 200
+    peaks = compact.json['peaks']
+    assert set(peaks.keys()) == {'peakIds', 'clusterIds'}
+    assert len(peaks['peakIds']) == len(peaks['clusterIds'])
+    expected = [(peak_id, cluster_id) for peak_id, p in enumerate(full.json['peaks'])
+                for cluster_id in p['clusterIds']]
+    assert list(zip(peaks['peakIds'], peaks['clusterIds'])) == expected
+    assert compact.json['fragments'] == full.json['fragments']
+    assert len(compact.data) < len(full.data)
+
+    request['annotation']['peaksFormat'] = 'none'
+    omitted = client.post(url, json=copy.deepcopy(request))
+    assert 'peaks' not in omitted.json
+    assert omitted.json['clusters'] == full.json['clusters']
+    assert omitted.json['fragments'] == full.json['fragments']
+
+
+@pytest.mark.parametrize('request_format', ['xi1', 'xi2'])
+def test_exact_peptide_db(request_format):
+    """Test that the peptide database holds exactly the request peptides in request order."""
+    import numpy as np
+    from xi2annotator.annotation import AnnotationSetup, request_peptides, \
+        setup_exact_peptide_db
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(
+        current_dir, '../fixtures', 'annotation_requests',
+        f'{request_format}_format_QNCcmELFEQLGEYKFQNALLVR-KQTALVELVK_12-0_z4_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    setup = AnnotationSetup(request['annotation'])
+    ctx = setup.create_context()
+
+    # reversed order (not alphabetical) and the same base sequence with and without modification
+    unmodified = copy.deepcopy(request['Peptides'][0])
+    if request_format == 'xi1':
+        for aa in unmodified['sequence']:
+            aa['Modification'] = ''
+    else:
+        unmodified['modification_ids'] = []
+        unmodified['modification_positions'] = []
+    peptides = request['Peptides'][::-1] + [unmodified]
+    base_seqs, modifications = request_peptides(setup, peptides)
+    setup_exact_peptide_db(ctx, base_seqs, modifications)
+    sequences = ctx.peptide_db.mod_pep_sequence(np.arange(3), mod_peptide_syntax='modX')
+    assert sequences.tolist() == [b'KQTALVELVK', b'QNcmCELFEQLGEYKFQNALLVR',
+                                  b'QNCELFEQLGEYKFQNALLVR']
+    assert ctx.modified_peptides_aa_lengths.tolist() == [10, 21, 21]
+
+    # a reused context gets the new peptides
+    setup_exact_peptide_db(ctx, base_seqs[:1], modifications[:1])
+    assert ctx.peptide_db.mod_pep_sequence(np.arange(1)).tolist() == [b'KQTALVELVK']
+
+
+def test_annotate_candidates(client):
+    """Test the annotation of several candidates of one spectrum in a single request."""
+    from xi2annotator.annotation import isotope_cache
+    from xi2annotator.routes import response_cache
+    response_cache.resize(0)
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    request['annotation']['config']['crosslinker'] = ['BS3', 'DSSO']
+    request['annotation']['crosslinkerID'] = 0
+    full = client.post(url_for('xi2annotator.annotate'), json=copy.deepcopy(request)).json
+
+    other_link_sites = copy.deepcopy(request['LinkSite'])
+    other_link_sites[0]['linkSite'] = 0
+    candidates_request = {
+        'annotation': request['annotation'],
+        'peaks': request['peaks'],
+        'candidates': [
+            {'Peptides': request['Peptides'], 'LinkSite': request['LinkSite']},
+            {'id': 'dsso', 'Peptides': request['Peptides'], 'LinkSite': request['LinkSite'],
+             'crosslinkerID': 1},
+            {'Peptides': request['Peptides'], 'LinkSite': other_link_sites},
+            {'Peptides': request['Peptides'][:1]},
+            {'Peptides': request['Peptides'], 'LinkSite': request['LinkSite'],
+             'crosslinkerID': 5},
+        ]
+    }
+    isotope_cache.clear()
+    res = client.post(url_for('xi2annotator.annotate_candidates'), json=candidates_request)
+    assert res.status_code == 200
+    # the isotope detection runs once for all candidates
+    assert isotope_cache.stats()['misses'] == 1
+    assert isotope_cache.stats()['hits'] == 0
+    assert res.json['peaks'] == full['peaks']
+    assert res.json['clusters'] == full['clusters']
+
+    candidates = res.json['candidates']
+    assert [c['id'] for c in candidates] == [0, 'dsso', 2, 3, 4]
+    assert candidates[0]['fragments'] == full['fragments']
+    assert candidates[0]['annotation'] == full['annotation']
+    assert candidates[1]['annotation']['crosslinker']['modMass'] != \
+        full['annotation']['crosslinker']['modMass']
+    assert candidates[3]['LinkSite'] == []
+    assert 'error' in candidates[4]
+
+    summary = candidates[0]['summary']
+    assert summary['matchedFragments'] == len(full['fragments'])
+    assert 0 < summary['matchedIntensityFraction'] <= 1
+    assert 0 < summary['sequenceCoverage'] <= 1
+    assert len(summary['peptideCoverage']) == 2
+    # the correct explanation matches more than the wrong crosslinker
+    assert candidates[1]['summary']['matchedFragments'] < summary['matchedFragments']
+
+    # without top-level crosslinkerID the crosslinker is only resolved per candidate
+    del candidates_request['annotation']['crosslinkerID']
+    candidates_request['candidates'] = [
+        {'Peptides': request['Peptides'], 'LinkSite': request['LinkSite'], 'crosslinkerID': 0},
+        {'Peptides': request['Peptides'], 'LinkSite': request['LinkSite'], 'crosslinkerID': 1},
+        {'Peptides': request['Peptides'], 'LinkSite': request['LinkSite']},
+    ]
+    res = client.post(url_for('xi2annotator.annotate_candidates'), json=candidates_request)
+    assert res.status_code == 200
+    assert res.json['peaks'] == full['peaks']
+    candidates_no_id = res.json['candidates']
+    assert candidates_no_id[0]['fragments'] == full['fragments']
+    assert candidates_no_id[0]['summary'] == summary
+    assert candidates_no_id[1]['summary'] == candidates[1]['summary']
+    assert candidates_no_id[1]['annotation']['crosslinker'] == \
+        candidates[1]['annotation']['crosslinker']
+    assert 'More than 1 crosslinker' in candidates_no_id[2]['error']
+
+
+def test_annotate_link_sites(client, monkeypatch):
+    """Test the link site scan of a crosslinked peptide pair."""
+    from xi2annotator.routes import response_cache
+    response_cache.resize(0)
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    scan_request = copy.deepcopy(request)
+    del scan_request['LinkSite']
+    scan_request['topK'] = 2
+    res = client.post(url_for('xi2annotator.annotate_link_sites'), json=scan_request)
+    assert res.status_code == 200
+    # BS3 links K, S, T, Y and the peptide n-terminus
+    site_pairs = res.json['sitePairs']
+    assert sorted(p['linkSites'] for p in site_pairs) == [[0, 0], [1, 0], [2, 0]]
+    matched = [p['summary']['matchedFragments'] for p in site_pairs]
+    assert matched == sorted(matched, reverse=True)
+    assert len(res.json['annotations']) == 2
+
+    # the shared site fragments match the same as the full fragmentation of each site pair
+    for site_pair, annotation in zip(site_pairs, res.json['annotations']):
+        link_sites = copy.deepcopy(request['LinkSite'])
+        link_sites[0]['linkSite'], link_sites[1]['linkSite'] = site_pair['linkSites']
+        full_request = copy.deepcopy(request)
+        full_request['LinkSite'] = link_sites
+        full = client.post(url_for('xi2annotator.annotate'), json=full_request).json
+        assert annotation['fragments'] == full['fragments']
+        assert annotation['LinkSite'] == full['LinkSite']
+        assert site_pair['summary']['matchedFragments'] == len(full['fragments'])
+        assert annotation['summary'] == {k: v for k, v in site_pair['summary'].items()
+                                         if k != 'crosslinkedFragments'}
+        assert 0 < site_pair['summary']['crosslinkedFragments'] <= len(full['fragments'])
+
+    # linear requests can't be scanned
+    linear_request = copy.deepcopy(scan_request)
+    linear_request['Peptides'] = linear_request['Peptides'][:1]
+    monkeypatch.setenv('XI2ANNOTATOR_DEBUG', 'true')
+    res = client.post(url_for('xi2annotator.annotate_link_sites'), json=linear_request)
+    assert res.status_code == 400
+
+
+def test_crosslinker_link_sites():
+    """Test the link sites allowed by the crosslinker specificities."""
+    from xi2annotator.annotation import get_annotation_setup, setup_request_peptide_db, \
+        crosslinker_link_sites, crosslinker_site_pairs
+    annotation = {
+        'precursorMZ': 500, 'precursorCharge': 3, 'crosslinkerID': 0,
+        'config': {'ms2_tol': '10 ppm', 'fragmentation': {},
+                   'crosslinker': [{'name': 'hetero', 'mass': 100,
+                                    'specificity': [['K', 'oxM'], ['X', 'nterm']]}],
+                   'modification': {'modifications': [
+                       {'name': 'ox', 'specificity': ['M'], 'type': 'variable',
+                        'composition': 'O1'}]}}}
+    setup = get_annotation_setup(annotation)
+    ctx = setup.create_context()
+    setup_request_peptide_db(setup, ctx, [
+        {'base_sequence': 'AKMKM', 'modification_ids': [0], 'modification_positions': [3]},
+        {'base_sequence': 'KR', 'modification_ids': [], 'modification_positions': []}])
+    # unmodified K and oxidised M
+    assert crosslinker_link_sites(setup, ctx, 0, 0) == [1, 2, 3]
+    assert crosslinker_link_sites(setup, ctx, 1, 0) == [0]
+    assert crosslinker_link_sites(setup, ctx, 1, 1) == [0, 1]
+    # either end can react with either peptide
+    assert crosslinker_site_pairs(setup, ctx) == [(0, 0), (1, 0), (1, 1), (2, 0), (2, 1),
+                                                  (3, 0), (3, 1), (4, 0)]
+
+
+def test_annotate_modification_sites(client, monkeypatch):
+    """Test the scan of all placements of a modification."""
+    from xi2annotator.routes import response_cache
+    response_cache.resize(0)
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_LAsdaK-TSR_z3_NAP.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    request['annotation']['config']['modification']['modifications'][0]['specificity'] = \
+        ['K', 'L']
+
+    scan_request = copy.deepcopy(request)
+    scan_request['modificationScan'] = {'peptideId': 0, 'modification': 'sda'}
+    res = client.post(url_for('xi2annotator.annotate_modification_sites'), json=scan_request)
+    assert res.status_code == 200
+    # the request placement on K is replaced by each candidate position
+    placements = res.json['placements']
+    assert sorted(p['position'] for p in placements) == [0, 2]
+    assert placements[0]['position'] == 2
+    assert placements[0]['siteDetermining']['matchedFragments'] > \
+        placements[1]['siteDetermining']['matchedFragments']
+    assert len(res.json['annotations']) == 2
+
+    for placement, annotation in zip(placements, res.json['annotations']):
+        full_request = copy.deepcopy(request)
+        full_request['Peptides'][0] = {'base_sequence': 'LAK', 'modification_ids': [0],
+                                       'modification_positions': [placement['position'] + 1]}
+        full = client.post(url_for('xi2annotator.annotate'), json=full_request).json
+        assert annotation['Peptides'] == full['Peptides']
+        assert annotation['fragments'] == full['fragments']
+        assert placement['summary'] == annotation['summary']
+        site_determining = placement['siteDetermining']
+        assert site_determining['matchedFragments'] <= site_determining['fragments']
+
+    # positions carrying another modification can't be scanned
+    monkeypatch.setenv('XI2ANNOTATOR_DEBUG', 'true')
+    scan_request['modificationScan'] = {'peptideId': 0, 'modification': 'sda',
+                                        'positions': [3]}
+    res = client.post(url_for('xi2annotator.annotate_modification_sites'), json=scan_request)
+    assert res.status_code == 400
+    assert 'Invalid positions' in res.json['error']
+
+    # explicit positions must be allowed by the specificity of the modification
+    scan_request['modificationScan']['positions'] = [0, 1]
+    res = client.post(url_for('xi2annotator.annotate_modification_sites'), json=scan_request)
+    assert res.status_code == 400
+    assert res.json['error'] == 'Invalid positions for modification sda: [1]'
+    scan_request['modificationScan']['positions'] = [2, 0]
+    res = client.post(url_for('xi2annotator.annotate_modification_sites'), json=scan_request)
+    assert res.status_code == 200
+    assert sorted(p['position'] for p in res.json['placements']) == [0, 2]
+
+
+@pytest.mark.parametrize('peptide_id', [0, 1])
+def test_modification_placement_fragments(peptide_id):
+    """Test that the shared placement fragments equal the fragments of each placement."""
+    import numpy as np
+    from xi2annotator.annotation import get_annotation_setup, request_peptides, \
+        modification_scan_positions, modification_placement_fragments, setup_exact_peptide_db, \
+        create_fragments
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_QNCcmELFEQLGEYKFQNALLVR-KQTALVELVK_12-0_z4_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    config = request['annotation']['config']
+    config['modification']['modifications'].append(
+        {'specificity': ['S', 'T', 'Y', 'E'], 'name': 'ph', 'mass': 79.96633,
+         'type': 'variable'})
+    # a modification specific loss and a loss only of unmodified residues
+    config['fragmentation']['losses'].append(
+        {'specificity': ['phS', 'phT'], 'name': 'H3PO4', 'mass': 97.9769})
+
+    setup = get_annotation_setup(request['annotation'])
+    ctx = setup.create_context()
+    base_seqs, modifications = request_peptides(setup, request['Peptides'])
+    mod_id, other_mods, positions = modification_scan_positions(
+        setup, base_seqs[peptide_id], modifications[peptide_id],
+        {'peptideId': peptide_id, 'modification': 'ph'})
+    assert len(positions) > 1
+    modifications[peptide_id] = other_mods
+    link_pos = (12, 0)
+    placement_fragments = modification_placement_fragments(
+        setup, ctx, base_seqs, modifications, peptide_id, mod_id, positions, link_pos)
+
+    for position, fragments in zip(positions, placement_fragments):
+        placed = list(modifications)
+        placed[peptide_id] = other_mods + [(position + 2, mod_id)]
+        setup_exact_peptide_db(ctx, base_seqs, placed)
+        expected = create_fragments(setup, ctx, [0, 1], link_pos)
+        assert len(fragments) == len(expected)
+        columns = [c for c in expected.dtype.names if c != 'mz']
+        assert np.all(fragments[columns] == expected[columns])
+        np.testing.assert_allclose(fragments['mz'], expected['mz'], rtol=1e-12)
+
+
+def test_annotation_summary():
+    """Test the summary numbers of an annotation."""
+    import numpy as np
+    from xicommon import dtypes
+    from xicommon.spectra_reader import Spectrum
+    spectrum = Spectrum({'mz': None, 'charge': 1, 'intensity': -1},
+                        np.array([100., 200., 300., 400.]), np.array([1., 2., 3., 4.]), -1)
+    spectrum.isotope_cluster_peaks = np.array([(0, 0), (1, 1), (1, 2), (2, 3)],
+                                              dtype=dtypes.peak_cluster)
+    annotations = np.zeros(3, dtype=dtypes.annotations)
+    annotations['cluster_id'] = [1, 1, 2]
+    annotations['ion_type'] = [b'b', b'y', b'P']
+    annotations['term'] = [b'n', b'c', b'']
+    annotations['idx'] = [1, 2, 0]
+    annotations['pep_id'] = [1, 1, 1]
+    from xi2annotator.annotation import annotation_summary
+    summary = annotation_summary(annotations, spectrum, [5])
+    assert summary == {'matchedFragments': 3, 'matchedIntensityFraction': 0.9,
+                       'sequenceCoverage': 0.5, 'peptideCoverage': [0.5]}
+
+    summary = annotation_summary(annotations[:0], spectrum, [5, 3])
+    assert summary == {'matchedFragments': 0, 'matchedIntensityFraction': 0.0,
+                       'sequenceCoverage': 0.0, 'peptideCoverage': [0.0, 0.0]}
+
+
+def test_isotope_cache(client):
+    """Test that the isotope detected spectrum is reused for the same peaks and settings."""
+    from xi2annotator.annotation import isotope_cache
+    from xi2annotator.routes import response_cache
+    url = url_for('xi2annotator.annotate')
+    # don't answer from the response cache
+    response_cache.resize(0)
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi1_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    isotope_cache.clear()
+    res1 = client.post(url, json=copy.deepcopy(request))
+    # different link site and ions reuse the processed spectrum
+    request2 = copy.deepcopy(request)
+    request2['LinkSite'][1]['linkSite'] = 1
+    request2['annotation']['ions'] = [{'type': 'BIon'}, {'type': 'YIon'}]
+    client.post(url, json=request2)
+    res3 = client.post(url, json=copy.deepcopy(request))
+    assert isotope_cache.stats()['misses'] == 1
+    assert isotope_cache.stats()['hits'] == 2
+    assert res1.json == res3.json
+    check_result(res3.json, exp_simple_synthetic)
+
+    # cached arrays are read-only
+    spectrum = next(iter(isotope_cache._data.values()))
+    assert not spectrum.mz_values.flags.writeable
+    assert not spectrum.isotope_cluster_peaks.flags.writeable
+
+    # different precursor charge
+    request['annotation']['precursorCharge'] = 2
+    client.post(url, json=copy.deepcopy(request))
+    assert isotope_cache.stats()['misses'] == 2
+    # different fragment tolerance
+    request['annotation']['fragmentTolerance'] = {'tolerance': 20, 'unit': 'ppm'}
+    client.post(url, json=copy.deepcopy(request))
+    assert isotope_cache.stats()['misses'] == 3
+    # different peaks
+    request['peaks'][0]['intensity'] += 1
+    client.post(url, json=copy.deepcopy(request))
+    assert isotope_cache.stats()['misses'] == 4
+
+
+def test_response_cache_etag(client):
+    """Test the response cache and the ETag / If-None-Match handling of the FULL route."""
+    from xi2annotator.routes import response_cache
+    url = url_for('xi2annotator.annotate')
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    response_cache.clear()
+    res1 = client.post(url, json=request)
+    assert res1._status_code == 200
+    etag = res1.headers['ETag']
+    assert response_cache.stats()['misses'] == 1
+
+    # identical request (different key order) is answered from the cache
+    reordered = {k: request[k] for k in reversed(list(request.keys()))}
+    res2 = client.post(url, json=reordered)
+    assert res2._status_code == 200
+    assert res2.headers['ETag'] == etag
+    assert res2.get_data() == res1.get_data()
+    assert response_cache.stats()['hits'] == 1
+
+    # If-None-Match with the ETag returns 304 without body
+    res3 = client.post(url, json=request, headers={'If-None-Match': etag})
+    assert res3._status_code == 304
+    assert res3.get_data() == b''
+
+    # different request
+    request['annotation']['precursorCharge'] = 2
+    res4 = client.post(url, json=request, headers={'If-None-Match': etag})
+    assert res4._status_code == 200
+    assert res4.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('json_name', [
+    'xi1_format_AKT-KMR_1-0_z3_BS3.json',
+    'x1_format_KKK-KKR_1-1_z1_BS3_stubs.json',
+    'xi2_format_QNCcmELFEQLGEYKFQNALLVR-KQTALVELVK_12-0_z4_BS3.json',
+    'xi2_format_LAsdaK-TSR_z3_NAP.json',
+])
+def test_annotate_columnar_format(client, json_name):
+    """Test that the columnar fragments format holds the same values as the default format."""
+    url = url_for('xi2annotator.annotate')
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests', json_name)
+    with open(json_file) as f:
+        request = json.load(f)
+
+    exp = client.post(url, json=request).json['fragments']
+    # select columnar format by Accept header
+    res = client.post(url, json=request,
+                      headers={'Accept': 'application/vnd.xiannotator.columnar+json'})
+    assert res._status_code == 200
+    columnar = res.json['fragments']
+    assert res.json['annotation']['responseFormat'] == 'columnar'
+
+    assert len(columnar['name']) == len(exp)
+    for i, frag in enumerate(exp):
+        assert columnar['name'][i] == frag['name']
+        assert columnar['ionNumber'][i] == frag['ionNumber']
+        assert columnar['peptideId'][i] == frag['peptideId']
+        assert columnar['type'][i] == frag['type']
+        assert columnar['nlosses'][i] == frag['nlosses']
+        assert columnar['stub'][i] == frag['stub']
+        for r in frag['range']:
+            assert columnar['rangeFrom'][r['peptideId']][i] == r['from']
+            assert columnar['rangeTo'][r['peptideId']][i] == r['to']
+        matches = columnar['matches']
+        match_idx = [j for j, fi in enumerate(matches['fragmentIndex']) if fi == i]
+        assert [matches['clusterId'][j] for j in match_idx] == frag['clusterIds']
+        for j, info in zip(match_idx, frag['clusterInfo']):
+            assert matches['calcMZ'][j] == info['calcMZ']
+            assert matches['error'][j] == info['error']
+            assert matches['matchedCharge'][j] == info['matchedCharge']
+            assert matches['matchedMissingMonoIsotopic'][j] == info['matchedMissingMonoIsotopic']
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_annotate_executor(client, executor):
+    """Test the FULL route running in the bounded annotation executor."""
+    from xi2annotator.routes import response_cache
+    url = url_for('xi2annotator.annotate')
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    response_cache.resize(0)
+    expected = client.post(url, json=request)
+    assert expected._status_code == 200
+
+    executor_app = create_app({'ANNOTATION_EXECUTOR': executor, 'ANNOTATION_WORKERS': 1})
+    response_cache.resize(0)
+    try:
+        res = executor_app.test_client().post(url, json=request)
+        assert res._status_code == 200
+        assert res.get_data() == expected.get_data()
+        assert res.headers['ETag'] == expected.headers['ETag']
+    finally:
+        executor_app.extensions['xi2annotator.executor'].shutdown()
+
+
+def test_annotate_executor_busy():
+    """Test that requests are rejected with 503 and Retry-After if the executor is saturated."""
+    import threading
+    from xi2annotator.executor import ExecutorBusy
+    from xi2annotator.routes import response_cache
+
+    app = create_app({'ANNOTATION_EXECUTOR': 'thread', 'ANNOTATION_WORKERS': 1,
+                      'ANNOTATION_QUEUE_DEPTH': 1, 'ANNOTATION_RETRY_AFTER': 5})
+    response_cache.resize(0)
+    executor = app.extensions['xi2annotator.executor']
+    release = threading.Event()
+    try:
+        # occupy the worker and the queue slot
+        blocked = [executor.submit(release.wait) for _ in range(2)]
+        with pytest.raises(ExecutorBusy):
+            executor.submit(release.wait)
+
+        current_dir = os.path.dirname(__file__)
+        json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                                 'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+        with open(json_file) as f:
+            request = json.load(f)
+        with app.test_request_context():
+            url = url_for('xi2annotator.annotate')
+        res = app.test_client().post(url, json=request)
+        assert res._status_code == 503
+        assert res.headers['Retry-After'] == '5'
+        assert 'error' in res.get_json()
+
+        # slots are freed once the blocking submissions finished
+        release.set()
+        for future in blocked:
+            future.result()
+        assert executor.pending == 0
+        res = app.test_client().post(url, json=request)
+        assert res._status_code == 200
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_server_timing(client):
+    """Test the opt-in Server-Timing header of the FULL route."""
+    from xi2annotator.bench import parse_server_timing
+    from xi2annotator.routes import response_cache
+    url = url_for('xi2annotator.annotate')
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    response_cache.clear()
+    res = client.post(url, json=request)
+    assert 'Server-Timing' not in res.headers
+
+    response_cache.clear()
+    res = client.post(url + '?timing=1', json=request)
+    header = res.headers['Server-Timing']
+    durations = parse_server_timing(header)
+    assert list(durations) == ['parse', 'config', 'peptide_db', 'isotope_detection',
+                               'fragmentation', 'annotation', 'response', 'jsonify']
+    assert f'peaks;desc="{len(request["peaks"])}"' in header
+    res_json = res.get_json()
+    assert f'clusters;desc="{len(res_json["clusters"])}"' in header
+    assert 'fragments;desc="' in header
+    n_annotations = sum(len(f['clusterIds']) for f in res_json['fragments'])
+    assert f'annotations;desc="{n_annotations}"' in header
+
+    # enabled by header, cached responses are marked
+    res = client.post(url, json=request, headers={'X-Server-Timing': '1'})
+    assert 'cached;desc="1"' in res.headers['Server-Timing']
+    assert 'fragmentation' not in res.headers['Server-Timing']
+
+
+@pytest.mark.parametrize('query', ['', '?workers=3', '?workers=2&ordered=0'])
+def test_annotate_stream(client, query):
+    """Test the NDJSON streaming route."""
+    from xi2annotator.routes import response_cache
+    response_cache.resize(0)
+    current_dir = os.path.dirname(__file__)
+    requests = []
+    for json_name in ['xi1_format_AKT-KMR_1-0_z3_BS3.json',
+                      'xi2_format_QNCcmELFEQLGEYKFQNALLVR-KQTALVELVK_12-0_z4_BS3.json',
+                      'xi2_format_LAsdaK-TSR_z3_NAP.json',
+                      'xi2_format_AKT-KMR_1-0_z3_BS3.json']:
+        with open(os.path.join(current_dir, '../fixtures', 'annotation_requests', json_name)) as f:
+            requests.append(json.load(f))
+    requests[1]['id'] = 'custom'
+
+    lines = [json.dumps(r) for r in requests[:2]] + ['', '{"no": "request"}'] + \
+        [json.dumps(r) for r in requests[2:]]
+    res = client.post(url_for('xi2annotator.annotate_ndjson_stream') + query,
+                      data='\n'.join(lines) + '\n', content_type='application/x-ndjson')
+    assert res._status_code == 200
+    assert res.mimetype == 'application/x-ndjson'
+    assert res.is_streamed
+    responses = [json.loads(line) for line in res.get_data().splitlines()]
+    ids = [r['id'] for r in responses]
+    if 'ordered=0' in query:
+        assert sorted(ids, key=str) == sorted([0, 'custom', 2, 3, 4], key=str)
+    else:
+        assert ids == [0, 'custom', 2, 3, 4]
+
+    by_id = {r.pop('id'): r for r in responses}
+    assert 'error' in by_id[2]
+    for request_id, request in zip([0, 'custom', 3, 4], requests):
+        request.pop('id', None)
+        expected = client.post(url_for('xi2annotator.annotate'), json=request).get_json()
+        assert by_id[request_id] == expected
@@ -0,0 +1,121 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+import json
+import os
+import pytest
+from xi2annotator import create_app
+from xi2annotator.bench import DEFAULT_DATA_DIR, InProcessClient, load_bench_requests, \
+    parse_server_timing, run_bench, run_peak_cluster_bench, run_requests, summarize, \
+    tryptic_peptides
+from xi2annotator.psm import peptide_json
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../fixtures', 'load_test')
+
+
+def test_peptide_json():
+    peptide = peptide_json('MoxPCcmK', ['cm', 'ox'])
+    assert peptide == {'base_sequence': 'MPCK', 'modification_ids': [1, 0],
+                       'modification_positions': [1, 3]}
+    with pytest.raises(ValueError):
+        peptide_json('MphK', ['cm', 'ox'])
+
+
+def test_tryptic_peptides():
+    peptides = tryptic_peptides(['AAAAAKPAAAAKBBBBBBRCCCCCCR'], missed_cleavages=1)
+    # no cleavage before proline, non-standard amino acids are skipped
+    assert peptides == ['AAAAAKPAAAAK', 'CCCCCCR']
+
+
+def test_parse_server_timing():
+    assert parse_server_timing(None) == {}
+    assert parse_server_timing('config;dur=1.5, annotation;desc="x";dur=20, peaks') == {
+        'config': 0.0015, 'annotation': 0.02}
+
+
+def test_load_bench_requests():
+    crosslinked = load_bench_requests('crosslinked', DATA_DIR)
+    assert len(crosslinked) == 10
+    request = crosslinked[0]
+    assert request['Peptides'][0]['base_sequence'] == 'RPCFSALEVDETYVPK'
+    assert request['Peptides'][0]['modification_positions'] == [3]
+    assert [ls['linkSite'] for ls in request['LinkSite']] == [12, 1]
+    assert request['annotation']['precursorCharge'] == 4
+
+    linear = load_bench_requests('linear', DATA_DIR)
+    assert len(linear) == 10
+    assert all(len(r['Peptides']) == 1 and r['LinkSite'] == [] for r in linear)
+
+    mito = load_bench_requests('mito', DATA_DIR, limit=3)
+    assert len(mito) == 3
+    assert all(len(r['Peptides']) == 2 for r in mito)
+    # random candidates are reproducible
+    assert load_bench_requests('mito', DATA_DIR, limit=3) == mito
+
+
+def test_run_bench():
+    report = run_bench(['crosslinked', 'mito'], DATA_DIR, concurrency=2, limit=4,
+                       app=create_app())
+    for name in ['crosslinked', 'mito']:
+        summary = report['sets'][name]
+        assert summary['requests'] == 4
+        assert summary['errors'] == 0
+        assert summary['errorMessages'] == {}
+        assert summary['throughput'] > 0
+        assert set(summary['latencyMs']) == {'mean', 'p50', 'p95', 'p99', 'max'}
+        assert summary['latencyMs']['p50'] <= summary['latencyMs']['p99']
+        assert list(summary['stagesMs']) == ['parse', 'config', 'peptide_db', 'isotope_detection',
+                                             'fragmentation', 'annotation', 'response',
+                                             'jsonify']
+
+
+def test_default_data_dir(monkeypatch, tmp_path):
+    # the default data directory does not depend on the working directory
+    monkeypatch.chdir(tmp_path)
+    assert os.path.samefile(DEFAULT_DATA_DIR, DATA_DIR)
+    assert len(load_bench_requests('linear', limit=2)) == 2
+
+
+def test_run_requests_errors():
+    body = json.dumps(load_bench_requests('linear', DATA_DIR, limit=1)[0]).encode('utf-8')
+    results, errors, wall_time = run_requests(InProcessClient(create_app()),
+                                              [body, b'{"Peptides": []}', body, b'{'],
+                                              concurrency=2)
+    # failed requests are not measured but reported as errors
+    assert [r[0] for r in results] == [200, 200]
+    assert len(errors) == 2
+    assert errors[1].startswith('JSONDecodeError')
+    summary = summarize(results, errors, wall_time, 2)
+    assert summary['requests'] == 4
+    assert summary['errors'] == 2
+    assert sum(summary['errorMessages'].values()) == 2
+    assert summary['throughput'] == pytest.approx(2 / wall_time)
+
+
+def test_missing_data_dir(tmp_path):
+    with pytest.raises(FileNotFoundError, match='--data-dir'):
+        run_bench(['linear'], str(tmp_path / 'load_test'))
+
+
+def test_run_peak_cluster_bench():
+    report = run_peak_cluster_bench(DATA_DIR, peak_counts=[100, 500], repeat=1)
+    assert list(report['peakCounts']) == [100, 500]
+    for result in report['peakCounts'].values():
+        assert result['identical']
+        assert result['clusterPeaks'] > 0
+        assert result['vectorizedMs'] > 0
+        assert result['perPeakMs'] > 0
@@ -0,0 +1,76 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+
+import numpy as np
+from xi2annotator.cache import LRUCache, array_nbytes, canonical_hash
+
+
+def test_canonical_hash():
+    assert canonical_hash({'a': 1, 'b': [1, 2]}) == canonical_hash({'b': [1, 2], 'a': 1})
+    assert canonical_hash({'a': 1}) != canonical_hash({'a': 2})
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    # mark a as recently used
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.get('b') is None
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 1
+
+    # disabled cache
+    cache.resize(0)
+    assert len(cache) == 0
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+def test_lru_cache_byte_limit():
+    cache = LRUCache(maxsize=10, max_bytes=180, sizeof=array_nbytes)
+    cache.put('a', np.zeros(10))
+    cache.put('b', (np.zeros(5), np.zeros(5)))
+    assert cache.stats()['bytes'] == 160
+    # evicts a
+    cache.put('c', np.zeros(5))
+    assert 'a' not in cache
+    assert cache.stats()['bytes'] == 120
+    # replacing an entry doesn't count twice
+    cache.put('c', np.zeros(5))
+    assert cache.stats()['bytes'] == 120
+    # too large values are not stored
+    cache.put('d', np.zeros(100))
+    assert 'd' not in cache
+    assert len(cache) == 2
+
+
+def test_lru_cache_ttl(monkeypatch):
+    import time
+    now = time.monotonic()
+    cache = LRUCache(maxsize=10, ttl=10)
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert cache.get('a') is None
+    assert 'a' not in cache
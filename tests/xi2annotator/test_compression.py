@@ -0,0 +1,143 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+import gzip
+import json
+import os
+import pytest
+from flask import url_for
+from xi2annotator import create_app
+from xi2annotator.metrics import response_size
+
+request_file = os.path.join(os.path.dirname(__file__), '../fixtures', 'annotation_requests',
+                            'xi1_format_AKT-KMR_1-0_z3_BS3.json')
+
+
+@pytest.fixture
+def app():
+    app = create_app({'RESPONSE_CACHE_SIZE': 0})
+    return app
+
+
+def load_request():
+    with open(request_file, 'rb') as f:
+        return f.read()
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(data)
+    if encoding == 'zstd':
+        zstandard = pytest.importorskip('zstandard')
+        return zstandard.ZstdCompressor().compress(data)
+    brotli = pytest.importorskip('brotli')
+    return brotli.compress(data)
+
+
+def decompress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'zstd':
+        zstandard = pytest.importorskip('zstandard')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    brotli = pytest.importorskip('brotli')
+    return brotli.decompress(data)
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'zstd', 'br'])
+def test_compressed_request(client, encoding):
+    """Test that compressed request bodies are decoded."""
+    url = url_for('xi2annotator.annotate')
+    data = load_request()
+    expected = client.post(url, data=data, content_type='application/json')
+    res = client.post(url, data=compress(data, encoding), content_type='application/json',
+                      headers={'Content-Encoding': encoding})
+    assert res.status_code == 200
+    assert res.json == expected.json
+
+
+def test_compressed_request_invalid(client):
+    """Test that corrupt and unsupported request encodings are rejected."""
+    url = url_for('xi2annotator.annotate')
+    data = load_request()
+    res = client.post(url, data=data, content_type='application/json',
+                      headers={'Content-Encoding': 'gzip'})
+    assert res.status_code == 400
+    res = client.post(url, data=data, content_type='application/json',
+                      headers={'Content-Encoding': 'compress'})
+    assert res.status_code == 415
+
+
+def test_compressed_request_too_large(app):
+    """Test the limit of the decompressed request size."""
+    app.wsgi_app.max_size = 1000
+    data = load_request()
+    with app.test_request_context():
+        url = url_for('xi2annotator.annotate')
+    res = app.test_client().post(url, data=gzip.compress(data),
+                                 content_type='application/json',
+                                 headers={'Content-Encoding': 'gzip'})
+    assert res.status_code == 413
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'zstd', 'br'])
+def test_compressed_response(client, encoding):
+    """Test the negotiated compression of the FULL responses."""
+    url = url_for('xi2annotator.annotate')
+    data = load_request()
+    expected = client.post(url, data=data, content_type='application/json')
+    assert 'Content-Encoding' not in expected.headers
+    etag = expected.headers['ETag']
+
+    response_size.clear()
+    res = client.post(url, data=data, content_type='application/json',
+                      headers={'Accept-Encoding': f'{encoding}, identity;q=0.5'})
+    assert res.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in res.headers['Vary']
+    assert res.headers['ETag'] == 'W/' + etag
+    assert len(res.data) < len(expected.data)
+    assert json.loads(decompress(res.data, encoding)) == expected.json
+    # the metrics record the transferred size
+    assert response_size.get(route='annotate') == (1, len(res.data))
+
+    # the weak ETag of a compressed response is accepted for If-None-Match
+    res = client.post(url, data=data, content_type='application/json',
+                      headers={'Accept-Encoding': encoding, 'If-None-Match': res.headers['ETag']})
+    assert res.status_code == 304
+
+
+def test_compressed_response_threshold(app, client):
+    """Test that small responses and clients not accepting an encoding are not compressed."""
+    res = client.get('/ready', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in res.headers
+    res = client.post(url_for('xi2annotator.annotate'), data=load_request(),
+                      content_type='application/json', headers={'Accept-Encoding': 'compress'})
+    assert 'Content-Encoding' not in res.headers
+    assert 'Accept-Encoding' in res.headers['Vary']
+
+
+def test_compressed_stream(client):
+    """Test the compression of the NDJSON stream responses."""
+    url = url_for('xi2annotator.annotate_ndjson_stream')
+    line = json.dumps(json.loads(load_request())).encode() + b'\n'
+    res = client.post(url, data=gzip.compress(line * 3), content_type='application/x-ndjson',
+                      headers={'Content-Encoding': 'gzip', 'Accept-Encoding': 'gzip'})
+    assert res.status_code == 200
+    assert res.headers['Content-Encoding'] == 'gzip'
+    responses = [json.loads(r) for r in gzip.decompress(res.data).splitlines()]
+    assert [r['id'] for r in responses] == [0, 1, 2]
+    assert all('fragments' in r for r in responses)
@@ -0,0 +1,86 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+
+import copy
+import json
+import os
+import numpy as np
+import pytest
+from xi2annotator import create_app
+from xi2annotator.json_provider import NumpyJSONProvider, numpy_default, orjson
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    return app
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_numpy_values(app, use_orjson):
+    if use_orjson and orjson is None:
+        pytest.skip('orjson not installed')
+    provider = NumpyJSONProvider(app, use_orjson=use_orjson)
+    obj = {
+        'b': np.float64(1.5),
+        'a': np.uint16(3),
+        'c': np.array([1, 2], dtype=np.int16),
+        'd': np.bool_(True),
+        'e': np.array([[1.5, 2.5]])[:, 0],
+        'f': [np.uint8(1), 2.5]
+    }
+    assert provider.dumps_bytes(obj) == b'{"a":3,"b":1.5,"c":[1,2],"d":true,"e":[1.5],"f":[1,2.5]}'
+    assert provider.loads(provider.dumps(obj)) == provider.loads(provider.dumps_bytes(obj))
+    # non-compact representation
+    assert json.loads(provider.dumps_bytes(obj, indent=True)) == json.loads(
+        provider.dumps_bytes(obj))
+
+
+def test_stdlib_fallback_matches_json(app):
+    provider = NumpyJSONProvider(app, use_orjson=False)
+    obj = {'x': 1e-05, 'y': [1, 2, 3], 'z': 'é'}
+    assert provider.dumps_bytes(obj) == json.dumps(
+        obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def test_response(app):
+    with app.app_context():
+        res = app.json.response({'a': np.arange(3)})
+        assert res.mimetype == 'application/json'
+        assert json.loads(res.get_data()) == {'a': [0, 1, 2]}
+        assert res.get_data().endswith(b'\n')
+
+
+@pytest.mark.parametrize('fixture', ['xi1_format_LAsdaK-TSR_z3_NAP.json',
+                                     'xi2_format_LAsdaK-TSR_z3_NAP.json'])
+def test_full_response_bytes(app, fixture):
+    """Test that the FULL responses are byte-identical to the standard library output."""
+    from xi2annotator.annotation import annotate_json
+    from xi2annotator.routes import response_cache
+    current_dir = os.path.dirname(__file__)
+    with open(os.path.join(current_dir, '../fixtures', 'annotation_requests', fixture)) as f:
+        request = json.load(f)
+    expected = json.dumps(annotate_json(copy.deepcopy(request)), default=numpy_default,
+                          sort_keys=True, separators=(',', ':')).encode('utf-8') + b'\n'
+    # small floats are written in exponent notation
+    assert b'e-05' in expected
+
+    response_cache.resize(0)
+    res = app.test_client().post('/xiAnnotator/annotate/FULL', json=request)
+    assert res.status_code == 200
+    assert res.get_data() == expected
@@ -0,0 +1,126 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+import json
+import os
+import threading
+import pytest
+from flask import url_for
+from xi2annotator import create_app
+from xi2annotator.metrics import Counter, Histogram, registry, requests_total, \
+    request_errors, requests_in_flight, stage_duration
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    return app
+
+
+def test_histogram_render():
+    histogram = Histogram('test_seconds', 'Test histogram.', ('route',), buckets=(0.1, 1))
+    histogram.observe(0.05, route='a')
+    histogram.observe(0.5, route='a')
+    histogram.observe(5, route='a')
+    assert histogram.get(route='a') == (3, 5.55)
+    assert histogram.render() == [
+        '# HELP test_seconds Test histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{route="a",le="0.1"} 1',
+        'test_seconds_bucket{route="a",le="1.0"} 2',
+        'test_seconds_bucket{route="a",le="+Inf"} 3',
+        'test_seconds_sum{route="a"} 5.55',
+        'test_seconds_count{route="a"} 3',
+    ]
+
+
+def test_counter_threads():
+    counter = Counter('test_total', 'Test counter.', ('route',))
+
+    def count():
+        for _ in range(1000):
+            counter.inc(route='a')
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counter.get(route='a') == 8000
+
+
+def test_metrics_endpoint(client):
+    from xi2annotator.routes import response_cache
+    registry.clear()
+    response_cache.resize(0)
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    url = url_for('xi2annotator.annotate')
+    assert client.post(url, json=request)._status_code == 200
+    assert client.post(url, data='no json')._status_code == 400
+
+    assert requests_total.get(route='annotate', status=200) == 1
+    assert requests_total.get(route='annotate', status=400) == 1
+    assert request_errors.get(route='annotate') == 1
+    assert requests_in_flight.get(route='annotate') == 0
+    for stage in ['parse', 'config', 'peptide_db', 'isotope_detection', 'fragmentation',
+                  'annotation', 'response', 'jsonify']:
+        assert stage_duration.get(route='annotate', stage=stage)[0] == 1
+
+    res = client.get('/metrics')
+    assert res._status_code == 200
+    assert res.content_type.startswith('text/plain')
+    text = res.get_data(as_text=True)
+    assert 'xi2annotator_requests_total{route="annotate",status="200"} 1' in text
+    assert 'xi2annotator_request_duration_seconds_count{route="annotate"} 2' in text
+    assert 'xi2annotator_stage_duration_seconds_count{route="annotate",stage="fragmentation"} 1' \
+        in text
+    assert 'xi2annotator_request_size_bytes_count{route="annotate"} 2' in text
+    # the metrics endpoint itself is not recorded
+    assert 'route="metrics"' not in text
+
+
+def test_cache_metrics(client):
+    """Test that the hits, misses and sizes of the caches are exported."""
+    from xi2annotator.cache import fragment_cache, isotope_cache, setup_cache
+    from xi2annotator.routes import response_cache
+    for cache in (fragment_cache, isotope_cache, setup_cache, response_cache):
+        cache.clear()
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    url = url_for('xi2annotator.annotate')
+    assert client.post(url, json=request)._status_code == 200
+    assert client.post(url, json=request)._status_code == 200
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE xi2annotator_cache_hits gauge' in text
+    assert 'xi2annotator_cache_hits{cache="response"} 1' in text
+    assert 'xi2annotator_cache_misses{cache="response"} 1' in text
+    assert 'xi2annotator_cache_entries{cache="response"} 1' in text
+    for cache in ('setup', 'fragment', 'isotope'):
+        assert f'xi2annotator_cache_misses{{cache="{cache}"}} 1' in text
+        assert f'xi2annotator_cache_entries{{cache="{cache}"}} 1' in text
+    assert f'xi2annotator_cache_bytes{{cache="fragment"}} {fragment_cache.nbytes}' in text
@@ -0,0 +1,82 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+
+"""
+Tests of the vectorized peak to isotope cluster mapping against the per-peak ``np.where`` lookup.
+
+The timings of both mappings are reported by ``python -m xi2annotator bench-peak-clusters``.
+"""
+import os
+from itertools import islice
+import numpy as np
+import pytest
+from xicommon.config import Config
+from xicommon.filters import IsotopeDetector
+from xicommon.mock_context import MockContext
+from xicommon.spectra_reader import Spectrum
+from xi2annotator.annotation import peak_cluster_ids, cluster_first_peak_ids
+from xi2annotator.bench import concatenated_peaks, peak_cluster_ids_per_peak
+from xi2annotator.psm import iter_spectra
+
+load_test_dir = os.path.join(os.path.dirname(__file__), '../fixtures', 'load_test')
+config = Config(ms2_tol='20 ppm')
+
+
+def read_spectra(mgf_file, n_spectra):
+    """Read the first n_spectra spectra of a load test MGF."""
+    return list(islice(iter_spectra(os.path.join(load_test_dir, mgf_file), config), n_spectra))
+
+
+def process(mz_array, int_array, charge=4):
+    ctx = MockContext(config)
+    spectrum = Spectrum({'mz': None, 'charge': charge, 'intensity': -1}, mz_array, int_array, -1)
+    return IsotopeDetector(ctx).process(spectrum)
+
+
+@pytest.mark.parametrize('mgf_file', ['1_HSA_SDA_AB_load_test_large.mgf',
+                                      '3_ecoli_BS3_LS_load_test_large.mgf'])
+def test_peak_cluster_ids(mgf_file):
+    for spectrum in read_spectra(mgf_file, 20):
+        processed = process(spectrum.mz_values, spectrum.int_values,
+                            spectrum.precursor['charge'])
+        n_peaks = len(processed.mz_values)
+        assert peak_cluster_ids(processed.isotope_cluster_peaks, n_peaks) == \
+            peak_cluster_ids_per_peak(processed.isotope_cluster_peaks, n_peaks)
+        first_peaks = cluster_first_peak_ids(processed.isotope_cluster_peaks)
+        assert len(first_peaks) == len(processed.isotope_cluster_charge_values)
+        for cid, pid in enumerate(first_peaks):
+            assert pid == processed.isotope_cluster_peaks['peak_id'][
+                processed.isotope_cluster_peaks['cluster_id'] == cid][0]
+
+
+def test_empty_spectrum():
+    processed = process(np.array([]), np.array([]))
+    assert peak_cluster_ids(processed.isotope_cluster_peaks, 0) == []
+    assert len(cluster_first_peak_ids(processed.isotope_cluster_peaks)) == 0
+
+
+@pytest.mark.parametrize('n_peaks', [250, 2500])
+def test_peak_cluster_ids_many_peaks(n_peaks):
+    mz_array, int_array = concatenated_peaks(
+        os.path.join(load_test_dir, '1_HSA_SDA_AB_load_test_large.mgf'), n_peaks, config)
+    processed = process(mz_array, int_array)
+    peaks = processed.isotope_cluster_peaks
+    # peaks in several clusters are mapped to all of them
+    assert len(peaks) > 0
+    assert len(np.unique(peaks['peak_id'])) < len(peaks)
+    assert peak_cluster_ids(peaks, n_peaks) == peak_cluster_ids_per_peak(peaks, n_peaks)
@@ -0,0 +1,134 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+import glob
+import json
+import os
+import pstats
+import pytest
+from xi2annotator import create_app
+from xi2annotator.profiling import RequestProfiler
+
+
+def load_request():
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        return json.load(f)
+
+
+def test_profile_every_nth_request(tmp_path):
+    from xi2annotator.routes import response_cache
+    app = create_app({'PROFILE_DIR': str(tmp_path), 'PROFILE_EVERY': 2})
+    response_cache.resize(0)
+    client = app.test_client()
+    request = load_request()
+    for _ in range(3):
+        assert client.post('/xiAnnotator/annotate/FULL', json=request)._status_code == 200
+
+    profiles = glob.glob(str(tmp_path / '*_sampled_*.prof'))
+    assert len(profiles) == 1
+    # the request is written next to the profile
+    with open(profiles[0][:-len('.prof')] + '.json') as f:
+        assert json.load(f) == request
+    stats = pstats.Stats(profiles[0])
+    assert any(func[2] == 'annotate_json' for func in stats.stats)
+
+
+def test_profile_slow_requests(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), slower_than=0.0, slow_samples=1)
+
+    def annotate(json_request, factor=1):
+        result = {'sum': sum(json_request['values']) * factor}
+        json_request['values'] = None
+        return result
+
+    # the slow call arms the profiling of the next call
+    assert profiler.run(annotate, {'values': [1, 2, 3]}, factor=2) == {'sum': 12}
+    assert glob.glob(str(tmp_path / '*.prof')) == []
+    assert profiler.run(annotate, {'values': [4]}, factor=2) == {'sum': 8}
+    profiles = glob.glob(str(tmp_path / '*_slow_*.prof'))
+    assert len(profiles) == 1
+    # the unmodified request is dumped
+    with open(profiles[0][:-len('.prof')] + '.json') as f:
+        assert json.load(f) == {'values': [4]}
+    stats = pstats.Stats(profiles[0])
+    assert any(func[2] == 'annotate' for func in stats.stats)
+
+    # profiled calls that turn out fast are not dumped
+    profiler.slower_than = 60
+    profiler.armed = 1
+    profiler.run(annotate, {'values': [1]})
+    assert profiler.armed == 0
+    assert len(glob.glob(str(tmp_path / '*.prof'))) == 1
+
+
+def test_profile_slow_request_cold_caches(tmp_path):
+    """Test that the profile of a slow request shows the work of the request as it ran."""
+    from xi2annotator.cache import fragment_cache, isotope_cache
+    from xi2annotator.routes import response_cache
+    app = create_app({'PROFILE_DIR': str(tmp_path), 'PROFILE_SLOWER_THAN': 0.0,
+                      'PROFILE_SLOW_SAMPLES': 1})
+    response_cache.resize(0)
+    client = app.test_client()
+    request = load_request()
+    assert client.post('/xiAnnotator/annotate/FULL', json=request).status_code == 200
+    fragment_cache.clear()
+    isotope_cache.clear()
+    assert client.post('/xiAnnotator/annotate/FULL', json=request).status_code == 200
+
+    profiles = glob.glob(str(tmp_path / '*_slow_*.prof'))
+    assert len(profiles) == 1
+    functions = {(os.path.basename(func[0]), func[2]) for func in pstats.Stats(profiles[0]).stats}
+    # fragmentation and isotope detection ran without cache
+    assert ('annotation.py', 'create_fragments') in functions
+    assert ('isotope_detector.py', 'process') in functions
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_profile_executor(tmp_path, executor):
+    """Test that annotations running in the executor are profiled."""
+    from xi2annotator.routes import response_cache
+    app = create_app({'PROFILE_DIR': str(tmp_path), 'PROFILE_EVERY': 1,
+                      'ANNOTATION_EXECUTOR': executor, 'ANNOTATION_WORKERS': 1})
+    response_cache.resize(0)
+    try:
+        res = app.test_client().post('/xiAnnotator/annotate/FULL', json=load_request())
+        assert res.status_code == 200
+    finally:
+        app.extensions['xi2annotator.executor'].shutdown()
+    profiles = glob.glob(str(tmp_path / '*_sampled_*.prof'))
+    assert len(profiles) == 1
+    stats = pstats.Stats(profiles[0])
+    assert any(func[2] == 'annotate_json' for func in stats.stats)
+
+
+def test_profile_disk_cap(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), every=1, max_bytes=0)
+    profiler.run(lambda r: r, {'values': [1]})
+    assert profiler.dumps == 1
+    assert os.listdir(tmp_path) == []
+
+    profiler.max_bytes = 10 ** 9
+    for i in range(3):
+        profiler.run(lambda r: r, {'values': [i]})
+    assert len(os.listdir(tmp_path)) == 6
+    size = sum(os.path.getsize(tmp_path / f) for f in os.listdir(tmp_path))
+    profiler.max_bytes = size - 1
+    profiler.enforce_disk_cap()
+    assert 0 < sum(os.path.getsize(tmp_path / f) for f in os.listdir(tmp_path)) < size
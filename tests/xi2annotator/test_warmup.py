@@ -0,0 +1,66 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+import json
+import os
+from xi2annotator import create_app
+
+
+def test_ready_after_warmup():
+    app = create_app({'WARMUP': True})
+    startup = app.extensions['xi2annotator.startup']
+    assert startup.ready.wait(60)
+    client = app.test_client()
+    res = client.get('/ready')
+    assert res._status_code == 200
+    report = res.get_json()
+    assert report['ready']
+    assert 'warmupError' not in report
+    assert report['warmupTime'] > 0
+    assert report['importTime'] > 0
+    assert report['timeToFirstRequest'] is None
+
+    current_dir = os.path.dirname(__file__)
+    json_file = os.path.join(current_dir, '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+    assert client.post('/xiAnnotator/annotate/FULL', json=request)._status_code == 200
+    first_request_time = client.get('/ready').get_json()['timeToFirstRequest']
+    assert first_request_time > report['importTime']
+    # only the first request is recorded
+    client.post('/xiAnnotator/annotate/FULL', json=request)
+    assert client.get('/ready').get_json()['timeToFirstRequest'] == first_request_time
+
+
+def test_not_ready_during_warmup(tmp_path):
+    app = create_app()
+    startup = app.extensions['xi2annotator.startup']
+    # without warm-up the app is ready immediately
+    assert startup.ready.is_set()
+
+    startup.ready.clear()
+    client = app.test_client()
+    res = client.get('/ready')
+    assert res._status_code == 503
+    assert not res.get_json()['ready']
+
+    # a failing warm-up is reported but makes the app ready
+    startup.warm_up(str(tmp_path / 'missing.json'))
+    res = client.get('/ready')
+    assert res._status_code == 200
+    assert 'missing.json' in res.get_json()['warmupError']
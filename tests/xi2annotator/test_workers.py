@@ -0,0 +1,96 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+
+import json
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+import urllib.request
+import pytest
+from xi2annotator import create_app
+from xi2annotator.workers import WorkerSupervisor, create_listen_socket
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post(port, request):
+    req = urllib.request.Request(f'http://127.0.0.1:{port}/xiAnnotator/annotate/FULL',
+                                 data=json.dumps(request).encode(),
+                                 headers={'Content-Type': 'application/json'})
+    end = time.monotonic() + 30
+    while True:
+        try:
+            with urllib.request.urlopen(req, timeout=30) as res:
+                return res.status, json.loads(res.read())
+        except (ConnectionError, urllib.error.URLError):
+            if time.monotonic() > end:
+                raise
+            time.sleep(0.2)
+
+
+def test_workers():
+    """Test serving with several worker processes, restarting crashed workers and shutdown."""
+    json_file = os.path.join(os.path.dirname(__file__), '../fixtures', 'annotation_requests',
+                             'xi2_format_AKT-KMR_1-0_z3_BS3.json')
+    with open(json_file) as f:
+        request = json.load(f)
+
+    port = free_port()
+    supervisor = WorkerSupervisor(create_app, create_listen_socket('127.0.0.1', port), 2)
+    results = queue.Queue()
+
+    def client():
+        try:
+            results.put(post(port, request))
+            # crashed workers are restarted
+            pids = list(supervisor.children)
+            os.kill(pids[0], signal.SIGKILL)
+            end = time.monotonic() + 30
+            while len(set(supervisor.children) - set(pids)) == 0 and time.monotonic() < end:
+                time.sleep(0.1)
+            results.put(sorted(supervisor.children) != sorted(pids))
+            results.put(post(port, request))
+        finally:
+            # graceful shutdown
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    handlers = {s: signal.getsignal(s) for s in [signal.SIGTERM, signal.SIGINT, signal.SIGALRM]}
+    threading.Thread(target=client, daemon=True).start()
+    try:
+        supervisor.run()
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+
+    assert supervisor.stopping
+    assert len(supervisor.children) == 0
+    status, res = results.get_nowait()
+    assert status == 200
+    assert len(res['fragments']) > 0
+    assert results.get_nowait()
+    status, _ = results.get_nowait()
+    assert status == 200
@@ -15,9 +15,14 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
 # USA
 
+import time
+IMPORT_START = time.perf_counter()
+
 from xi2annotator.app import *
 from xi2annotator.config import *
 from flask import Blueprint
 
 bp = Blueprint('xi2annotator', __name__)
 from xi2annotator import routes
+
+IMPORT_TIME = time.perf_counter() - IMPORT_START
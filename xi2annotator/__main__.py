@@ -19,24 +19,158 @@
 Main entry point for xi2annotator web service.
 """
 import argparse
+import functools
+import json
+import sys
 from waitress import serve
 
 
+def bench(args):
+    """Run the annotation benchmark and write the JSON report."""
+    from xi2annotator.bench import check_data_dir, run_bench
+    try:
+        check_data_dir(args.data_dir)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    report = run_bench(args.sets, data_dir=args.data_dir, url=args.url,
+                       concurrency=args.concurrency, repeat=args.repeat, limit=args.limit,
+                       warmup=args.warmup)
+    write_report(report, args.output)
+
+
+def bench_peak_clusters(args):
+    """Run the peak to isotope cluster mapping benchmark and write the JSON report."""
+    from xi2annotator.bench import check_data_dir, run_peak_cluster_bench
+    try:
+        check_data_dir(args.data_dir)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    report = run_peak_cluster_bench(args.data_dir, args.peak_counts, args.repeat)
+    write_report(report, args.output)
+
+
+def write_report(report, output):
+    """
+    Write a benchmark report as JSON.
+
+    :param report: (dict) benchmark report
+    :param output: (str) file to write the report to (stdout if None)
+    """
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+def annotate_file(args):
+    """Annotate the PSMs of a result CSV and write the NDJSON responses."""
+    from xi2annotator.annotate_file import annotate_file as run_annotate_file
+    if args.output:
+        with open(args.output, 'wb') as output:
+            stats = run_annotate_file(args.mgf, args.csv, args.config, output, args.workers,
+                                      response_format=args.response_format,
+                                      peaks_format=args.peaks_format)
+    else:
+        stats = run_annotate_file(args.mgf, args.csv, args.config, sys.stdout.buffer,
+                                  args.workers, response_format=args.response_format,
+                                  peaks_format=args.peaks_format)
+    sys.stderr.write(f"Annotated {stats['annotated']} PSMs, {stats['missing_spectra']} PSMs "
+                     f"without spectrum\n")
+
+
 def main():
     """Run the annotation web service."""
+    from xi2annotator.bench import BENCH_SETS, DEFAULT_DATA_DIR, PEAK_COUNTS
+
     parser = argparse.ArgumentParser(description='XiAnnotator web service')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to (default: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=8084, help='Port to bind to (default: 8084)')
     parser.add_argument('--debug', action='store_true', help='Run in debug mode (Flask dev server)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes sharing the port (default: 1)')
+    parser.add_argument('--no-warmup', action='store_true',
+                        help='Skip the warm-up annotation at startup')
+    subparsers = parser.add_subparsers(dest='command')
+
+    bench_parser = subparsers.add_parser(
+        'bench', help='Benchmark the annotation with the load test data sets')
+    bench_parser.add_argument('--sets', nargs='+', choices=list(BENCH_SETS),
+                              default=['crosslinked', 'linear'],
+                              help='Data sets to run (default: crosslinked linear)')
+    bench_parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                              help=f'Directory of the load test files (default in a source '
+                                   f'checkout: {DEFAULT_DATA_DIR})')
+    bench_parser.add_argument('--url', default=None,
+                              help='Base URL of a running server (default: in-process app)')
+    bench_parser.add_argument('--concurrency', type=int, default=1,
+                              help='Number of concurrent requests (default: 1)')
+    bench_parser.add_argument('--repeat', type=int, default=1,
+                              help='Number of times each request is run (default: 1)')
+    bench_parser.add_argument('--limit', type=int, default=None,
+                              help='Maximal number of requests per data set (default: all)')
+    bench_parser.add_argument('--warmup', type=int, default=1,
+                              help='Number of unmeasured warm-up requests per set (default: 1)')
+    bench_parser.add_argument('--output', default=None,
+                              help='File to write the JSON report to (default: stdout)')
+
+    peak_bench_parser = subparsers.add_parser(
+        'bench-peak-clusters',
+        help='Benchmark the vectorized peak to isotope cluster mapping against a per-peak lookup')
+    peak_bench_parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                                   help=f'Directory of the load test files (default in a source '
+                                        f'checkout: {DEFAULT_DATA_DIR})')
+    peak_bench_parser.add_argument('--peak-counts', nargs='+', type=int, default=PEAK_COUNTS,
+                                   help=f'Numbers of peaks (default: '
+                                        f'{" ".join(map(str, PEAK_COUNTS))})')
+    peak_bench_parser.add_argument('--repeat', type=int, default=5,
+                                   help='Number of runs of each mapping (default: 5)')
+    peak_bench_parser.add_argument('--output', default=None,
+                                   help='File to write the JSON report to (default: stdout)')
+
+    file_parser = subparsers.add_parser(
+        'annotate-file', help='Annotate the PSMs of a result CSV with the spectra of a MGF file')
+    file_parser.add_argument('mgf', help='MGF peak list file')
+    file_parser.add_argument('csv', help='PSM result CSV file (xi/xiFDR format)')
+    file_parser.add_argument('config', help='xi2 config JSON file')
+    file_parser.add_argument('--output', '-o', default=None,
+                             help='NDJSON file to write the responses to (default: stdout)')
+    file_parser.add_argument('--workers', type=int, default=None,
+                             help='Number of worker processes (default: number of CPUs)')
+    file_parser.add_argument('--response-format', choices=['columnar'], default=None,
+                             help='Use the columnar fragments response format')
+    file_parser.add_argument('--peaks-format', choices=['full', 'compact', 'none'],
+                             default=None,
+                             help='Format of the echoed peaks (default: full)')
     args = parser.parse_args()
 
+    if args.command == 'bench':
+        bench(args)
+        return
+    if args.command == 'bench-peak-clusters':
+        bench_peak_clusters(args)
+        return
+    if args.command == 'annotate-file':
+        annotate_file(args)
+        return
+
+    import xi2annotator
     from xi2annotator.app import create_app
-    app = create_app()
+    print(f"Imported xi2annotator in {xi2annotator.IMPORT_TIME:.3f}s", flush=True)
+    app_factory = functools.partial(create_app, {'WARMUP': not args.no_warmup})
 
     if args.debug:
+        app = app_factory()
         print(f"Starting debug server on {args.host}:{args.port}")
         app.run(host=args.host, port=args.port, debug=True)
+    elif args.workers > 1:
+        from xi2annotator.workers import serve_workers
+        print(f"Starting production server on {args.host}:{args.port} with {args.workers} "
+              f"workers", flush=True)
+        serve_workers(app_factory, args.host, args.port, args.workers)
     else:
+        app = app_factory()
         print(f"Starting production server on {args.host}:{args.port}")
         serve(app, host=args.host, port=args.port)
 
@@ -0,0 +1,150 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Offline annotation of the PSMs of a xi result CSV with the spectra of a MGF file.
+
+The PSMs are joined to the spectra by run name and scan number while the MGF is streamed.
+The annotations run in a process pool, the config is sent once to each worker process
+(initializer) and the spectra are sent as NumPy arrays, so only the peptides and the raw peak
+buffers are pickled per task. The NDJSON responses are written incrementally in MGF order.
+"""
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from xicommon.config import Config
+from xi2annotator.annotation import get_annotation_setup, annotate_json, is_debug
+from xi2annotator.json_provider import dumps_bytes
+from xi2annotator.psm import read_psms, iter_spectra, psm_key, psm_peptides
+
+# annotation setup and context of a worker process
+_worker = {}
+
+
+def init_worker(annotation_json):
+    """
+    Initialise a worker process with the shared annotation block.
+
+    :param annotation_json: (dict) annotation block (config, returnModSyntax, ...) shared by
+        all requests
+    """
+    setup = get_annotation_setup(annotation_json)
+    _worker['annotation'] = annotation_json
+    _worker['setup'] = setup
+    _worker['ctx'] = setup.create_context()
+
+
+def annotate_task(task):
+    """
+    Annotate a single PSM in a worker process.
+
+    :param task: (tuple) id, peptides, link sites, precursor charge, precursor m/z, m/z array
+        and intensity array of the PSM
+    :return: serialized NDJSON response line
+    :rtype: bytes
+    """
+    psm_id, peptides, link_sites, charge, precursor_mz, mz_array, int_array = task
+    try:
+        json_request = {
+            'id': psm_id,
+            'Peptides': peptides,
+            'LinkSite': [{'id': 0, 'peptideId': i, 'linkSite': site}
+                         for i, site in enumerate(link_sites)],
+            'peaks': (mz_array, int_array),
+            'annotation': {**_worker['annotation'], 'precursorCharge': charge,
+                           'precursorMZ': precursor_mz},
+        }
+        response = annotate_json(json_request, _worker['setup'], _worker['ctx'])
+    except Exception as e:
+        response = {'id': psm_id, 'error': str(e)}
+        if is_debug():
+            import traceback
+            response['stacktrace'] = traceback.format_exc()
+    return dumps_bytes(response) + b'\n'
+
+
+def psm_tasks(psms, spectra, config_json, stats):
+    """
+    Join the PSMs to the streamed spectra and create the annotation tasks.
+
+    :param psms: (list of dict) PSM rows of a xi result CSV
+    :param spectra: (iterable of Spectrum) spectra of the MGF file
+    :param config_json: (dict) xi2 config
+    :param stats: (dict) counts of the tasks (updated)
+    :return: generator of tasks for annotate_task
+    """
+    psms_by_key = {}
+    for psm in psms:
+        psms_by_key.setdefault(psm_key(psm), []).append(psm)
+    for spectrum in spectra:
+        for psm in psms_by_key.pop((spectrum.run_name, spectrum.scan_number), []):
+            peptides, link_sites = psm_peptides(psm, config_json)
+            charge = int(psm['Charge']) if psm.get('Charge') else spectrum.precursor_charge
+            stats['annotated'] += 1
+            yield (psm.get('PSMID', stats['annotated'] - 1), peptides, link_sites, charge,
+                   float(spectrum.precursor_mz), spectrum.mz_values, spectrum.int_values)
+    stats['missing_spectra'] = sum(len(p) for p in psms_by_key.values())
+
+
+def annotate_file(mgf_path, csv_path, config_path, output, workers=None,
+                  return_mod_syntax='Xmod', response_format=None, peaks_format=None):
+    """
+    Annotate the PSMs of a xi result CSV and write the responses as NDJSON.
+
+    :param mgf_path: (str) path to the MGF file
+    :param csv_path: (str) path to the xi result CSV
+    :param config_path: (str) path to the xi2 config JSON
+    :param output: (binary file) output the NDJSON responses are written to
+    :param workers: (int) number of worker processes (default: number of CPUs)
+    :param return_mod_syntax: (str) modification syntax of the responses
+    :param response_format: (str) 'columnar' for the columnar fragments format
+    :param peaks_format: (str) format of the echoed peaks ('full', 'compact' or 'none')
+    :return: number of annotated PSMs and of PSMs without spectrum
+    :rtype: dict
+    """
+    with open(config_path) as f:
+        config_json = json.load(f)
+    annotation_json = {'config': config_json, 'returnModSyntax': return_mod_syntax}
+    if response_format is not None:
+        annotation_json['responseFormat'] = response_format
+    if peaks_format is not None:
+        annotation_json['peaksFormat'] = peaks_format
+    workers = workers or multiprocessing.cpu_count()
+
+    stats = {'annotated': 0, 'missing_spectra': 0}
+    tasks = psm_tasks(read_psms(csv_path), iter_spectra(mgf_path, Config(**config_json)),
+                      config_json, stats)
+
+    if workers <= 1:
+        init_worker(annotation_json)
+        for task in tasks:
+            output.write(annotate_task(task))
+        return stats
+
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(annotation_json,)) as executor:
+        # bound the number of tasks in flight to keep the memory usage constant
+        pending = deque()
+        for task in tasks:
+            if len(pending) >= 4 * workers:
+                output.write(pending.popleft().result())
+            pending.append(executor.submit(annotate_task, task))
+        while pending:
+            output.write(pending.popleft().result())
+    return stats
@@ -15,312 +15,224 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
 # USA
 
+import base64
+import copy
+import json
+import threading
 import traceback
-from flask import jsonify
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import jsonify, current_app
 from xicommon.config import Crosslinker, Modification, ModificationConfig, Loss, \
     FragmentationConfig, Config
 from xicommon.mock_context import MockContext
+from xicommon.simple_databases import SimplePeptideDatabase
 from xicommon.spectra_reader import Spectrum
 from xicommon.fragment_peptides import fragment_crosslinked_peptide_pair, \
-    fragment_linear_peptide, fragment_noncovalent_peptide_pair
-from xicommon.fragmentation import spread_charges, include_losses
+    fragment_crosslinked_peptide, fragment_linear_peptide, fragment_noncovalent_peptide_pair
+from xicommon.fragmentation import include_losses
 from xicommon.filters import IsotopeDetector
 from xicommon import const
+from xi2annotator.cache import LRUCache, canonical_hash, setup_cache, fragment_cache, \
+    isotope_cache
+from xi2annotator.timing import StageTimer
+import hashlib
+import itertools
 import numpy as np
 import re
 import os
 
 
-def annotate_request(json_request):
+# default losses used if the xi2 config doesn't define any
+DEFAULT_LOSSES = [
+    {"name": 'H2O',
+     "mass": 18.01056027,
+     "specificity": ['S', 'T', 'D', 'E', 'cterm']},
+    {"name": 'NH3',
+     "mass": 17.02654493,
+     "specificity": ['R', 'K', 'N', 'Q', 'nterm']}
+]
+
+# columns of the annotation table that define a unique fragment
+FRAGMENT_COLS = ['ion_type', 'idx', 'pep_id', 'LN', 'loss', 'nlosses', 'stub', 'ranges']
+
+# Accept header mimetype selecting the columnar fragments format (responseFormat 'columnar')
+COLUMNAR_MIMETYPE = 'application/vnd.xiannotator.columnar+json'
+
+# little-endian dtypes of the base64 encoded peaks format
+PEAK_DTYPES = {'float64': '<f8', 'float32': '<f4'}
+
+# formats of the echoed peaks block (annotation block option peaksFormat)
+PEAKS_FORMATS = ['full', 'compact', 'none']
+
+# splits a modX peptide into n-terminal modification, modified amino acids and c-terminal
+# modification (same pattern as xicommon's modified_peptides_from_sequences)
+MODX_PARTS_RE = re.compile(r"""(?:
+        ^(?:[^A-Z]+-)?
+        |(?:-[^A-Z]+|(?<=[A-Z]))$
+        |(?:[^A-Z]*[A-Z])
+        )""", re.X)
+
+# number of site pairs with full annotations in link site scan responses
+DEFAULT_TOP_K = 3
+
+# annotation block keys that define the config of a xi1 json style request
+XI1_CONFIG_KEYS = ['crosslinker', 'modifications', 'fragmentTolerance', 'ions', 'losses']
+
+
+class AnnotationSetup:
     """
-    Annotate the json request.
+    Request independent part of an annotation.
 
-    :param json_request: JSON annotation request
-    :return: JSON annotation response
+    Holds everything that only depends on the config part of the annotation block: the
+    Config itself, the selected crosslinker, the return modification syntax and the
+    crosslinker, modifications and losses blocks of the response. This allows sharing the
+    setup between several annotations using the same config (e.g. batch requests or the
+    setup cache). The setup is treated as read-only once created.
     """
-    try:
+
+    def __init__(self, annotation_json):
+        """
+        Create the setup from the annotation block of a request.
+
+        The annotation block is not modified, use `apply` to write the derived values into it.
+        :param annotation_json: annotation block of the json request
+        """
+        self.key = self.config_key(annotation_json)
+        self.default_losses = None
         # create Config object
-        if 'config' in json_request['annotation'].keys():
+        if 'config' in annotation_json.keys():
+            config_json = annotation_json['config']
             # add default losses if there were no losses defined
             # ToDo: maybe this should happen on the frontend request generation?
-            if 'losses' not in json_request['annotation']['config']['fragmentation'].keys():
-                json_request['annotation']['config']['fragmentation']['losses'] = [
-                    {"name": 'H2O',
-                     "mass": 18.01056027,
-                     "specificity": ['S', 'T', 'D', 'E', 'cterm']},
-                    {"name": 'NH3',
-                     "mass": 17.02654493,
-                     "specificity": ['R', 'K', 'N', 'Q', 'nterm']}
-                ]
-            config = Config(**json_request['annotation']['config'])
+            if 'losses' not in config_json['fragmentation'].keys():
+                self.default_losses = DEFAULT_LOSSES
+                config_json = dict(config_json)
+                config_json['fragmentation'] = dict(config_json['fragmentation'],
+                                                    losses=copy.deepcopy(DEFAULT_LOSSES))
+            self.config = Config(**config_json)
         else:
             # create from xi1 json style format
-            config = create_config_from_json_format(json_request['annotation'])
+            self.config = create_config_from_json_format(copy.deepcopy(annotation_json))
 
         # set return mod syntax
-        return_mod_syntax = json_request['annotation'].get('returnModSyntax',
-                                                           config.mod_peptide_syntax)
+        self.return_mod_syntax = annotation_json.get('returnModSyntax',
+                                                     self.config.mod_peptide_syntax)
         # set crosslinker
-        is_crosslinked = False
-        crosslinker = None
-        if len(config.crosslinker) > 0:
-            is_crosslinked = True
+        self.is_crosslinked = False
+        self.crosslinker_idx = None
+        self.crosslinker = None
+        if len(self.config.crosslinker) > 0:
+            self.is_crosslinked = True
             try:
-                crosslinker_idx = json_request['annotation']['crosslinkerID']
+                self.crosslinker_idx = annotation_json['crosslinkerID']
             except KeyError:
-                if len(config.crosslinker) == 1:
-                    crosslinker_idx = 0
+                if len(self.config.crosslinker) == 1:
+                    self.crosslinker_idx = 0
                 else:
                     raise ValueError(
                         "More than 1 crosslinker in config without defined crosslinkerID!")
-            crosslinker = config.crosslinker[crosslinker_idx]
-
-        # create peptide database and set up Context
-        ctx = MockContext(config)
-        # xi2 style annotation
-        if 'base_sequence' in json_request['Peptides'][0].keys():
-            base_seqs = [p['base_sequence'].encode('ascii') for p in json_request['Peptides']]
-            mod_ids = [p['modification_ids'] for p in json_request['Peptides']]
-            mod_pos = [p['modification_positions'] for p in json_request['Peptides']]
-
-            ctx.setup_peptide_db_xi2annotator(base_seqs, mod_ids, mod_pos)
-
-            # get the peptide indices of input peptides in the peptide db
-            peps_db = ctx.peptide_db.unmodified_sequences[ctx.peptide_db.peptides['sequence_index']]
-            pep_idx = [np.where(peps_db == p)[0][0] for p in base_seqs]
-        # xi1 style annotation
-        else:
-            peptides = []
-            for peptide in json_request['Peptides']:
-                pep_seq = ''.join([aa['Modification'] + aa['aminoAcid']
-                                   for aa in peptide['sequence']])
-                peptides.append(pep_seq.encode('ascii'))
-            peptides = np.array(peptides)
-            ctx.setup_peptide_db(peptides)
-
-            # get the peptide indices of input peptides in the peptide db
-            peps_db = ctx.peptide_db.mod_pep_sequence(range(ctx.peptide_db.peptides.size))
-            pep_idx = [np.where(peps_db == p)[0][0] for p in peptides]
-
-        # create Spectrum object
-        precursor = {
-            'mz': json_request['annotation'].get('precursorMZ', None),
-            'charge': json_request['annotation']['precursorCharge'],
-            'intensity': json_request['annotation'].get('precursorIntensity', -1)
-        }
-        mz_array = np.array([p['mz'] for p in json_request['peaks']])
-        int_array = np.array([p['intensity'] for p in json_request['peaks']])
-        spectrum = Spectrum(precursor, mz_array, int_array, -1)
-
-        # Process Spectrum for annotation:
-        # detect and reduce isotope clusters to monoisotopic peaks
-        detector = IsotopeDetector(ctx)
-        full_match_spectrum = detector.process(spectrum)
+            self.crosslinker = self.config.crosslinker[self.crosslinker_idx]
 
-        # create unique clusters, cluster indices and cluster ids
-        unique_clusters, cluster_indices, cluster_ids = np.unique(
-            full_match_spectrum.isotope_cluster_peaks['cluster_id'], return_index=True,
-            return_inverse=True)
+        # modification name to modification id (0 is unmodified) for modX sequences
+        self.modification_ids = {'': 0, 'H-': 0, '-OH': 0}
+        self.modification_ids.update(
+            {m.name: i + 1 for i, m in enumerate(self.config.modification.modifications)})
 
-        # create response peaks block with clusterIds mz-ordered
-        json_request['peaks'] = [
-            {'mz': float(m), 'intensity': float(i), 'clusterIds':
-                [int(cid) for cid in full_match_spectrum.isotope_cluster_peaks['cluster_id'][
-                    np.where(full_match_spectrum.isotope_cluster_peaks['peak_id'] == peakid)]]}
-            for peakid, (m, i) in enumerate(zip(
-                full_match_spectrum.mz_values, full_match_spectrum.int_values))
-        ]
+        self.response_blocks = self._create_response_blocks()
 
-        # create clusters
-        json_request['clusters'] = [
-            {'charge': int(c), 'firstPeakId':
-                int(full_match_spectrum.isotope_cluster_peaks['peak_id'][cluster_indices[i]])}
-            for i, c in enumerate(full_match_spectrum.isotope_cluster_charge_values)
-        ]
+    @staticmethod
+    def config_key(annotation_json):
+        """
+        Create the cache key of the config relevant part of an annotation block.
 
-        # create fragments
-        n_peptides = len(ctx.peptide_db.peptides)
-        # Linear
-        if n_peptides == 1:
-            fragments = fragment_linear_peptide(
-                0, ctx, add_precursor=config.fragmentation.add_precursor)
-            fragments = include_losses(fragments, [0], ctx)
-            fragments = spread_charges(fragments, ctx, precursor['charge'])
-            # overwrite LinkSite with empty list for linears
-            json_request['LinkSite'] = []
-        elif n_peptides == 2:
-            link1_pos = json_request['LinkSite'][0]['linkSite']
-            link2_pos = json_request['LinkSite'][1]['linkSite']
-            # noncovalently associated peptides NAPs
-            if link1_pos == -1 and link2_pos == -1:
-                fragments = fragment_noncovalent_peptide_pair(
-                    pep_idx[0], pep_idx[1], ctx,
-                    add_precursor=config.fragmentation.add_precursor)
-            # Crosslinked peptide
-            elif is_crosslinked:
-                fragments = fragment_crosslinked_peptide_pair(
-                    pep_idx[0], pep_idx[1], link1_pos, link2_pos,
-                    crosslinker, ctx,
-                    add_precursor=config.fragmentation.add_precursor)
-            else:
-                raise ValueError("2 peptides with crosslink positions defined but no crosslinker.")
-            fragments = include_losses(fragments, [pep_idx[0], pep_idx[1]], ctx)
-            fragments = spread_charges(fragments, ctx, precursor['charge'])
+        :param annotation_json: annotation block of the json request
+        :return: canonical hash of the config relevant values
+        :rtype: str
+        """
+        if 'config' in annotation_json.keys():
+            config_keys = ['config']
         else:
-            raise ValueError("Unsupported number of peptides given!")
+            config_keys = XI1_CONFIG_KEYS
+        return canonical_hash({k: annotation_json.get(k) for k in
+                               config_keys + ['returnModSyntax', 'crosslinkerID']})
 
-        # annotate the spectrum with fragments
-        annotations = full_match_spectrum.annotate_spectrum(fragments, ctx)
+    def apply(self, annotation_json):
+        """
+        Write the config derived values into the annotation block of a request.
 
-        if len(annotations) == 0:
-            json_request['fragments'] = []
-        else:
-            # generate peptides in return_mod_syntax as list of modified amino acids
-            # for assembly of fragment sequences
-            if return_mod_syntax == 'modX':
-                pep_to_aa_re = const.PEPTIDE_TO_AMINO_ACID
-            elif return_mod_syntax == 'Xmod':
-                pep_to_aa_re = re.compile(b'([A-Z][^A-Z\\-]*)')
-
-            return_pep1 = ctx.peptide_db.mod_pep_sequence([pep_idx[0]],
-                                                          mod_peptide_syntax=return_mod_syntax)
-            pep_mod_arr1 = pep_to_aa_re.findall(return_pep1)
-            return_pep2 = ctx.peptide_db.mod_pep_sequence([pep_idx[1]],
-                                                          mod_peptide_syntax=return_mod_syntax) \
-                if n_peptides == 2 else None
-            pep_mod_arr2 = pep_to_aa_re.findall(return_pep2) if n_peptides == 2 else []
-            pep_mod_arr = [pep_mod_arr1, pep_mod_arr2]
-
-            # create unique fragments
-            fragment_cols = ['ion_type', 'idx', 'pep_id', 'LN', 'loss', 'nlosses', 'stub',
-                             'ranges']
-            annotations.sort(order=fragment_cols)
-            if len(annotations) == 1:
-                fragments = annotations[fragment_cols]
-                frag_indices = [0]
-                frag_counts = [1]
-            else:
-                fragments, frag_indices, frag_counts = np.unique(
-                    annotations[fragment_cols], return_index=True, return_counts=True)
-
-            json_request['fragments'] = []
-            for i, f in enumerate(fragments):
-                name = f['ion_type'].decode('ascii')
-                if f['ion_type'] != b'P':
-                    name += str(f['idx'])
-                if not f['LN']:
-                    name += '+P'
-                name += f['stub'].decode('ascii')
-                if f['nlosses'] > 0:
-                    name += '_' + f['loss'].decode('ascii')
-                # get all annotations for this fragment
-                f_annotations = annotations[frag_indices[i]: frag_indices[i] + frag_counts[i]]
-
-                # loop over fragment annotations for clusterIds and clusterInfo
-                cluster_ids = []
-                cluster_info = []
-                for annotation in f_annotations:
-                    # get cluster id and convert to int (int16 not JSON serializable)
-                    cluster_id = int(annotation['cluster_id'])
-                    # append to cluster ids
-                    cluster_ids.append(cluster_id)
-                    cluster_info.append({
-                        'Clusterid': cluster_id,
-                        'calcMZ': annotation['frag_mz'],
-                        'error': annotation['rel_error'] / 1e-6,
-                        'errorUnit': 'ppm',
-                        'matchedMissingMonoIsotopic': int(annotation['missing_monoisotopic_peak']),
-                        'matchedCharge': int(annotation['frag_charge'])
-                    })
-
-                # reformat ranges according to annotator format
-                f_pep_id = f['pep_id'] - 1  # change pep_id from 1-based to 0-based
-
-                if f['LN']:
-                    ranges = [{
-                        'peptideId': int(f_pep_id),
-                        'from': int(f['ranges'][f_pep_id][0]),
-                        'to': int(f['ranges'][f_pep_id][1]) - 1
-                    }]
-                else:
-                    ranges = [{'peptideId': pep_id, 'from': int(r[0]), 'to': int(r[1]) - 1}
-                              for pep_id, r in enumerate(f['ranges'])]
-
-                # assemble fragment sequence
-                frag_sequence = [pep_mod_arr[i][r[0]:r[1]]
-                                 for i, r in enumerate(f['ranges']) if r.sum() > 0]
-                frag_sequence_str = ' + '.join(
-                    [''.join([aa.decode() for aa in seq]) for seq in frag_sequence])
-                fragment = {
-                    'name': name,
-                    'ionNumber': int(f['idx']),
-                    'peptideId': int(f_pep_id),
-                    'range': ranges,
-                    'type': f['ion_type'].decode('ascii'),
-                    # ToDo: change class to primary True, False? or just have field nlosses
-                    'class': 'lossy' if f['nlosses'] > 0 else 'non-lossy',
-                    'nlosses': int(f['nlosses']),
-                    'stub': f['stub'].decode('ascii'),
-                    'clusterIds': cluster_ids,
-                    'clusterInfo': cluster_info,
-                    'sequence': frag_sequence_str
-                }
-                json_request['fragments'].append(fragment)
-
-        # theoretical calculated precursor m/z and error
-        peptides_mass = ctx.peptide_db.peptide_mass(np.arange(n_peptides)).sum()
-        if is_crosslinked:
-            cl_mass = crosslinker.mass
-            peptides_mass += cl_mass
-        calc_mz = (peptides_mass / precursor['charge']) + const.PROTON_MASS
-        json_request['annotation']['calculatedMZ'] = calc_mz
-        if precursor['mz'] is None:
-            json_request['annotation']['precursorError'] = ''
-        else:
-            json_request['annotation']['precursorError'] = {
-                'tolerance': (precursor['mz'] - calc_mz) / calc_mz * 1e6,
-                'unit': 'ppm'
-            }
+        Adds the default losses to the echoed config (if used) and writes out the
+        crosslinker, modifications and losses blocks. The blocks are copied, so mutating a
+        response doesn't change the setup shared by later requests.
+        :param annotation_json: annotation block of the json request
+        """
+        if self.default_losses is not None:
+            annotation_json['config'] = dict(annotation_json['config'])
+            annotation_json['config']['fragmentation'] = dict(
+                annotation_json['config']['fragmentation'],
+                losses=copy.deepcopy(self.default_losses))
+        annotation_json.update(copy.deepcopy(self.response_blocks))
+
+    def create_context(self):
+        """
+        Create a new MockContext for this setup.
+
+        The context is not thread-safe as the peptide database gets replaced for each
+        annotation, but it can be reused for consecutive annotations.
+        :return: context without peptide database
+        :rtype: MockContext
+        """
+        return MockContext(self.config)
 
+    def _create_response_blocks(self):
+        """
+        Create the config derived blocks of the response annotation block.
+
+        :return: crosslinker (if crosslinked), modifications and losses blocks
+        :rtype: dict
+        """
+        config = self.config
+        blocks = {}
         # write out crosslinker modMass for xispec
-        if is_crosslinked:
+        if self.is_crosslinked:
             try:
-                xi2_stubs = config.crosslinker[crosslinker_idx].cleavage_stubs
+                xi2_stubs = config.crosslinker[self.crosslinker_idx].cleavage_stubs
                 stubs = []
                 for s in xi2_stubs:
                     stubs.append(f"{s.name}:{s.mass}:{''.join(s.pairs_with)}")
             except (KeyError, TypeError):
                 stubs = []
 
-            json_request['annotation']['crosslinker'] = {
-                'name': crosslinker.name,
-                'modMass': crosslinker.mass,
-                'specificity': crosslinker.specificity,
+            blocks['crosslinker'] = {
+                'name': self.crosslinker.name,
+                'modMass': self.crosslinker.mass,
+                'specificity': self.crosslinker.specificity,
             }
             if len(stubs) > 0:
-                json_request['annotation']['crosslinker'].update({
+                blocks['crosslinker'].update({
                     'stubs1': stubs,
                     'stubs2': stubs,
                     'cleavage_stubs': [s.to_dict() for s in xi2_stubs]
                 })
 
-        # write out modifications with masses (it's possible to just give composition and not mass)
-        json_request['annotation']['modifications'] = []
+        # write out modifications with masses (it's possible to just give composition and not
+        # mass)
+        blocks['modifications'] = []
         for mod in config.modification.modifications:
-            json_request['annotation']['modifications'].append({
+            blocks['modifications'].append({
                 'id': mod.name,
                 'aminoAcids': mod.specificity,
                 'mass': mod.mass
             })
 
         # write out losses in annotation block for backwards compatibility
-        json_request['annotation']['losses'] = []
+        blocks['losses'] = []
         for loss in config.fragmentation.losses:
             specificity = loss.specificity.copy()
-            if return_mod_syntax != config.mod_peptide_syntax:
-                if return_mod_syntax == 'modX':
+            if self.return_mod_syntax != config.mod_peptide_syntax:
+                if self.return_mod_syntax == 'modX':
                     specificity = [s[1:] + s[0] for s in specificity]
-                elif return_mod_syntax == 'Xmod':
+                elif self.return_mod_syntax == 'Xmod':
                     specificity = [s[-1] + s[:-1] for s in specificity]
                 else:
                     raise Exception
@@ -333,19 +245,1519 @@ def annotate_request(json_request):
                 old_loss['specificity'].append('CTerm')
             if loss.nterm:
                 old_loss['specificity'].append('NTerm')
-            json_request['annotation']['losses'].append(old_loss)
+            blocks['losses'].append(old_loss)
+
+        return blocks
+
+
+def get_annotation_setup(annotation_json):
+    """
+    Return the (cached) AnnotationSetup for the annotation block of a request.
+
+    :param annotation_json: annotation block of the json request
+    :rtype: AnnotationSetup
+    """
+    key = AnnotationSetup.config_key(annotation_json)
+    setup = setup_cache.get(key)
+    if setup is None:
+        setup = AnnotationSetup(annotation_json)
+        setup_cache.put(setup.key, setup)
+    return setup
+
 
-        # ToDo: the version should come from a central place
-        json_request['annotation']['xiVersion'] = const.VERSION
+def is_debug():
+    """Return True if the annotator runs in debug mode (XI2ANNOTATOR_DEBUG)."""
+    debug_value = os.environ.get("XI2ANNOTATOR_DEBUG", "false")
+    return debug_value.lower() != "false" and debug_value != "0"
+
+
+def annotate_request(json_request, timer=None):
+    """
+    Annotate the json request.
 
-        return jsonify(json_request)
+    :param json_request: JSON annotation request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: JSON annotation response
+    """
+    if timer is None:
+        timer = StageTimer()
+    profiler = current_app.extensions.get('xi2annotator.profiler')
+    try:
+        if profiler is None:
+            response_json = annotate_json(json_request, timer=timer)
+        else:
+            response_json = profiler.run(annotate_json, json_request, timer=timer)
+        response = jsonify(response_json)
+        timer.lap('jsonify')
+        return response
     except Exception as e:
-        debug_value = os.environ.get("XI2ANNOTATOR_DEBUG", "false")
-        if debug_value.lower() != "false" and debug_value != "0":
+        if is_debug():
             return jsonify({'error': str(e), "stacktrace": traceback.format_exc()}), 400
         raise e
 
 
+def annotate_batch_request(json_request, timer=None):
+    """
+    Annotate a batch of spectra sharing the same annotation config.
+
+    The batch request consists of a shared ``annotation`` block (config, crosslinkerID,
+    returnModSyntax, ...) and a list of ``items``. Each item holds the ``Peptides``,
+    ``LinkSite`` and ``peaks`` of a single annotation and an optional ``annotation`` block
+    with the item specific precursor values (precursorCharge, precursorMZ, ...).
+    The config is only created once and the context is reused for all items. Items overriding
+    the config, crosslinkerID or returnModSyntax get their own (cached) setup and context.
+    Errors are reported per item and don't fail the whole batch.
+
+    :param json_request: JSON batch annotation request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: JSON batch annotation response with one FULL response per item
+    """
+    if timer is None:
+        timer = StageTimer()
+    try:
+        setup = get_annotation_setup(json_request['annotation'])
+        ctx = setup.create_context()
+    except Exception as e:
+        if is_debug():
+            return jsonify({'error': str(e), "stacktrace": traceback.format_exc()}), 400
+        raise e
+
+    contexts = {setup.key: ctx}
+    responses = []
+    for item in json_request['items']:
+        try:
+            item_request = dict(item)
+            item_request['annotation'] = {**json_request['annotation'],
+                                          **item.get('annotation', {})}
+            item_setup = setup
+            if AnnotationSetup.config_key(item_request['annotation']) != setup.key:
+                item_setup = get_annotation_setup(item_request['annotation'])
+            if item_setup.key not in contexts:
+                contexts[item_setup.key] = item_setup.create_context()
+            responses.append(annotate_json(item_request, item_setup, contexts[item_setup.key],
+                                           timer))
+        except Exception as e:
+            error = {'error': str(e)}
+            if is_debug():
+                error['stacktrace'] = traceback.format_exc()
+            responses.append(error)
+
+    response = jsonify({'responses': responses})
+    timer.lap('jsonify')
+    return response
+
+
+def annotate_candidates_request(json_request, timer=None):
+    """
+    Annotate several candidate explanations of one spectrum.
+
+    See `annotate_candidates_json` for the request format.
+
+    :param json_request: JSON candidates annotation request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: JSON candidates annotation response
+    """
+    if timer is None:
+        timer = StageTimer()
+    try:
+        response_json = annotate_candidates_json(json_request, timer)
+    except Exception as e:
+        if is_debug():
+            return jsonify({'error': str(e), "stacktrace": traceback.format_exc()}), 400
+        raise e
+    response = jsonify(response_json)
+    timer.lap('jsonify')
+    return response
+
+
+def annotate_link_sites_request(json_request, timer=None):
+    """
+    Scan all link sites allowed by the crosslinker for the peptide pair of the request.
+
+    See `annotate_link_sites_json` for the request format.
+
+    :param json_request: JSON link site scan request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: JSON link site scan response
+    """
+    if timer is None:
+        timer = StageTimer()
+    try:
+        response_json = annotate_link_sites_json(json_request, timer)
+    except Exception as e:
+        if is_debug():
+            return jsonify({'error': str(e), "stacktrace": traceback.format_exc()}), 400
+        raise e
+    response = jsonify(response_json)
+    timer.lap('jsonify')
+    return response
+
+
+def annotate_modification_sites_request(json_request, timer=None):
+    """
+    Annotate every candidate placement of a modification on a request peptide.
+
+    See `annotate_modification_sites_json` for the request format.
+
+    :param json_request: JSON modification site scan request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: JSON modification site scan response
+    """
+    if timer is None:
+        timer = StageTimer()
+    try:
+        response_json = annotate_modification_sites_json(json_request, timer)
+    except Exception as e:
+        if is_debug():
+            return jsonify({'error': str(e), "stacktrace": traceback.format_exc()}), 400
+        raise e
+    response = jsonify(response_json)
+    timer.lap('jsonify')
+    return response
+
+
+# per thread contexts of the stream annotation (contexts are not thread-safe)
+_stream_contexts = threading.local()
+
+
+def stream_context(setup):
+    """
+    Return a context for the setup that is reused by the stream annotations of this thread.
+
+    :param setup: (AnnotationSetup) annotation setup
+    :rtype: MockContext
+    """
+    contexts = getattr(_stream_contexts, 'contexts', None)
+    if contexts is None:
+        contexts = _stream_contexts.contexts = LRUCache(maxsize=8)
+    ctx = contexts.get(setup.key)
+    if ctx is None:
+        ctx = setup.create_context()
+        contexts.put(setup.key, ctx)
+    return ctx
+
+
+def annotate_stream_line(line, index):
+    """
+    Annotate a single line of a NDJSON annotation stream.
+
+    The ``id`` of the request is echoed in the response (defaults to the 0-based index of the
+    request in the stream). Errors are returned as response with the id and the error.
+
+    :param line: (str|bytes) JSON annotation request
+    :param index: (int) index of the request in the stream
+    :return: annotation response
+    :rtype: dict
+    """
+    request_id = index
+    try:
+        json_request = json.loads(line)
+        request_id = json_request.setdefault('id', index)
+        setup = get_annotation_setup(json_request['annotation'])
+        return annotate_json(json_request, setup, stream_context(setup))
+    except Exception as e:
+        error = {'id': request_id, 'error': str(e)}
+        if is_debug():
+            error['stacktrace'] = traceback.format_exc()
+        return error
+
+
+def annotate_stream(lines, workers=1, ordered=True):
+    """
+    Annotate a stream of NDJSON annotation requests.
+
+    The lines are consumed lazily and at most 2 * workers requests are in progress at any time,
+    so the memory usage doesn't depend on the length of the stream.
+
+    :param lines: (iterable of str|bytes) JSON annotation requests, empty lines are skipped
+    :param workers: (int) number of threads annotating the requests
+    :param ordered: (bool) yield the responses in the order of the requests, otherwise they are
+        yielded as soon as they are finished (use the echoed id to match them)
+    :return: generator of the annotation responses
+    """
+    requests = enumerate(line for line in lines if line.strip())
+    if workers <= 1:
+        for index, line in requests:
+            yield annotate_stream_line(line, index)
+        return
+
+    with ThreadPoolExecutor(workers, thread_name_prefix='xi2annotator-stream') as executor:
+        pending = deque() if ordered else set()
+        for index, line in requests:
+            if len(pending) >= 2 * workers:
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            future = executor.submit(annotate_stream_line, line, index)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+        while pending:
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def annotate_json_timed(json_request):
+    """
+    Annotate the json request and return the response with the timer of the stages.
+
+    Used to run the annotation in an executor (thread or process).
+
+    :param json_request: JSON annotation request
+    :return: annotation response and StageTimer
+    :rtype: tuple
+    """
+    timer = StageTimer()
+    return annotate_json(json_request, timer=timer), timer
+
+
+def annotate_json(json_request, setup=None, ctx=None, timer=None):
+    """
+    Annotate the json request and return the response as dictionary.
+
+    :param json_request: JSON annotation request (gets modified to become the response)
+    :param setup: (AnnotationSetup) precomputed setup for the request config, if None it is
+        taken from the setup cache
+    :param ctx: (MockContext) context to reuse, if None a new one is created from the setup
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: annotation response
+    :rtype: dict
+    """
+    if timer is None:
+        timer = StageTimer()
+    if setup is None:
+        setup = get_annotation_setup(json_request['annotation'])
+
+    # create peptide database and set up Context
+    if ctx is None:
+        ctx = setup.create_context()
+    timer.lap('config')
+    pep_idx = setup_request_peptide_db(setup, ctx, json_request['Peptides'])
+    timer.lap('peptide_db')
+
+    spectrum = process_request_peaks(json_request, ctx, timer)
+    annotate_peptides(json_request, setup, ctx, pep_idx, spectrum, timer)
+    return json_request
+
+
+def annotate_candidates_json(json_request, timer=None):
+    """
+    Annotate several candidate explanations of one spectrum and summarize their matches.
+
+    The request holds the ``annotation`` block and the ``peaks`` of a FULL request and a list
+    of ``candidates``. Each candidate holds the ``Peptides`` and ``LinkSite`` and optionally an
+    ``id`` (default: its index) and a ``crosslinkerID`` selecting another crosslinker of the
+    config; the top-level ``crosslinkerID`` is only required for candidates without one when
+    the config holds several crosslinkers. The isotope detection runs once, the response holds
+    the shared ``peaks`` and ``clusters`` blocks and per candidate the FULL response blocks
+    (without peaks and clusters) and a ``summary`` (see `annotation_summary`).
+    Errors are reported per candidate and don't fail the other candidates.
+
+    :param json_request: JSON candidates annotation request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: candidates annotation response
+    :rtype: dict
+    """
+    if timer is None:
+        timer = StageTimer()
+    annotation_json = json_request['annotation']
+    # the candidates only differ in the crosslinker, so they share the context and the isotope
+    # detection, which don't depend on the crosslinker choice (resolved per candidate)
+    setup = get_annotation_setup(dict(annotation_json,
+                                      crosslinkerID=annotation_json.get('crosslinkerID', 0)))
+    ctx = setup.create_context()
+    timer.lap('config')
+
+    response = {'annotation': annotation_json, 'peaks': json_request['peaks']}
+    spectrum = process_request_peaks(response, ctx, timer)
+    del response['annotation']
+
+    response['candidates'] = [
+        annotate_candidate(annotation_json, candidate, i, ctx, spectrum, timer)
+        for i, candidate in enumerate(json_request['candidates'])]
+    timer.count('candidates', len(response['candidates']))
+    return response
+
+
+def annotate_candidate(annotation_json, candidate, index, ctx, spectrum, timer):
+    """
+    Annotate a candidate explanation of an isotope detected spectrum.
+
+    :param annotation_json: annotation block of the request
+    :param candidate: candidate with Peptides, LinkSite and optionally id and crosslinkerID
+    :param index: (int) index of the candidate (default id)
+    :param ctx: (MockContext) context of the request config
+    :param spectrum: (Spectrum) isotope detected spectrum
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: FULL response blocks (without peaks and clusters) and summary of the candidate or
+        the error
+    :rtype: dict
+    """
+    candidate_annotation = dict(annotation_json)
+    if 'crosslinkerID' in candidate:
+        candidate_annotation['crosslinkerID'] = candidate['crosslinkerID']
+    candidate_response = {'id': candidate.get('id', index),
+                          'Peptides': candidate['Peptides'],
+                          'LinkSite': candidate.get('LinkSite', []),
+                          'annotation': candidate_annotation}
+    try:
+        candidate_setup = get_annotation_setup(candidate_annotation)
+        pep_idx = setup_request_peptide_db(candidate_setup, ctx, candidate['Peptides'])
+        timer.lap('peptide_db')
+        annotations = annotate_peptides(candidate_response, candidate_setup, ctx, pep_idx,
+                                        spectrum, timer)
+        candidate_response['summary'] = annotation_summary(
+            annotations, spectrum, ctx.peptide_aa_lengths)
+        timer.lap('response')
+    except Exception as e:
+        candidate_response = {'id': candidate.get('id', index), 'error': str(e)}
+        if is_debug():
+            candidate_response['stacktrace'] = traceback.format_exc()
+    return candidate_response
+
+
+def annotate_link_sites_json(json_request, timer=None):
+    """
+    Scan all link sites allowed by the crosslinker for the peptide pair and rank the pairs.
+
+    The request is a FULL request of a crosslinked peptide pair, the LinkSite block is ignored
+    and ``topK`` (default: DEFAULT_TOP_K) sets the number of site pairs that get full
+    annotations. The fragments of one peptide only depend on its own link site, so each
+    peptide is fragmented once per site and the fragments of a site pair are the fragments of
+    its two sites.
+    The response holds the ``peaks`` and ``clusters`` blocks, the ``sitePairs`` with the
+    summary (see `annotation_summary`) and the number of matched crosslinked fragments ranked
+    by matched fragments and matched intensity, and the FULL response blocks of the top k
+    site pairs as ``annotations``.
+
+    :param json_request: JSON link site scan request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: link site scan response
+    :rtype: dict
+    """
+    if timer is None:
+        timer = StageTimer()
+    annotation_json = json_request['annotation']
+    setup = get_annotation_setup(annotation_json)
+    if not setup.is_crosslinked:
+        raise ValueError("Link site scanning requires a crosslinker!")
+    if len(json_request['Peptides']) != 2:
+        raise ValueError("Link site scanning requires two peptides!")
+    ctx = setup.create_context()
+    timer.lap('config')
+    setup_request_peptide_db(setup, ctx, json_request['Peptides'])
+    timer.lap('peptide_db')
+
+    response = {'annotation': annotation_json, 'peaks': json_request['peaks']}
+    spectrum = process_request_peaks(response, ctx, timer)
+    del response['annotation']
+
+    charge = annotation_json['precursorCharge']
+    site_pairs = crosslinker_site_pairs(setup, ctx)
+    # charged fragments of each peptide by its link site
+    site_fragments = [{}, {}]
+    for pep_index, site in sorted(set((p, pair[p]) for pair in site_pairs for p in (0, 1))):
+        fragments = crosslinked_peptide_fragments(setup, ctx, pep_index, site)
+        site_fragments[pep_index][site] = spread_fragment_charges(fragments, charge)
+    timer.lap('fragmentation')
+
+    site_pair_results = []
+    for site1, site2 in site_pairs:
+        # the pair is matched as a whole as the M+1 matching depends on all direct matches
+        fragments = np.concatenate([site_fragments[0][site1], site_fragments[1][site2]])
+        annotations = spectrum.annotate_spectrum(fragments, ctx)
+        summary = annotation_summary(annotations, spectrum, ctx.peptide_aa_lengths)
+        crosslinked = annotations[~annotations['LN'] & (annotations['ion_type'] != b'P')]
+        summary['crosslinkedFragments'] = \
+            len(np.unique(crosslinked[FRAGMENT_COLS])) if len(crosslinked) > 0 else 0
+        site_pair_results.append({'linkSites': [int(site1), int(site2)], 'summary': summary})
+    site_pair_results.sort(key=lambda r: (-r['summary']['matchedFragments'],
+                                          -r['summary']['matchedIntensityFraction']))
+    response['sitePairs'] = site_pair_results
+    timer.count('site_pairs', len(site_pairs))
+    timer.lap('annotation')
+
+    top_k = json_request.get('topK', DEFAULT_TOP_K)
+    response['annotations'] = []
+    for rank, result in enumerate(site_pair_results[:top_k]):
+        link_sites = [{'id': 0, 'peptideId': i, 'linkSite': site}
+                      for i, site in enumerate(result['linkSites'])]
+        candidate = {'Peptides': json_request['Peptides'], 'LinkSite': link_sites}
+        response['annotations'].append(
+            annotate_candidate(annotation_json, candidate, rank, ctx, spectrum, timer))
+    return response
+
+
+def crosslinker_link_sites(setup, ctx, pep_index, end):
+    """
+    Return the link sites of a peptide allowed by one end of the crosslinker.
+
+    Amino acid specificities without modification only match unmodified residues, 'X' matches
+    any residue. The nterm/cterm specificities allow the first/last residue of the peptide.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context with the peptide database set up
+    :param pep_index: (int) index of the peptide in the peptide database
+    :param end: (int) index of the crosslinker end (specificity)
+    :return: 0-based link sites
+    :rtype: list
+    """
+    crosslinker = setup.crosslinker
+    sequence = ctx.peptide_db.unmod_pep_sequence(pep_index)
+    length = len(sequence)
+    modifications = ctx.peptide_db.peptides['modifications'][pep_index][2:2 + length]
+    sites = set()
+    for aa, mod_name in zip(crosslinker.ord_aa_specificity[end],
+                            crosslinker.mod_specificity[end]):
+        mod_id = setup.modification_ids.get(mod_name, -1)
+        sites.update(i for i in range(length)
+                     if (aa == ord('X') or sequence[i] == aa) and modifications[i] == mod_id)
+    if crosslinker.nterm[end]:
+        sites.add(0)
+    if crosslinker.cterm[end]:
+        sites.add(length - 1)
+    return sorted(sites)
+
+
+def crosslinker_site_pairs(setup, ctx):
+    """
+    Return the link site pairs of the two peptides allowed by the crosslinker specificity.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context with the peptide pair set up
+    :return: 0-based (site of peptide 1, site of peptide 2) pairs
+    :rtype: list
+    """
+    if setup.crosslinker.homobifunctional:
+        ends = [(0, 0)]
+    else:
+        ends = [(0, 1), (1, 0)]
+    pairs = set()
+    for end1, end2 in ends:
+        pairs.update(itertools.product(crosslinker_link_sites(setup, ctx, 0, end1),
+                                       crosslinker_link_sites(setup, ctx, 1, end2)))
+    return sorted(pairs)
+
+
+def crosslinked_peptide_fragments(setup, ctx, pep_index, link_pos):
+    """
+    Create the singly charged fragments of one peptide of the crosslinked pair.
+
+    These are the fragments fragment_crosslinked_peptide_pair creates for this peptide
+    (fragments of the peptide with the complete other peptide attached at the link site)
+    including losses. The precursor fragments are added to the first peptide.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context with the peptide pair set up
+    :param pep_index: (int) index of the fragmented peptide (0 or 1)
+    :param link_pos: (int) 0-based link site of the fragmented peptide
+    :return: (ndarray) sorted fragments at charge 1
+    """
+    add_precursor = setup.config.fragmentation.add_precursor and pep_index == 0
+    fragments = fragment_crosslinked_peptide(pep_index, 1 - pep_index, link_pos,
+                                             setup.crosslinker, ctx, add_precursor=add_precursor)
+    if pep_index == 1:
+        fragments['pep_id'] = 2
+        fragments['ranges'] = fragments['ranges'][:, ::-1].copy()
+    fragments = include_losses(fragments, [0, 1], ctx)
+    fragments.sort()
+    return fragments
+
+
+def annotate_modification_sites_json(json_request, timer=None):
+    """
+    Annotate every candidate placement of a modification and compare the site evidence.
+
+    The request is a FULL request with a ``modificationScan`` block, e.g.
+    {'peptideId': 0, 'modification': 'ox', 'positions': [2, 5]}. The (side chain) modification
+    of the config is placed once at each 0-based candidate position of the peptide (default:
+    all residues in its specificity without another modification), an occurrence of it in the
+    request peptide is one of the placements. ``topK`` (default: DEFAULT_TOP_K) sets the
+    number of placements that get full annotations.
+    The response holds the ``peaks`` and ``clusters`` blocks, the ``placements`` with the
+    summary (see `annotation_summary`) and the ``siteDetermining`` evidence ranked by the
+    matched site-determining fragments, their matched intensity and the matched fragments, and
+    the FULL response blocks of the top k placements as ``annotations``. Site-determining
+    fragments hold the modification for some but not all candidate positions.
+
+    :param json_request: JSON modification site scan request
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: modification site scan response
+    :rtype: dict
+    """
+    if timer is None:
+        timer = StageTimer()
+    annotation_json = json_request['annotation']
+    setup = get_annotation_setup(annotation_json)
+    ctx = setup.create_context()
+    timer.lap('config')
+
+    n_peptides = len(json_request['Peptides'])
+    if n_peptides == 1:
+        link_pos = None
+    elif n_peptides == 2:
+        link_pos = (json_request['LinkSite'][0]['linkSite'],
+                    json_request['LinkSite'][1]['linkSite'])
+    else:
+        raise ValueError("Unsupported number of peptides given!")
+    scan = json_request['modificationScan']
+    pep_index = scan.get('peptideId', 0)
+    if not 0 <= pep_index < n_peptides:
+        raise ValueError(f"Unknown peptideId: {pep_index}")
+    base_seqs, modifications = request_peptides(setup, json_request['Peptides'])
+    mod_id, other_mods, positions = modification_scan_positions(
+        setup, base_seqs[pep_index], modifications[pep_index], scan)
+    modifications[pep_index] = other_mods
+    timer.lap('peptide_db')
+
+    response = {'annotation': annotation_json, 'peaks': json_request['peaks']}
+    spectrum = process_request_peaks(response, ctx, timer)
+    del response['annotation']
+
+    placement_fragments = modification_placement_fragments(
+        setup, ctx, base_seqs, modifications, pep_index, mod_id, positions, link_pos)
+    timer.lap('fragmentation')
+
+    charge = annotation_json['precursorCharge']
+    positions_array = np.array(positions)
+    placement_results = []
+    for position, fragments in zip(positions, placement_fragments):
+        annotations = spectrum.annotate_spectrum(spread_fragment_charges(fragments, charge), ctx)
+        # the singly charged table holds each fragment once
+        n_site_fragments = int(site_determining_mask(
+            fragments['ranges'][:, pep_index], positions_array).sum())
+        site_annotations = annotations[site_determining_mask(
+            annotations['ranges'][:, pep_index], positions_array)]
+        placement_results.append({
+            'position': position,
+            'summary': annotation_summary(annotations, spectrum, ctx.peptide_aa_lengths),
+            'siteDetermining': {
+                'fragments': n_site_fragments,
+                'matchedFragments': len(np.unique(site_annotations[FRAGMENT_COLS]))
+                if len(site_annotations) > 0 else 0,
+                'matchedIntensityFraction': matched_intensity_fraction(site_annotations,
+                                                                       spectrum)
+            }
+        })
+    placement_results.sort(key=lambda r: (-r['siteDetermining']['matchedFragments'],
+                                          -r['siteDetermining']['matchedIntensityFraction'],
+                                          -r['summary']['matchedFragments'],
+                                          -r['summary']['matchedIntensityFraction']))
+    response['placements'] = placement_results
+    timer.count('placements', len(positions))
+    timer.lap('annotation')
+
+    top_k = json_request.get('topK', DEFAULT_TOP_K)
+    response['annotations'] = []
+    for rank, result in enumerate(placement_results[:top_k]):
+        peptides = list(json_request['Peptides'])
+        peptides[pep_index] = peptide_json(
+            base_seqs[pep_index], other_mods + [(result['position'] + 2, mod_id)])
+        candidate = {'Peptides': peptides, 'LinkSite': json_request.get('LinkSite', [])}
+        response['annotations'].append(
+            annotate_candidate(annotation_json, candidate, rank, ctx, spectrum, timer))
+    return response
+
+
+def modification_scan_positions(setup, sequence, modifications, scan):
+    """
+    Return the scanned modification, the other modifications and the candidate positions.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param sequence: (bytes) unmodified sequence of the scanned peptide
+    :param modifications: (list) (slot, modification id) pairs of the scanned peptide, see
+        `request_peptides`
+    :param scan: modificationScan block of the request, explicit positions must be free and
+        allowed by the specificity of the modification
+    :return: modification id, the other (slot, modification id) pairs of the peptide and the
+        sorted 0-based candidate positions
+    :rtype: tuple
+    """
+    name = scan['modification']
+    mod_id = setup.modification_ids.get(name, 0)
+    if mod_id == 0:
+        raise ValueError(f"Unknown modification: {name}")
+    modification = setup.config.modification.modifications[mod_id - 1]
+    if modification.nterm_mod or modification.cterm_mod:
+        raise ValueError(f"Terminal modification {name} can't be scanned over residues!")
+
+    other_mods = list(modifications)
+    placed_slots = [slot for slot, m in other_mods if m == mod_id and slot >= 2]
+    if placed_slots:
+        other_mods.remove((placed_slots[0], mod_id))
+    occupied = {slot - 2 for slot, _ in other_mods}
+
+    if 'positions' in scan:
+        positions = sorted(set(scan['positions']))
+        invalid = [p for p in positions if not 0 <= p < len(sequence) or p in occupied
+                   or not modification_allows(modification, sequence, p)]
+        if invalid:
+            raise ValueError(f"Invalid positions for modification {name}: {invalid}")
+    else:
+        positions = [i for i in range(len(sequence))
+                     if i not in occupied and modification_allows(modification, sequence, i)]
+    if len(positions) == 0:
+        raise ValueError(f"No candidate positions for modification {name}!")
+    return mod_id, other_mods, positions
+
+
+def modification_allows(modification, sequence, position):
+    """
+    Return True if the specificity of the modification allows the residue at position.
+
+    :param modification: (Modification) modification of the config
+    :param sequence: (bytes) unmodified peptide sequence
+    :param position: (int) 0-based residue position
+    :rtype: bool
+    """
+    amino_acid = chr(sequence[position])
+    for specificity in modification.specificity:
+        if specificity.startswith('nterm'):
+            if position != 0:
+                continue
+            specificity = specificity[5:]
+        elif specificity.startswith('cterm'):
+            if position != len(sequence) - 1:
+                continue
+            specificity = specificity[5:]
+        if specificity in ('X', amino_acid):
+            return True
+    return False
+
+
+def modification_placement_fragments(setup, ctx, base_seqs, modifications, pep_index, mod_id,
+                                     positions, link_pos):
+    """
+    Create the singly charged fragments of every placement of a modification.
+
+    A fragment only depends on the placement through whether its range holds the modification
+    and how modifying the carrying residue changes the loss sites (see `loss_site_changes`),
+    which groups the placements. The n-terminal fragments holding any placement hold the first
+    placement of the same group and those holding none miss the last placement (vice versa for
+    c-terminal fragments), fragments of the other peptide or covering the whole peptide hold
+    all placements. So only the first and last placement of each group get fragmented, the
+    fragments of every placement are taken from these (equal up to the rounding of the m/z
+    values).
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context to set up the peptide database in
+    :param base_seqs: (list of bytes) unmodified sequences of the request peptides
+    :param modifications: (list) (slot, modification id) pairs of each peptide without the
+        scanned modification, see `request_peptides`
+    :param pep_index: (int) index of the scanned peptide
+    :param mod_id: (int) id of the scanned modification
+    :param positions: (list of int) sorted 0-based candidate positions
+    :param link_pos: link sites of the peptides, see `create_fragments`
+    :return: sorted singly charged fragments of each placement
+    :rtype: list
+    """
+    sequence = base_seqs[pep_index]
+    losses = setup.config.fragmentation.losses
+    changes = {p: loss_site_changes(losses, sequence[p], mod_id) for p in positions}
+    group_ids = {c: i + 1 for i, c in enumerate(sorted(set(changes.values())))}
+    groups = {p: group_ids[changes[p]] for p in positions}
+    representatives = set()
+    for group in set(groups.values()):
+        group_positions = [p for p in positions if groups[p] == group]
+        representatives.update((group_positions[0], group_positions[-1]))
+    representatives = np.array(sorted(representatives))
+    representative_groups = np.array([groups[p] for p in representatives])
+
+    pep_idx = list(range(len(base_seqs)))
+    representative_fragments = []
+    representative_variants = []
+    for position in representatives:
+        placed = list(modifications)
+        placed[pep_index] = modifications[pep_index] + [(int(position) + 2, mod_id)]
+        setup_exact_peptide_db(ctx, base_seqs, placed)
+        fragments = get_singly_charged_fragments(setup, ctx, pep_idx, link_pos)
+        representative_fragments.append(fragments)
+        # residue group carrying the modification within the fragment for each representative
+        ranges = fragments['ranges'][:, pep_index]
+        representative_variants.append(
+            placement_variants(ranges, representatives, representative_groups))
+
+    placement_fragments = []
+    for position in positions:
+        selected = []
+        for i, fragments in enumerate(representative_fragments):
+            ranges = fragments['ranges'][:, pep_index]
+            variant = placement_variants(ranges, np.array([position]),
+                                         np.array([groups[position]]))
+            matching = representative_variants[i] == variant
+            # take each fragment from the first representative holding the same variant
+            selected.append(fragments[matching[:, i] & (matching.argmax(axis=1) == i)])
+        fragments = np.concatenate(selected)
+        fragments.sort()
+        placement_fragments.append(fragments)
+    return placement_fragments
+
+
+def loss_site_changes(losses, amino_acid, mod_id):
+    """
+    Return how modifying a residue changes its loss sites.
+
+    Loss specificities match amino acid and modification of a residue ('X' matches all
+    residues), so modifying a residue can add or remove a loss site.
+
+    :param losses: (list of Loss) losses of the config
+    :param amino_acid: (int) residue (ord)
+    :param mod_id: (int) id of the modification
+    :return: change of the number of loss sites (-1, 0 or 1) for each loss
+    :rtype: tuple
+    """
+    changes = []
+    for loss in losses:
+        if ord('X') in loss.ord_aa_specificity:
+            changes.append(0)
+            continue
+        specificity = set(zip(loss.ord_aa_specificity, loss.mod_specificity_codes))
+        changes.append(int((amino_acid, mod_id) in specificity)
+                       - int((amino_acid, 0) in specificity))
+    return tuple(changes)
+
+
+def placement_variants(ranges, positions, groups):
+    """
+    Return the residue group carrying the modification within the fragments for placements.
+
+    :param ranges: (ndarray) [from, to) ranges of the fragments on the scanned peptide
+    :param positions: (ndarray) 0-based placements of the modification
+    :param groups: (ndarray) residue groups (> 0) of the placements
+    :return: (ndarray) residue group (0 if not within the fragment) per fragment and placement
+    """
+    held = (ranges[:, 0, None] <= positions[None, :]) & (positions[None, :] < ranges[:, 1, None])
+    return np.where(held, groups[None, :], 0)
+
+
+def site_determining_mask(ranges, positions):
+    """
+    Return the mask of the fragments holding some but not all of the candidate positions.
+
+    :param ranges: (ndarray) [from, to) ranges of the fragments on the scanned peptide
+    :param positions: (ndarray) 0-based candidate positions of the modification
+    :return: (ndarray) boolean mask of the site-determining fragments
+    """
+    held = (ranges[:, 0, None] <= positions[None, :]) & (positions[None, :] < ranges[:, 1, None])
+    return held.any(axis=1) & ~held.all(axis=1)
+
+
+def peptide_json(base_sequence, modifications):
+    """
+    Create the xi2 style peptide block of a peptide.
+
+    :param base_sequence: (bytes) unmodified sequence
+    :param modifications: (list) (slot, modification id) pairs, see `request_peptides`
+    :rtype: dict
+    """
+    return {
+        'base_sequence': base_sequence.decode('ascii'),
+        'modification_ids': [mod_id - 1 for _, mod_id in modifications],
+        'modification_positions': [0 if slot == 0 else 32767 if slot == 1 else slot - 1
+                                   for slot, _ in modifications]
+    }
+
+
+def matched_intensity_fraction(annotations, spectrum):
+    """
+    Return the intensity of the peaks in matched isotope clusters relative to the total.
+
+    :param annotations: (ndarray) annotation table of the matched fragments
+    :param spectrum: (Spectrum) isotope detected spectrum
+    :rtype: float
+    """
+    cluster_peaks = spectrum.isotope_cluster_peaks
+    peak_ids = np.unique(cluster_peaks['peak_id'][
+        np.isin(cluster_peaks['cluster_id'], annotations['cluster_id'])])
+    total_intensity = spectrum.int_values.sum()
+    if total_intensity <= 0:
+        return 0.0
+    return float(spectrum.int_values[peak_ids].sum() / total_intensity)
+
+
+def annotation_summary(annotations, spectrum, peptide_lengths):
+    """
+    Summarize the matches of an annotation.
+
+    - matchedFragments: number of matched unique fragments
+    - matchedIntensityFraction: summed intensity of the peaks in matched isotope clusters
+      relative to the total intensity of the spectrum
+    - sequenceCoverage: fraction of the peptide bonds explained by a matched fragment (over all
+      peptides) and peptideCoverage the fraction per peptide
+
+    :param annotations: (ndarray) annotation table of the matched fragments
+    :param spectrum: (Spectrum) isotope detected spectrum
+    :param peptide_lengths: (ndarray) lengths of the peptides
+    :rtype: dict
+    """
+    peptide_lengths = np.asarray(peptide_lengths, dtype=np.int64)
+    n_fragments = len(np.unique(annotations[FRAGMENT_COLS])) if len(annotations) > 0 else 0
+
+    intensity_fraction = matched_intensity_fraction(annotations, spectrum)
+
+    # cleaved bond of the backbone fragments: after idx residues for n-terminal fragments and
+    # before the last idx residues for c-terminal fragments
+    backbone = annotations[annotations['ion_type'] != b'P']
+    pep_ids = backbone['pep_id'].astype(np.int64) - 1
+    lengths = peptide_lengths[pep_ids]
+    idx = backbone['idx'].astype(np.int64)
+    bonds = np.where(backbone['term'] == b'n', idx, lengths - idx)
+    valid = (bonds > 0) & (bonds < lengths)
+    covered = np.unique(np.stack([pep_ids[valid], bonds[valid]]), axis=1)
+    n_covered = np.bincount(covered[0], minlength=len(peptide_lengths))
+    n_bonds = np.maximum(peptide_lengths - 1, 0)
+    return {
+        'matchedFragments': n_fragments,
+        'matchedIntensityFraction': intensity_fraction,
+        'sequenceCoverage': float(n_covered.sum() / n_bonds.sum()) if n_bonds.sum() else 0.0,
+        'peptideCoverage': [float(c / b) if b else 0.0 for c, b in zip(n_covered, n_bonds)]
+    }
+
+
+def setup_request_peptide_db(setup, ctx, peptides_json):
+    """
+    Set up the peptide database of the context with the request peptides.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context to set up
+    :param peptides_json: Peptides block of the request
+    :return: indices of the peptides in the peptide database
+    :rtype: list
+    """
+    # the peptide database holds exactly the request peptides in request order
+    base_seqs, modifications = request_peptides(setup, peptides_json)
+    setup_exact_peptide_db(ctx, base_seqs, modifications)
+    return list(range(len(base_seqs)))
+
+
+def request_precursor(annotation_json):
+    """
+    Return the precursor information of the annotation block.
+
+    :param annotation_json: annotation block of the json request
+    :return: precursor mz, charge and intensity
+    :rtype: dict
+    """
+    return {
+        'mz': annotation_json.get('precursorMZ', None),
+        'charge': annotation_json['precursorCharge'],
+        'intensity': annotation_json.get('precursorIntensity', -1)
+    }
+
+
+def process_request_peaks(json_request, ctx, timer):
+    """
+    Detect the isotope clusters of the request peaks and create the peaks and clusters blocks.
+
+    :param json_request: JSON annotation request (peaks get replaced by the response peaks)
+    :param ctx: (MockContext) context holding the isotope detection settings
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: isotope detected spectrum
+    :rtype: Spectrum
+    """
+    # create Spectrum object
+    precursor = request_precursor(json_request['annotation'])
+    mz_array, int_array, peaks_dtype = decode_peaks(json_request['peaks'])
+
+    # Process Spectrum for annotation:
+    # detect and reduce isotope clusters to monoisotopic peaks
+    full_match_spectrum = get_processed_spectrum(ctx, precursor, mz_array, int_array)
+    timer.lap('isotope_detection')
+    timer.count('peaks', len(mz_array))
+    timer.count('clusters', len(full_match_spectrum.isotope_cluster_charge_values))
+
+    # create response peaks block with clusterIds mz-ordered
+    isotope_cluster_peaks = full_match_spectrum.isotope_cluster_peaks
+    peaks_format = json_request['annotation'].get('peaksFormat', 'full')
+    if peaks_format not in PEAKS_FORMATS:
+        raise ValueError(f"Unsupported peaksFormat: {peaks_format}")
+    if peaks_format == 'none':
+        del json_request['peaks']
+    elif peaks_format == 'compact':
+        json_request['peaks'] = compact_peak_clusters(isotope_cluster_peaks)
+    elif peaks_dtype is None:
+        peak_clusters = peak_cluster_ids(isotope_cluster_peaks,
+                                         len(full_match_spectrum.mz_values))
+        json_request['peaks'] = [
+            {'mz': m, 'intensity': i, 'clusterIds': cids}
+            for m, i, cids in zip(full_match_spectrum.mz_values.tolist(),
+                                  full_match_spectrum.int_values.tolist(), peak_clusters)
+        ]
+    else:
+        json_request['peaks'] = {
+            'encoding': 'base64',
+            'dtype': peaks_dtype,
+            'mz': encode_peak_array(full_match_spectrum.mz_values, peaks_dtype),
+            'intensity': encode_peak_array(full_match_spectrum.int_values, peaks_dtype),
+            'clusterIds': peak_cluster_ids(isotope_cluster_peaks,
+                                           len(full_match_spectrum.mz_values))
+        }
+
+    # create clusters
+    json_request['clusters'] = [
+        {'charge': c, 'firstPeakId': p}
+        for c, p in zip(full_match_spectrum.isotope_cluster_charge_values.tolist(),
+                        cluster_first_peak_ids(isotope_cluster_peaks).tolist())
+    ]
+    timer.lap('response')
+    return full_match_spectrum
+
+
+def annotate_peptides(json_request, setup, ctx, pep_idx, full_match_spectrum, timer):
+    """
+    Annotate the isotope detected spectrum with the fragments of the request peptides.
+
+    Writes the fragments, LinkSite and the annotation block values of the response.
+
+    :param json_request: JSON annotation request (gets modified to become the response)
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context with the peptide database set up
+    :param pep_idx: (list of int) indices of the peptides in the peptide database
+    :param full_match_spectrum: (Spectrum) isotope detected spectrum
+    :param timer: (StageTimer) timer recording the durations of the annotation stages
+    :return: annotation table of the matched fragments
+    :rtype: ndarray
+    """
+    return_mod_syntax = setup.return_mod_syntax
+    is_crosslinked = setup.is_crosslinked
+    crosslinker = setup.crosslinker
+    precursor = request_precursor(json_request['annotation'])
+
+    # create fragments
+    n_peptides = len(ctx.peptide_db.peptides)
+    # Linear
+    if n_peptides == 1:
+        link_pos = None
+        # overwrite LinkSite with empty list for linears
+        json_request['LinkSite'] = []
+    elif n_peptides == 2:
+        link_pos = (json_request['LinkSite'][0]['linkSite'],
+                    json_request['LinkSite'][1]['linkSite'])
+    else:
+        raise ValueError("Unsupported number of peptides given!")
+    fragments = get_fragments(setup, ctx, pep_idx, link_pos, precursor['charge'])
+    timer.lap('fragmentation')
+    timer.count('fragments', len(fragments))
+
+    # annotate the spectrum with fragments
+    annotations = full_match_spectrum.annotate_spectrum(fragments, ctx)
+    timer.lap('annotation')
+    timer.count('annotations', len(annotations))
+
+    if json_request['annotation'].get('responseFormat') == 'columnar':
+        json_request['fragments'] = columnar_fragments(annotations)
+    elif len(annotations) == 0:
+        json_request['fragments'] = []
+    else:
+        # generate peptides in return_mod_syntax as list of modified amino acids
+        # for assembly of fragment sequences
+        if return_mod_syntax == 'modX':
+            pep_to_aa_re = const.PEPTIDE_TO_AMINO_ACID
+        elif return_mod_syntax == 'Xmod':
+            pep_to_aa_re = re.compile(b'([A-Z][^A-Z\\-]*)')
+
+        return_pep1 = ctx.peptide_db.mod_pep_sequence([pep_idx[0]],
+                                                      mod_peptide_syntax=return_mod_syntax)
+        pep_mod_arr1 = pep_to_aa_re.findall(return_pep1)
+        return_pep2 = ctx.peptide_db.mod_pep_sequence([pep_idx[1]],
+                                                      mod_peptide_syntax=return_mod_syntax) \
+            if n_peptides == 2 else None
+        pep_mod_arr2 = pep_to_aa_re.findall(return_pep2) if n_peptides == 2 else []
+        pep_mod_arr = [pep_mod_arr1, pep_mod_arr2]
+
+        # create unique fragments
+        fragment_cols = FRAGMENT_COLS
+        annotations.sort(order=fragment_cols)
+        if len(annotations) == 1:
+            fragments = annotations[fragment_cols]
+            frag_indices = [0]
+            frag_counts = [1]
+        else:
+            fragments, frag_indices, frag_counts = np.unique(
+                annotations[fragment_cols], return_index=True, return_counts=True)
+
+        json_request['fragments'] = []
+        for i, f in enumerate(fragments):
+            name = f['ion_type'].decode('ascii')
+            if f['ion_type'] != b'P':
+                name += str(f['idx'])
+            if not f['LN']:
+                name += '+P'
+            name += f['stub'].decode('ascii')
+            if f['nlosses'] > 0:
+                name += '_' + f['loss'].decode('ascii')
+            # get all annotations for this fragment
+            f_annotations = annotations[frag_indices[i]: frag_indices[i] + frag_counts[i]]
+
+            # loop over fragment annotations for clusterIds and clusterInfo
+            cluster_ids = []
+            cluster_info = []
+            for annotation in f_annotations:
+                # NumPy values are serialized by the app's JSON provider
+                cluster_id = annotation['cluster_id']
+                # append to cluster ids
+                cluster_ids.append(cluster_id)
+                cluster_info.append({
+                    'Clusterid': cluster_id,
+                    'calcMZ': annotation['frag_mz'],
+                    'error': annotation['rel_error'] / 1e-6,
+                    'errorUnit': 'ppm',
+                    'matchedMissingMonoIsotopic': int(annotation['missing_monoisotopic_peak']),
+                    'matchedCharge': annotation['frag_charge']
+                })
+
+            # reformat ranges according to annotator format
+            f_pep_id = f['pep_id'] - 1  # change pep_id from 1-based to 0-based
+
+            if f['LN']:
+                ranges = [{
+                    'peptideId': int(f_pep_id),
+                    'from': int(f['ranges'][f_pep_id][0]),
+                    'to': int(f['ranges'][f_pep_id][1]) - 1
+                }]
+            else:
+                ranges = [{'peptideId': pep_id, 'from': int(r[0]), 'to': int(r[1]) - 1}
+                          for pep_id, r in enumerate(f['ranges'])]
+
+            # assemble fragment sequence
+            frag_sequence = [pep_mod_arr[i][r[0]:r[1]]
+                             for i, r in enumerate(f['ranges']) if r.sum() > 0]
+            frag_sequence_str = ' + '.join(
+                [''.join([aa.decode() for aa in seq]) for seq in frag_sequence])
+            fragment = {
+                'name': name,
+                'ionNumber': int(f['idx']),
+                'peptideId': int(f_pep_id),
+                'range': ranges,
+                'type': f['ion_type'].decode('ascii'),
+                # ToDo: change class to primary True, False? or just have field nlosses
+                'class': 'lossy' if f['nlosses'] > 0 else 'non-lossy',
+                'nlosses': int(f['nlosses']),
+                'stub': f['stub'].decode('ascii'),
+                'clusterIds': cluster_ids,
+                'clusterInfo': cluster_info,
+                'sequence': frag_sequence_str
+            }
+            json_request['fragments'].append(fragment)
+
+    # theoretical calculated precursor m/z and error
+    peptides_mass = ctx.peptide_db.peptide_mass(np.arange(n_peptides)).sum()
+    if is_crosslinked:
+        cl_mass = crosslinker.mass
+        peptides_mass += cl_mass
+    calc_mz = (peptides_mass / precursor['charge']) + const.PROTON_MASS
+    json_request['annotation']['calculatedMZ'] = calc_mz
+    if precursor['mz'] is None:
+        json_request['annotation']['precursorError'] = ''
+    else:
+        json_request['annotation']['precursorError'] = {
+            'tolerance': (precursor['mz'] - calc_mz) / calc_mz * 1e6,
+            'unit': 'ppm'
+        }
+
+    # write out config derived values (crosslinker, modifications and losses)
+    setup.apply(json_request['annotation'])
+
+    # ToDo: the version should come from a central place
+    json_request['annotation']['xiVersion'] = const.VERSION
+    timer.lap('response')
+
+    return annotations
+
+
+def columnar_fragments(annotations):
+    """
+    Create the fragments block in columnar format.
+
+    Instead of a list of fragment dicts each holding a list of cluster matches, the fragments
+    are returned as parallel arrays and the matches as a flat table referencing the fragments
+    by their index. Ranges are 0-based and inclusive with one array per peptide, -1 marks
+    fragments not covering the peptide.
+
+    :param annotations: (ndarray) annotation table from annotate_spectrum
+    :return: fragments block with parallel arrays
+    :rtype: dict
+    """
+    annotations = np.sort(annotations, order=FRAGMENT_COLS)
+    if len(annotations) < 2:
+        fragments = annotations[FRAGMENT_COLS]
+        frag_index = np.zeros(len(annotations), dtype=np.intp)
+    else:
+        fragments, frag_index = np.unique(annotations[FRAGMENT_COLS], return_inverse=True)
+
+    # assemble fragment names
+    ion_type = fragments['ion_type']
+    names = np.char.add(ion_type, np.where(ion_type != b'P', fragments['idx'].astype('S3'), b''))
+    names = np.char.add(names, np.where(fragments['LN'], b'', b'+P'))
+    names = np.char.add(names, fragments['stub'])
+    names = np.char.add(names, np.where(fragments['nlosses'] > 0,
+                                        np.char.add(b'_', fragments['loss']), b''))
+
+    # ranges, pep_id is 1-based and linear fragments only cover their own peptide
+    ranges = fragments['ranges'].astype(np.int16)
+    covered = ~fragments['LN'][:, None] | (
+        fragments['pep_id'][:, None] - 1 == np.arange(2)[None, :])
+    range_from = np.where(covered, ranges[:, :, 0], -1)
+    range_to = np.where(covered, ranges[:, :, 1] - 1, -1)
+
+    return {
+        'name': names.astype(str).tolist(),
+        'ionNumber': fragments['idx'],
+        'peptideId': fragments['pep_id'].astype(np.int16) - 1,
+        'type': ion_type.astype(str).tolist(),
+        'nlosses': fragments['nlosses'],
+        'stub': fragments['stub'].astype(str).tolist(),
+        'rangeFrom': range_from.T,
+        'rangeTo': range_to.T,
+        'matches': {
+            'fragmentIndex': frag_index.reshape(-1),
+            'clusterId': annotations['cluster_id'],
+            'calcMZ': annotations['frag_mz'],
+            'error': annotations['rel_error'] / 1e-6,
+            'errorUnit': 'ppm',
+            'matchedCharge': annotations['frag_charge'],
+            'matchedMissingMonoIsotopic': annotations['missing_monoisotopic_peak'].astype(np.uint8)
+        }
+    }
+
+
+def decode_peaks(peaks):
+    """
+    Decode the peaks block of a request into m/z and intensity arrays.
+
+    The peaks are either a list of {'mz': .., 'intensity': ..} objects or a dict with base64
+    encoded little-endian buffers:
+    {'encoding': 'base64', 'dtype': 'float64'|'float32', 'mz': '..', 'intensity': '..'}.
+    The buffers are wrapped with np.frombuffer without copying. Requests built in process
+    (e.g. by annotate_file) pass the already decoded (m/z array, intensity array) tuple, which
+    is echoed like a list.
+
+    :param peaks: (list|dict|tuple) peaks block of the request
+    :return: m/z array, intensity array and the dtype name of encoded peaks (None for a list
+        or tuple)
+    :rtype: tuple
+    """
+    if isinstance(peaks, tuple):
+        mz_array, int_array = peaks
+        if len(mz_array) != len(int_array):
+            raise ValueError("Number of m/z and intensity values of the peaks differ!")
+        return (np.asarray(mz_array, dtype=np.float64), np.asarray(int_array, dtype=np.float64),
+                None)
+    if not isinstance(peaks, dict):
+        mz_array = np.array([p['mz'] for p in peaks], dtype=np.float64)
+        int_array = np.array([p['intensity'] for p in peaks], dtype=np.float64)
+        return mz_array, int_array, None
+    if peaks.get('encoding') != 'base64':
+        raise ValueError(f"Unsupported peaks encoding: {peaks.get('encoding')}")
+    dtype = peaks.get('dtype', 'float64')
+    if dtype not in PEAK_DTYPES:
+        raise ValueError(f"Unsupported peaks dtype: {dtype}")
+    mz_array = np.frombuffer(base64.b64decode(peaks['mz']), dtype=PEAK_DTYPES[dtype])
+    int_array = np.frombuffer(base64.b64decode(peaks['intensity']), dtype=PEAK_DTYPES[dtype])
+    if len(mz_array) != len(int_array):
+        raise ValueError("Number of m/z and intensity values of the peaks differ!")
+    return mz_array, int_array, dtype
+
+
+def encode_peak_array(values, dtype):
+    """
+    Encode peak values as base64 little-endian buffer.
+
+    :param values: (ndarray) peak values (m/z or intensity)
+    :param dtype: (str) dtype name of the buffer ('float64' or 'float32')
+    :rtype: str
+    """
+    return base64.b64encode(
+        np.asarray(values, dtype=PEAK_DTYPES[dtype]).tobytes()).decode('ascii')
+
+
+def peak_cluster_ids(isotope_cluster_peaks, n_peaks):
+    """
+    Group the cluster ids of the isotope cluster peaks by peak.
+
+    Sorts the cluster peaks by peak id (stable, so the cluster ids of each peak keep their
+    order) and splits the sorted cluster ids at the peak boundaries.
+    :param isotope_cluster_peaks: (ndarray) peak_cluster table of the processed spectrum
+    :param n_peaks: (int) number of peaks in the spectrum
+    :return: cluster ids for each peak
+    :rtype: list of lists
+    """
+    order = np.argsort(isotope_cluster_peaks['peak_id'], kind='stable')
+    sorted_peak_ids = isotope_cluster_peaks['peak_id'][order]
+    cluster_ids = isotope_cluster_peaks['cluster_id'][order].tolist()
+    bounds = np.searchsorted(sorted_peak_ids, np.arange(n_peaks + 1)).tolist()
+    return [cluster_ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def compact_peak_clusters(isotope_cluster_peaks):
+    """
+    Create the compact peaks block holding only the cluster membership of the peaks.
+
+    The m/z and intensity values are not repeated, the peak ids refer to the m/z-ordered
+    peaks of the request. Peaks belonging to several clusters occur once per cluster.
+
+    :param isotope_cluster_peaks: (ndarray) peak_cluster table of the processed spectrum
+    :return: parallel arrays of peak ids and cluster ids ordered by peak id
+    :rtype: dict
+    """
+    order = np.argsort(isotope_cluster_peaks['peak_id'], kind='stable')
+    return {'peakIds': isotope_cluster_peaks['peak_id'][order].tolist(),
+            'clusterIds': isotope_cluster_peaks['cluster_id'][order].tolist()}
+
+
+def cluster_first_peak_ids(isotope_cluster_peaks):
+    """
+    Return the id of the first peak of each isotope cluster.
+
+    :param isotope_cluster_peaks: (ndarray) peak_cluster table of the processed spectrum
+    :return: (ndarray) first peak id for each cluster id
+    """
+    _, cluster_indices = np.unique(isotope_cluster_peaks['cluster_id'], return_index=True)
+    return isotope_cluster_peaks['peak_id'][cluster_indices]
+
+
+def create_fragments(setup, ctx, pep_idx, link_pos):
+    """
+    Create the singly charged fragments including losses for the peptides in the context.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param ctx: (MockContext) context with the peptide database set up
+    :param pep_idx: (list of int) indices of the peptides in the peptide database
+    :param link_pos: (tuple of int) 0-based link sites of the two peptides, (-1, -1) for
+        noncovalently associated peptides and None for linear peptides
+    :return: (ndarray) sorted fragments at charge 1
+    """
+    add_precursor = setup.config.fragmentation.add_precursor
+    # Linear
+    if link_pos is None:
+        fragments = fragment_linear_peptide(0, ctx, add_precursor=add_precursor)
+        fragments = include_losses(fragments, [0], ctx)
+    else:
+        # noncovalently associated peptides NAPs
+        if link_pos[0] == -1 and link_pos[1] == -1:
+            fragments = fragment_noncovalent_peptide_pair(
+                pep_idx[0], pep_idx[1], ctx, add_precursor=add_precursor)
+        # Crosslinked peptide
+        elif setup.is_crosslinked:
+            fragments = fragment_crosslinked_peptide_pair(
+                pep_idx[0], pep_idx[1], link_pos[0], link_pos[1],
+                setup.crosslinker, ctx, add_precursor=add_precursor)
+        else:
+            raise ValueError("2 peptides with crosslink positions defined but no crosslinker.")
+        fragments = include_losses(fragments, [pep_idx[0], pep_idx[1]], ctx)
+    fragments.sort()
+    return fragments
+
+
+def spread_fragment_charges(fragments, max_charge):
+    """
+    Create the fragments in all charge states from 1 to max_charge.
+
+    Gives the same result as xicommon's spread_charges but derives the charged m/z values in
+    one vectorized step and replaces the sort of the whole structured table by a lexsort on
+    (m/z, charge, position in the sorted singly charged table).
+
+    :param fragments: (ndarray) sorted fragments at charge 1 (see `create_fragments`)
+    :param max_charge: (int) maximal fragment charge
+    :return: (ndarray) sorted fragments in all charge states
+    """
+    n_frags = fragments.size
+    frag_indices = np.tile(np.arange(n_frags), max_charge)
+    charges = np.repeat(np.arange(1, max_charge + 1, dtype=fragments.dtype['charge']), n_frags)
+    mzs = (fragments['mz'][frag_indices] + (charges - 1) * const.PROTON_MASS) / charges
+    order = np.lexsort((frag_indices, charges, mzs))
+    charged = fragments[frag_indices[order]]
+    charged['charge'] = charges[order]
+    charged['mz'] = mzs[order]
+    return charged
+
+
+def peptide_key(ctx, pep_idx):
+    """
+    Create a hashable canonical form of the peptides.
+
+    :param ctx: (MockContext) context with the peptide database set up
+    :param pep_idx: (list of int) indices of the peptides in the peptide database
+    :return: unmodified sequence and modifications (including termini) of each peptide
+    :rtype: tuple
+    """
+    key = []
+    for idx in pep_idx:
+        sequence = ctx.peptide_db.unmod_pep_sequence(idx)
+        modifications = ctx.peptide_db.peptides['modifications'][idx][:len(sequence) + 2]
+        key.append((bytes(sequence), modifications.tobytes()))
+    return tuple(key)
+
+
+def get_singly_charged_fragments(setup, ctx, pep_idx, link_pos):
+    """
+    Return the (cached) singly charged fragments including losses for the peptides.
+
+    The fragments are cached independent of the precursor charge, the key is built from the
+    setup key (covering ion types, add_precursor and losses), the canonical peptides, the link
+    sites and the crosslinker. Cached fragment tables are read-only.
+
+    See `create_fragments` for the parameters.
+    :return: (ndarray) sorted fragments at charge 1
+    """
+    key = (setup.key, peptide_key(ctx, pep_idx), link_pos, setup.crosslinker_idx)
+    fragments = fragment_cache.get(key)
+    if fragments is None:
+        fragments = create_fragments(setup, ctx, pep_idx, link_pos)
+        fragments.flags.writeable = False
+        fragment_cache.put(key, fragments)
+    return fragments
+
+
+def get_fragments(setup, ctx, pep_idx, link_pos, charge):
+    """
+    Return the charged fragments including losses for the peptides in the context.
+
+    The singly charged fragments come from the fragment cache (see
+    `get_singly_charged_fragments`), the charge states are spread for each request.
+
+    See `create_fragments` for the parameters.
+    :param charge: (int) precursor charge (maximal fragment charge)
+    :return: (ndarray) fragments in all charge states
+    """
+    fragments = get_singly_charged_fragments(setup, ctx, pep_idx, link_pos)
+    return spread_fragment_charges(fragments, charge)
+
+
+def request_peptides(setup, peptides_json):
+    """
+    Read the unmodified sequences and modifications of the request peptides.
+
+    Supports the xi2 style (base_sequence, modification_ids and modification_positions) and
+    the xi1 style (list of aminoAcid and Modification name) peptides.
+
+    :param setup: (AnnotationSetup) setup of the annotation
+    :param peptides_json: Peptides block of the request
+    :return: unmodified sequences (bytes) and the (slot, modification id) pairs of each peptide
+        (slot 0 is the n-terminus, 1 the c-terminus and i + 2 the i-th amino acid; id 0 is
+        unmodified, i + 1 the i-th modification of the config)
+    :rtype: tuple
+    """
+    base_seqs = []
+    modifications = []
+    for peptide in peptides_json:
+        # xi2 style: 0 is n-terminal, 32767 is c-terminal, else 1-based amino acid position
+        if 'base_sequence' in peptide:
+            base_seqs.append(peptide['base_sequence'].encode('ascii'))
+            modifications.append([
+                (0 if pos == 0 else 1 if pos == 32767 else pos + 1, mod_id + 1)
+                for mod_id, pos in zip(peptide['modification_ids'],
+                                       peptide['modification_positions'])])
+        # xi1 style: modX sequence
+        else:
+            pep_seq = ''.join([aa['Modification'] + aa['aminoAcid']
+                               for aa in peptide['sequence']])
+            parts = MODX_PARTS_RE.findall(pep_seq)
+            amino_acids = parts[1:-1]
+            mods = [(0, setup.modification_ids[parts[0]]),
+                    (1, setup.modification_ids[parts[-1]])]
+            mods += [(i + 2, setup.modification_ids[aa[:-1]])
+                     for i, aa in enumerate(amino_acids)]
+            base_seqs.append(''.join([aa[-1] for aa in amino_acids]).encode('ascii'))
+            modifications.append([(slot, mod_id) for slot, mod_id in mods if mod_id > 0])
+    return base_seqs, modifications
+
+
+def setup_exact_peptide_db(ctx, base_sequences, modifications):
+    """
+    Set up the peptide database of the context with exactly the given peptides.
+
+    Unlike MockContext.setup_peptide_db(_xi2annotator) the peptides are neither sorted nor
+    made unique, so a peptide's index in the database is its index in the request. No fragment
+    database, site info table or variable modification counts are built, so the cost only
+    depends on the number of peptides.
+
+    :param ctx: (MockContext) context to set up (replaces a previous peptide database)
+    :param base_sequences: (list of bytes) unmodified sequences of the peptides
+    :param modifications: (list) (slot, modification id) pairs of each peptide, see
+        `request_peptides`
+    """
+    sequences = np.array(base_sequences)
+    peptides = np.zeros(len(base_sequences), [
+        ('sequence_index', np.intp),
+        ('modifications', np.uint8, (sequences.dtype.itemsize + 2,)),
+        ('linear_only', np.bool_),
+        ('var_mod_count', np.uint8)])
+    peptides['sequence_index'] = np.arange(len(base_sequences))
+    for i, mods in enumerate(modifications):
+        for slot, mod_id in mods:
+            peptides['modifications'][i, slot] = mod_id
+
+    ctx.unmodified_peptide_sequences = sequences
+    ctx.modified_peptides = peptides
+    ctx.fixed_mod_peptide_sequences = None
+    ctx.site_info_table = None
+    ctx.fragment_db = None
+    ctx.peptide_db = SimplePeptideDatabase(ctx)
+    ctx.peptide_aa_lengths = np.char.str_len(sequences)
+    ctx.modified_peptides_aa_lengths = ctx.peptide_aa_lengths
+
+
+def isotope_key(ctx, mz_array, int_array, charge):
+    """
+    Create the isotope cache key of a peak list.
+
+    :param ctx: (MockContext) context holding the isotope detection settings
+    :param mz_array: (ndarray) m/z values of the peaks
+    :param int_array: (ndarray) intensity values of the peaks
+    :param charge: (int) precursor charge (limits the detected cluster charges)
+    :return: digest of the peaks, the precursor charge and the isotope detection settings
+    :rtype: tuple
+    """
+    peaks_hash = hashlib.sha1(np.ascontiguousarray(mz_array, dtype=np.float64).tobytes())
+    peaks_hash.update(np.ascontiguousarray(int_array, dtype=np.float64).tobytes())
+    isotope_config = ctx.config.isotope_config
+    settings = (ctx.get_isotope_rtol(''), isotope_config.cluster_calc_size,
+                isotope_config.max_mono_to_first_peak_ratio,
+                isotope_config.avergine_min_cluster_size, isotope_config.avergine_breakup_factor,
+                getattr(ctx.config, 'max_cluster_size', None))
+    return peaks_hash.hexdigest(), charge, settings
+
+
+def get_processed_spectrum(ctx, precursor, mz_array, int_array):
+    """
+    Return the (cached) isotope detected spectrum of a peak list.
+
+    The cached spectra only hold read-only arrays (peaks, cluster values and the
+    peak_cluster table), the list of Cluster objects is dropped. Each call returns a shallow
+    copy carrying the precursor of the request, so concurrent requests share the arrays safely.
+
+    :param ctx: (MockContext) context holding the isotope detection settings
+    :param precursor: (dict) precursor information (mz, charge and intensity)
+    :param mz_array: (ndarray) m/z values of the peaks
+    :param int_array: (ndarray) intensity values of the peaks
+    :return: isotope detected spectrum
+    :rtype: Spectrum
+    """
+    key = isotope_key(ctx, mz_array, int_array, precursor['charge'])
+    processed = isotope_cache.get(key)
+    if processed is None:
+        spectrum = Spectrum(precursor, mz_array, int_array, -1)
+        processed = IsotopeDetector(ctx).process(spectrum)
+        processed.isotope_cluster = None
+        for value in vars(processed).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        isotope_cache.put(key, processed)
+    spectrum = copy.copy(processed)
+    spectrum.precursor = dict(precursor)
+    spectrum._precursor_mass = None
+    return spectrum
+
+
 def create_config_from_json_format(annotation_json):
     """
     Create a Config from the xi1 json format.
@@ -19,13 +19,15 @@ import os
 
 from flask import Flask
 from flask_cors import CORS
+from xi2annotator.json_provider import NumpyJSONProvider
 
 
-def create_app():
+def create_app(config=None):
     """
     Create the flask app.
 
     Currently only used for annotation.
+    :param config: (dict) config values overriding the loaded config
     :return: flask app
     """
     app = Flask(__name__)
@@ -39,18 +41,86 @@ def create_app():
             app.config.from_envvar('XI2ANNOTATOR_SETTINGS')
         except (FileNotFoundError, RuntimeError):
             ...
+    if config is not None:
+        app.config.update(config)
+
+    # serialize NumPy values natively (using orjson if available)
+    app.json = NumpyJSONProvider(app, use_orjson=app.config['JSON_USE_ORJSON'])
 
     # add CORS header
     CORS(app, resources={
         r"/xiAnnotator/annotate/FULL": {
             "origins": "*",
-            "headers": app.config['CORS_HEADERS']
+            "headers": [app.config['CORS_HEADERS'], 'Content-Encoding', 'X-Server-Timing'],
+            "expose_headers": ['ETag', 'Retry-After', 'Server-Timing']
+        },
+        r"/xiAnnotator/annotate/BATCH": {
+            "origins": "*",
+            "headers": [app.config['CORS_HEADERS'], 'Content-Encoding']
+        },
+        r"/xiAnnotator/annotate/CANDIDATES": {
+            "origins": "*",
+            "headers": [app.config['CORS_HEADERS'], 'Content-Encoding']
+        },
+        r"/xiAnnotator/annotate/LINKSITES": {
+            "origins": "*",
+            "headers": [app.config['CORS_HEADERS'], 'Content-Encoding']
+        },
+        r"/xiAnnotator/annotate/MODSITES": {
+            "origins": "*",
+            "headers": [app.config['CORS_HEADERS'], 'Content-Encoding']
+        },
+        r"/xiAnnotator/annotate/STREAM": {
+            "origins": "*",
+            "headers": [app.config['CORS_HEADERS'], 'Content-Encoding']
         }
     })
 
+    # size the in-process caches
+    from xi2annotator.cache import setup_cache, fragment_cache, isotope_cache
+    setup_cache.resize(app.config['SETUP_CACHE_SIZE'])
+    fragment_cache.resize(app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_BYTES'])
+    isotope_cache.resize(app.config['ISOTOPE_CACHE_SIZE'], app.config['ISOTOPE_CACHE_BYTES'])
+
     from xi2annotator import bp
     app.register_blueprint(bp)
 
+    # optionally run the FULL annotations in a bounded executor
+    if app.config['ANNOTATION_EXECUTOR'] is not None:
+        from xi2annotator.executor import BoundedExecutor
+        from xi2annotator.routes import annotate_async
+        app.extensions['xi2annotator.executor'] = BoundedExecutor(
+            app.config['ANNOTATION_WORKERS'], app.config['ANNOTATION_QUEUE_DEPTH'],
+            processes=app.config['ANNOTATION_EXECUTOR'] == 'process')
+        app.view_functions['xi2annotator.annotate'] = annotate_async
+
+    # sampled profiling of the annotations
+    if app.config['PROFILE_DIR']:
+        from xi2annotator.profiling import RequestProfiler
+        app.extensions['xi2annotator.profiler'] = RequestProfiler(
+            app.config['PROFILE_DIR'], app.config['PROFILE_EVERY'],
+            app.config['PROFILE_SLOWER_THAN'], app.config['PROFILE_MAX_BYTES'],
+            app.config['PROFILE_SLOW_SAMPLES'])
+
+    # warm-up and /ready endpoint
+    from xi2annotator.warmup import init_startup
+    init_startup(app)
+
+    # annotation request metrics and the /metrics endpoint
+    if app.config['METRICS']:
+        from xi2annotator.metrics import init_metrics
+        init_metrics(app)
+
+    # compressed request and response bodies, registered after the metrics so the response
+    # gets compressed before its size is recorded
+    if app.config['COMPRESSION']:
+        from xi2annotator.compression import init_compression
+        init_compression(app)
+
+    from xi2annotator.routes import response_cache
+    response_cache.resize(app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_BYTES'],
+                          app.config['RESPONSE_CACHE_TTL'])
+
     return app
 
 
@@ -0,0 +1,493 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Benchmark the annotation with the load test data sets.
+
+The requests are created from the load test peak lists: the crosslinked and linear sets join
+the xi result PSMs to their spectra, the large proteome sets (MITO, E. coli) annotate the
+spectra with random peptide (pair) candidates from the tryptic digest of their FASTA file.
+The requests are run against an in-process app or a running server and the throughput,
+latency percentiles and the time spent in the annotation stages are reported as JSON.
+The peak cluster benchmark compares the vectorized peak to isotope cluster mapping of the
+response with a per-peak lookup on increasing numbers of load test peaks.
+"""
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy as np
+from xi2annotator.timing import StageTimer, STAGES
+
+# load test data sets (files in the load test data directory)
+BENCH_SETS = {
+    'crosslinked': {
+        'mgf': '1_HSA_SDA_AB_load_test_small.mgf',
+        'config': '1_HSA_SDA_AB_xi2_config.json',
+        'psms': 'HSA-S_good_cl_xi1_results.csv',
+    },
+    'linear': {
+        'mgf': '1_HSA_SDA_AB_load_test_small.mgf',
+        'config': '1_HSA_SDA_AB_xi2_config.json',
+        'psms': 'HSA-S_linear_xi1_results.csv',
+    },
+    'mito': {
+        'mgf': '2_MITO_L.mgf',
+        'config': '2_MITO_config.json',
+        'fasta': '2_MITO.fasta',
+    },
+    'ecoli': {
+        'mgf': '3_ecoli_BS3_LS_load_test_large.mgf',
+        'config': '3_ecoli_BS3_LS_xi2_config.json',
+        'fasta': '3_4_Ecoli_LS_ID2_2up_1E5.fasta',
+    },
+}
+
+# load test directory of a source checkout (not part of an installed package)
+DEFAULT_DATA_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'load_test'))
+
+# peak list and peak counts of the peak cluster benchmark
+PEAK_CLUSTER_MGF = '1_HSA_SDA_AB_load_test_large.mgf'
+PEAK_COUNTS = [250, 1000, 2500, 5000]
+
+AMINO_ACIDS = set('ACDEFGHIKLMNPQRSTVWY')
+
+
+def check_data_dir(data_dir):
+    """
+    Check that the load test data directory exists.
+
+    :param data_dir: (str) directory containing the load test files
+    :raises FileNotFoundError: if the directory doesn't exist
+    """
+    if not os.path.isdir(data_dir):
+        raise FileNotFoundError(
+            f"Load test data directory {data_dir} not found (the default only exists in a "
+            f"source checkout), set the directory with --data-dir")
+
+
+def read_fasta(fasta_path):
+    """
+    Read the protein sequences of a FASTA file.
+
+    :param fasta_path: (str) path to the FASTA file
+    :rtype: list of str
+    """
+    proteins = []
+    with open(fasta_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                proteins.append('')
+            elif proteins:
+                proteins[-1] += line
+    return proteins
+
+
+def tryptic_peptides(proteins, missed_cleavages=2, min_length=6, max_length=40):
+    """
+    Digest the proteins with trypsin (cleaving after K/R, not before P).
+
+    :param proteins: (list of str) protein sequences
+    :param missed_cleavages: (int) maximal number of missed cleavages
+    :param min_length: (int) minimal peptide length
+    :param max_length: (int) maximal peptide length
+    :return: sorted unique peptides consisting of standard amino acids only
+    :rtype: list of str
+    """
+    peptides = set()
+    for protein in proteins:
+        sites = [0] + [i + 1 for i in range(len(protein) - 1)
+                       if protein[i] in 'KR' and protein[i + 1] != 'P'] + [len(protein)]
+        for start in range(len(sites) - 1):
+            for end in range(start + 1, min(start + missed_cleavages + 2, len(sites))):
+                peptide = protein[sites[start]:sites[end]]
+                if min_length <= len(peptide) <= max_length and set(peptide) <= AMINO_ACIDS:
+                    peptides.add(peptide)
+    return sorted(peptides)
+
+
+def random_candidate_requests(spectra, peptides, config_json, seed=0):
+    """
+    Create crosslinked FULL requests annotating the spectra with random peptide pairs.
+
+    The fixed modifications of the config are applied and the peptides are linked at a random
+    lysine (or the n-terminus if the peptide has no lysine).
+
+    :param spectra: (list of Spectrum) spectra to annotate
+    :param peptides: (list of str) candidate peptides
+    :param config_json: (dict) xi2 config
+    :param seed: (int) seed of the random candidate selection
+    :rtype: list
+    """
+    from xi2annotator.psm import peptide_json, spectrum_request
+    rng = random.Random(seed)
+    modifications = config_json.get('modification', {}).get('modifications', [])
+    modification_names = [m['name'] for m in modifications]
+    fixed_mods = {aa: m['name'] for m in modifications if m['type'] == 'fixed'
+                  for aa in m['specificity'] if len(aa) == 1}
+
+    requests = []
+    for spectrum in spectra:
+        pair = []
+        link_sites = []
+        for peptide in rng.sample(peptides, 2):
+            xmod_sequence = ''.join(aa + fixed_mods.get(aa, '') for aa in peptide)
+            pair.append(peptide_json(xmod_sequence, modification_names))
+            lysines = [i for i, aa in enumerate(peptide[:-1]) if aa == 'K']
+            link_sites.append(rng.choice(lysines) if lysines else 0)
+        requests.append(spectrum_request(spectrum, pair, link_sites, config_json))
+    return requests
+
+
+def load_bench_requests(name, data_dir=DEFAULT_DATA_DIR, limit=None, seed=0):
+    """
+    Create the FULL requests of a load test data set.
+
+    :param name: (str) name of the data set (key of BENCH_SETS)
+    :param data_dir: (str) directory containing the load test files
+    :param limit: (int) maximal number of requests (None for all)
+    :param seed: (int) seed of the random candidates of the large proteome sets
+    :rtype: list
+    """
+    from xicommon.config import Config
+    from xi2annotator.psm import read_psms, read_spectra, psm_requests
+    bench_set = BENCH_SETS[name]
+    with open(os.path.join(data_dir, bench_set['config'])) as f:
+        config_json = json.load(f)
+    spectra = read_spectra(os.path.join(data_dir, bench_set['mgf']), Config(**config_json))
+
+    if 'psms' in bench_set:
+        psms = read_psms(os.path.join(data_dir, bench_set['psms']))
+        requests = psm_requests(psms, spectra, config_json)
+    else:
+        missed_cleavages = config_json.get('digestion', {}).get('missed_cleavages', 2)
+        peptides = tryptic_peptides(read_fasta(os.path.join(data_dir, bench_set['fasta'])),
+                                    missed_cleavages)
+        spectra = list(spectra.values())[:limit]
+        requests = random_candidate_requests(spectra, peptides, config_json, seed)
+    return requests[:limit]
+
+
+def parse_server_timing(header):
+    """
+    Parse the stage durations of a Server-Timing header.
+
+    :param header: (str) Server-Timing header value (e.g. 'config;dur=1.2, annotation;dur=3')
+    :return: durations in seconds by metric name
+    :rtype: dict
+    """
+    durations = {}
+    if not header:
+        return durations
+    for metric in header.split(','):
+        name, *params = [p.strip() for p in metric.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'dur':
+                durations[name] = float(value) / 1000
+    return durations
+
+
+class RequestError(Exception):
+    """Error response of a benchmark request."""
+
+
+class InProcessClient:
+    """Run the requests in the annotation functions of an in-process app."""
+
+    def __init__(self, app=None):
+        """
+        Initialise the client.
+
+        :param app: Flask app, created with create_app if None
+        """
+        if app is None:
+            from xi2annotator.app import create_app
+            app = create_app()
+        self.app = app
+
+    def annotate(self, body):
+        """
+        Annotate a serialized FULL request.
+
+        Errors of the annotation are raised.
+
+        :param body: (bytes) JSON request
+        :return: response status and stage durations
+        :rtype: tuple
+        """
+        from xi2annotator.annotation import annotate_json
+        timer = StageTimer()
+        with self.app.app_context():
+            json_request = json.loads(body)
+            timer.lap('parse')
+            response = annotate_json(json_request, timer=timer)
+            self.app.json.response(response)
+            timer.lap('jsonify')
+        return 200, timer.durations
+
+
+class ServerClient:
+    """Send the requests to the FULL route of a running server."""
+
+    def __init__(self, url):
+        """
+        Initialise the client.
+
+        :param url: (str) base URL of the server (e.g. http://localhost:8084)
+        """
+        self.url = url.rstrip('/') + '/xiAnnotator/annotate/FULL'
+
+    def annotate(self, body):
+        """
+        Annotate a serialized FULL request.
+
+        :param body: (bytes) JSON request
+        :return: response status and stage durations (from the Server-Timing header)
+        :rtype: tuple
+        """
+        request = Request(self.url, data=body, headers={'Content-Type': 'application/json',
+                                                        'X-Server-Timing': '1'})
+        try:
+            with urlopen(request) as response:
+                response.read()
+                return response.status, parse_server_timing(response.headers['Server-Timing'])
+        except HTTPError as e:
+            raise RequestError(f'HTTP {e.code}: {e.reason}') from e
+
+
+def run_requests(client, bodies, concurrency=1):
+    """
+    Run the requests concurrently and measure their latencies.
+
+    Failed requests are not measured, their errors are collected separately.
+
+    :param client: (InProcessClient|ServerClient) client running the requests
+    :param bodies: (list of bytes) serialized requests
+    :param concurrency: (int) number of concurrently running requests
+    :return: results (status, latency in seconds, stage durations) of the succeeded requests,
+        error messages of the failed requests and the wall time
+    :rtype: tuple
+    """
+    def timed(body):
+        start = time.perf_counter()
+        try:
+            status, durations = client.annotate(body)
+        except Exception as e:
+            return None, f'{type(e).__name__}: {e}'
+        return (status, time.perf_counter() - start, durations), None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        outcomes = list(executor.map(timed, bodies))
+    wall_time = time.perf_counter() - start
+    results = [result for result, _ in outcomes if result is not None]
+    errors = [error for _, error in outcomes if error is not None]
+    return results, errors, wall_time
+
+
+def distribution(values):
+    """
+    Summarize values (in seconds) as mean, percentiles and maximum in milliseconds.
+
+    :param values: (list of float) values in seconds
+    :rtype: dict
+    """
+    values = np.asarray(values) * 1000
+    if values.size == 0:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95),
+            'p99': float(p99), 'max': float(values.max())}
+
+
+def summarize(results, errors, wall_time, concurrency):
+    """
+    Create the report of a benchmark run.
+
+    The throughput and latencies are measured on the succeeded requests only, the failed
+    requests are reported as error counts by message.
+
+    :param results: (list of tuple) status, latency and stage durations of each succeeded
+        request
+    :param errors: (list of str) error messages of the failed requests
+    :param wall_time: (float) wall time of the run in seconds
+    :param concurrency: (int) number of concurrently running requests
+    :rtype: dict
+    """
+    stage_names = [s for s in STAGES if any(s in r[2] for r in results)]
+    stage_names += sorted({s for r in results for s in r[2]} - set(stage_names))
+    stages = {}
+    for stage in stage_names:
+        durations = [r[2].get(stage, 0.0) for r in results]
+        stages[stage] = {**distribution(durations), 'total': sum(durations) * 1000}
+    return {
+        'requests': len(results) + len(errors),
+        'errors': len(errors),
+        'errorMessages': dict(Counter(errors).most_common()),
+        'concurrency': concurrency,
+        'wallTime': wall_time,
+        'throughput': len(results) / wall_time if wall_time > 0 else 0.0,
+        'latencyMs': distribution([r[1] for r in results]),
+        'stagesMs': stages,
+    }
+
+
+def run_bench(sets, data_dir=DEFAULT_DATA_DIR, url=None, concurrency=1, repeat=1, limit=None,
+              warmup=1, app=None):
+    """
+    Run the benchmark of the load test data sets.
+
+    Repeated requests sent to a server are answered from its response cache, use repeat only
+    to measure the cache or with a disabled response cache.
+
+    :param sets: (list of str) names of the data sets (keys of BENCH_SETS)
+    :param data_dir: (str) directory containing the load test files
+    :param url: (str) base URL of a running server, if None an in-process app is used
+    :param concurrency: (int) number of concurrently running requests
+    :param repeat: (int) number of times each request is run
+    :param limit: (int) maximal number of requests per data set (None for all)
+    :param warmup: (int) number of requests run before the measurement of each data set
+    :param app: Flask app for the in-process run, created with create_app if None
+    :return: benchmark report
+    :rtype: dict
+    :raises FileNotFoundError: if the data directory doesn't exist
+    """
+    from xicommon import const
+    check_data_dir(data_dir)
+    client = ServerClient(url) if url else InProcessClient(app)
+    report = {
+        'xiVersion': const.VERSION,
+        'mode': url if url else 'in-process',
+        'sets': {},
+    }
+    for name in sets:
+        bodies = [json.dumps(r).encode('utf-8')
+                  for r in load_bench_requests(name, data_dir, limit)]
+        run_requests(client, bodies[:warmup])
+        results, errors, wall_time = run_requests(client, bodies * repeat, concurrency)
+        report['sets'][name] = summarize(results, errors, wall_time, concurrency)
+    return report
+
+
+def concatenated_peaks(mgf_path, n_peaks, config=None):
+    """
+    Concatenate the peaks of the spectra in a MGF file until n_peaks is reached.
+
+    Each spectrum is shifted by 2000 m/z to avoid overlapping peaks of different spectra.
+
+    :param mgf_path: (str) path to the MGF file
+    :param n_peaks: (int) number of peaks
+    :param config: (Config) config of the MGF reader (default config if None)
+    :return: m/z array and intensity array
+    :rtype: tuple
+    """
+    from xicommon.config import Config
+    from xi2annotator.psm import iter_spectra
+    mzs = []
+    ints = []
+    total = 0
+    for i, spectrum in enumerate(iter_spectra(mgf_path, config or Config())):
+        mzs.append(spectrum.mz_values + i * 2000)
+        ints.append(spectrum.int_values)
+        total += len(spectrum.mz_values)
+        if total >= n_peaks:
+            break
+    return np.concatenate(mzs)[:n_peaks], np.concatenate(ints)[:n_peaks]
+
+
+def peak_cluster_ids_per_peak(isotope_cluster_peaks, n_peaks):
+    """
+    Map the peaks to their isotope cluster ids with a per-peak np.where lookup.
+
+    Reference of the vectorized `peak_cluster_ids`.
+
+    :param isotope_cluster_peaks: (ndarray) cluster_id, peak_id records of the spectrum
+    :param n_peaks: (int) number of peaks of the spectrum
+    :return: cluster ids of each peak
+    :rtype: list of list of int
+    """
+    return [[int(cid) for cid in isotope_cluster_peaks['cluster_id'][
+        np.where(isotope_cluster_peaks['peak_id'] == peak_id)]] for peak_id in range(n_peaks)]
+
+
+def min_duration(func, repeat):
+    """
+    Run a function several times and return its result and minimal duration in seconds.
+
+    :param func: (callable) function without arguments
+    :param repeat: (int) number of runs
+    :rtype: tuple
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+    return result, min(durations)
+
+
+def run_peak_cluster_bench(data_dir=DEFAULT_DATA_DIR, peak_counts=PEAK_COUNTS, repeat=5,
+                           charge=4):
+    """
+    Benchmark the vectorized peak to isotope cluster mapping against the per-peak lookup.
+
+    The isotope clusters are detected on the concatenated peaks of the load test spectra, the
+    minimal duration of both mappings is reported for each number of peaks.
+
+    :param data_dir: (str) directory containing the load test files
+    :param peak_counts: (list of int) numbers of peaks
+    :param repeat: (int) number of runs of each mapping
+    :param charge: (int) precursor charge of the isotope detection
+    :return: benchmark report
+    :rtype: dict
+    :raises FileNotFoundError: if the data directory doesn't exist
+    """
+    from xicommon.config import Config
+    from xicommon.filters import IsotopeDetector
+    from xicommon.mock_context import MockContext
+    from xicommon.spectra_reader import Spectrum
+    from xi2annotator.annotation import peak_cluster_ids
+    check_data_dir(data_dir)
+    config = Config(ms2_tol='20 ppm')
+    mgf_path = os.path.join(data_dir, PEAK_CLUSTER_MGF)
+    report = {'mgf': PEAK_CLUSTER_MGF, 'repeat': repeat, 'peakCounts': {}}
+    for n_peaks in peak_counts:
+        mz_array, int_array = concatenated_peaks(mgf_path, n_peaks, config)
+        n_peaks = len(mz_array)
+        spectrum = Spectrum({'mz': None, 'charge': charge, 'intensity': -1}, mz_array,
+                            int_array, -1)
+        peaks = IsotopeDetector(MockContext(config)).process(spectrum).isotope_cluster_peaks
+        vectorized, vectorized_time = min_duration(
+            lambda: peak_cluster_ids(peaks, n_peaks), repeat)
+        per_peak, per_peak_time = min_duration(
+            lambda: peak_cluster_ids_per_peak(peaks, n_peaks), repeat)
+        report['peakCounts'][n_peaks] = {
+            'clusterPeaks': len(peaks),
+            'identical': vectorized == per_peak,
+            'vectorizedMs': vectorized_time * 1000,
+            'perPeakMs': per_peak_time * 1000,
+            'speedup': per_peak_time / vectorized_time if vectorized_time > 0 else None,
+        }
+    return report
@@ -0,0 +1,200 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+In-process caches used to share work between annotation requests.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_hash(obj):
+    """
+    Create a hash of a JSON serializable object that is independent of the dict key order.
+
+    :param obj: JSON serializable object
+    :return: hex digest of the canonical JSON representation
+    :rtype: str
+    """
+    canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def array_nbytes(value):
+    """
+    Return the memory footprint of a numpy array or a tuple/list of numpy arrays.
+
+    :param value: (ndarray|tuple|list) value to measure
+    :rtype: int
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(array_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+def object_nbytes(value):
+    """
+    Return the summed memory footprint of the numpy array attributes of an object.
+
+    :param value: object to measure (e.g. a processed Spectrum)
+    :rtype: int
+    """
+    return array_nbytes(list(vars(value).values()))
+
+
+class LRUCache:
+    """
+    Thread-safe bounded least recently used cache with hit/miss counters.
+
+    The cache is bounded by the number of entries and optionally by the summed size of the
+    entries as measured by the sizeof function. Entries can optionally expire after ttl seconds.
+    Setting maxsize to 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=128, max_bytes=None, sizeof=None, ttl=None):
+        """
+        Initialise the cache.
+
+        :param maxsize: (int) maximal number of entries
+        :param max_bytes: (int) maximal summed size of the entries (None for no limit)
+        :param sizeof: (callable) function returning the size of a value in bytes, required if
+            max_bytes is set
+        :param ttl: (float) time to live of the entries in seconds (None for no expiry)
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the value for key and mark it as most recently used.
+
+        :param key: cache key
+        :param default: value returned if key is not cached
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if key in self._expires and self._expires[key] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store value for key evicting the least recently used entries if required.
+
+        :param key: cache key
+        :param value: value to store
+        """
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        # values larger than the whole cache are not stored
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            self._evict()
+
+    def resize(self, maxsize, max_bytes=None, ttl=None):
+        """
+        Change the bounds of the cache.
+
+        :param maxsize: (int) new maximal number of entries
+        :param max_bytes: (int) new maximal summed size of the entries (None to keep the current)
+        :param ttl: (float) new time to live for new entries (None to keep the current)
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._expires.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return the cache statistics.
+
+        :return: hits, misses, current and maximal size (entries and bytes)
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                    'maxsize': self.maxsize, 'bytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def _remove(self, key):
+        if key in self._data:
+            del self._data[key]
+            self.nbytes -= self._sizes.pop(key)
+            self._expires.pop(key, None)
+
+    def _evict(self):
+        while len(self._data) > max(self.maxsize, 0) or (
+                self.max_bytes is not None and self.nbytes > self.max_bytes):
+            key, _ = self._data.popitem(last=False)
+            self.nbytes -= self._sizes.pop(key)
+            self._expires.pop(key, None)
+
+
+# cache of AnnotationSetups keyed by the canonical hash of the config relevant request part
+setup_cache = LRUCache(maxsize=128)
+
+# cache of charged fragment tables bounded by number of entries and memory
+fragment_cache = LRUCache(maxsize=256, max_bytes=64 * 1024 * 1024, sizeof=array_nbytes)
+
+# cache of isotope detected spectra keyed by the peaks, precursor charge and isotope settings
+isotope_cache = LRUCache(maxsize=64, max_bytes=64 * 1024 * 1024, sizeof=object_nbytes)
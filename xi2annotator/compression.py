@@ -0,0 +1,299 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Content-Encoding of the request and response bodies.
+
+Request bodies compressed with gzip (or zstd / brotli if the zstandard / brotli packages are
+installed) are decoded as a stream by a WSGI middleware, so the views read the plain body.
+Responses of at least COMPRESSION_MIN_SIZE bytes are compressed with the best encoding
+accepted by the client. Streamed responses (NDJSON) are compressed chunk by chunk and flushed
+after each chunk, so finished annotations still arrive immediately.
+"""
+import gzip
+import io
+import zlib
+from flask import request, current_app
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.wsgi import get_input_stream
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# size of the chunks read from the compressed request stream
+CHUNK_SIZE = 64 * 1024
+
+# errors raised by the decoders on corrupt input
+DECODE_ERRORS = (OSError, EOFError, zlib.error) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ()) + \
+    ((brotli.error,) if brotli is not None else ())
+
+
+class BrotliReader:
+    """File-like reader decompressing a brotli compressed stream."""
+
+    def __init__(self, stream):
+        """
+        Initialise the reader.
+
+        :param stream: (file) brotli compressed stream
+        """
+        self.stream = stream
+        self.decompressor = brotli.Decompressor()
+        self.buffer = b''
+
+    def read(self, size):
+        """
+        Read up to size decompressed bytes.
+
+        :param size: (int) maximal number of bytes to return
+        :rtype: bytes
+        """
+        while not self.buffer:
+            chunk = self.stream.read(CHUNK_SIZE)
+            if not chunk:
+                if not self.decompressor.is_finished():
+                    raise brotli.error("Truncated brotli stream")
+                return b''
+            self.buffer = self.decompressor.process(chunk)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def available_decoders():
+    """
+    Return the readers decoding the supported request Content-Encodings.
+
+    :return: content encoding to function creating a decompressing reader of a stream
+    :rtype: dict
+    """
+    decoders = {'gzip': lambda stream: gzip.GzipFile(fileobj=stream, mode='rb'),
+                'x-gzip': lambda stream: gzip.GzipFile(fileobj=stream, mode='rb')}
+    if zstandard is not None:
+        decoders['zstd'] = lambda stream: zstandard.ZstdDecompressor().stream_reader(
+            stream, read_across_frames=True)
+    if brotli is not None:
+        decoders['br'] = BrotliReader
+    return decoders
+
+
+class DecodedStream(io.RawIOBase):
+    """Raw stream of the decompressed request body with a limit on the decompressed size."""
+
+    def __init__(self, reader, max_size=None):
+        """
+        Initialise the stream.
+
+        :param reader: (file) decompressing reader of the request body
+        :param max_size: (int) maximal number of decompressed bytes (None for no limit)
+        """
+        super().__init__()
+        self.reader = reader
+        self.max_size = max_size
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self.reader.read(len(buffer))
+        except DECODE_ERRORS as e:
+            raise BadRequest(f"Invalid compressed request body: {e}")
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class DecompressionMiddleware:
+    """
+    WSGI middleware decoding compressed request bodies.
+
+    The wsgi.input of requests with a supported Content-Encoding is replaced by the decoded
+    stream (marked as terminated). The Content-Length header is kept, so it still reports the
+    transferred (compressed) size. Unsupported encodings are rejected with 415.
+    """
+
+    def __init__(self, wsgi_app, max_size=None):
+        """
+        Initialise the middleware.
+
+        :param wsgi_app: wrapped WSGI app
+        :param max_size: (int) maximal size of a decompressed request body (None for no limit)
+        """
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+        self.decoders = available_decoders()
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return self.wsgi_app(environ, start_response)
+        if encoding not in self.decoders:
+            error = UnsupportedMediaType(f"Unsupported Content-Encoding: {encoding}")
+            return error(environ, start_response)
+        reader = self.decoders[encoding](get_input_stream(environ))
+        environ['wsgi.input'] = io.BufferedReader(DecodedStream(reader, self.max_size),
+                                                  CHUNK_SIZE)
+        environ['wsgi.input_terminated'] = True
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
+
+
+class GzipCompressor:
+    """Incremental gzip compressor."""
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class ZstdCompressor:
+    """Incremental zstd compressor."""
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    """Incremental brotli compressor."""
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def available_compressors():
+    """
+    Return the compressors of the supported response encodings in order of preference.
+
+    :return: content encoding to (compressor class, config key of the compression level)
+    :rtype: dict
+    """
+    compressors = {}
+    if zstandard is not None:
+        compressors['zstd'] = (ZstdCompressor, 'COMPRESSION_ZSTD_LEVEL')
+    if brotli is not None:
+        compressors['br'] = (BrotliCompressor, 'COMPRESSION_BROTLI_LEVEL')
+    compressors['gzip'] = (GzipCompressor, 'COMPRESSION_GZIP_LEVEL')
+    return compressors
+
+
+def create_compressor(encoding):
+    """
+    Create a compressor for the encoding with the configured compression level.
+
+    :param encoding: (str) content encoding
+    """
+    compressor_class, level_key = available_compressors()[encoding]
+    return compressor_class(current_app.config[level_key])
+
+
+def compress_chunks(chunks, compressor):
+    """
+    Compress an iterable of chunks flushing the compressor after each chunk.
+
+    :param chunks: iterable of bytes
+    :param compressor: compressor of the response encoding
+    """
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response):
+    """
+    Compress the response with the best encoding accepted by the client.
+
+    Responses smaller than COMPRESSION_MIN_SIZE, responses without content and already
+    encoded responses are left unchanged. Strong ETags of compressed responses become weak
+    as the body is no longer byte-identical to the uncompressed representation.
+
+    :param response: Flask response
+    :return: the (compressed) response
+    """
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or request.method == 'HEAD' or 'Content-Encoding' in response.headers
+            or response.direct_passthrough):
+        return response
+    if not response.is_streamed and \
+            len(response.get_data()) < current_app.config['COMPRESSION_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(list(available_compressors()))
+    if encoding is None:
+        return response
+
+    compressor = create_compressor(encoding)
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """
+    Decode compressed request bodies and compress the responses of the app.
+
+    :param app: Flask app
+    """
+    app.wsgi_app = DecompressionMiddleware(app.wsgi_app,
+                                           app.config['COMPRESSION_MAX_DECODED_SIZE'])
+    app.after_request(compress_response)
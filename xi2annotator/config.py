@@ -15,10 +15,61 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
 # USA
 
+import os
+
+
 class Config(object):
     DEBUG = False
     TESTING = False
     CORS_HEADERS = 'Content-Type'
+    # use orjson for the JSON responses if it is installed (opt-in: faster, but floats are
+    # formatted differently than by the standard library, e.g. 0.00003924 instead of 3.924e-05)
+    JSON_USE_ORJSON = False
+    # maximal number of cached annotation setups (0 disables the cache)
+    SETUP_CACHE_SIZE = 128
+    # maximal number of entries and bytes of the theoretical fragment cache
+    FRAGMENT_CACHE_SIZE = 256
+    FRAGMENT_CACHE_BYTES = 64 * 1024 * 1024
+    # maximal number of entries and bytes of the isotope detected spectrum cache
+    ISOTOPE_CACHE_SIZE = 64
+    ISOTOPE_CACHE_BYTES = 64 * 1024 * 1024
+    # maximal number of entries, bytes and time to live (seconds) of the FULL response cache
+    RESPONSE_CACHE_SIZE = 256
+    RESPONSE_CACHE_BYTES = 256 * 1024 * 1024
+    RESPONSE_CACHE_TTL = 3600
+    # annotate a bundled request in the background after startup (/ready returns 200 after it)
+    WARMUP = False
+    # record annotation request metrics and expose them on /metrics
+    METRICS = True
+    # run FULL annotations in a bounded executor ('thread', 'process' or None for inline)
+    ANNOTATION_EXECUTOR = None
+    # number of annotation workers and of requests that may wait for a free worker
+    ANNOTATION_WORKERS = 4
+    ANNOTATION_QUEUE_DEPTH = 16
+    # seconds sent in the Retry-After header of requests rejected by a saturated executor
+    ANNOTATION_RETRY_AFTER = 1
+    # maximal number of annotation threads of a NDJSON stream request
+    STREAM_WORKERS = 4
+    # decode compressed request bodies and compress responses (Content-Encoding)
+    COMPRESSION = True
+    # only compress responses of at least this size (bytes)
+    COMPRESSION_MIN_SIZE = 1024
+    # compression levels of the response encodings (gzip: 1-9, zstd: 1-22, brotli: 0-11)
+    COMPRESSION_GZIP_LEVEL = 6
+    COMPRESSION_ZSTD_LEVEL = 3
+    COMPRESSION_BROTLI_LEVEL = 4
+    # maximal size of a decompressed request body (bytes, None for no limit)
+    COMPRESSION_MAX_DECODED_SIZE = 1024 * 1024 * 1024
+    # directory for cProfile dumps of sampled FULL annotations (None disables profiling)
+    PROFILE_DIR = os.environ.get('XI2ANNOTATOR_PROFILE_DIR')
+    # profile every Nth annotation (0 disables) and annotations slower than this (seconds)
+    PROFILE_EVERY = int(os.environ.get('XI2ANNOTATOR_PROFILE_EVERY', 0))
+    PROFILE_SLOWER_THAN = float(os.environ['XI2ANNOTATOR_PROFILE_SLOWER_THAN']) \
+        if 'XI2ANNOTATOR_PROFILE_SLOWER_THAN' in os.environ else None
+    # number of annotations profiled after an annotation slower than PROFILE_SLOWER_THAN
+    PROFILE_SLOW_SAMPLES = int(os.environ.get('XI2ANNOTATOR_PROFILE_SLOW_SAMPLES', 8))
+    # maximal disk usage of the profile dumps
+    PROFILE_MAX_BYTES = int(os.environ.get('XI2ANNOTATOR_PROFILE_MAX_BYTES', 512 * 1024 * 1024))
 
 
 class ProductionConfig(Config):
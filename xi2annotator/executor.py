@@ -0,0 +1,99 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Bounded executor running annotations outside of the request handling thread.
+
+The number of queued and running annotations is limited, submitting to a saturated executor
+fails immediately instead of piling up requests, so the server can shed load.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class ExecutorBusy(Exception):
+    """Raised if all worker and queue slots of a BoundedExecutor are taken."""
+
+
+class BoundedExecutor:
+    """Thread or process pool executor with a bounded queue."""
+
+    def __init__(self, max_workers=4, queue_depth=16, processes=False):
+        """
+        Initialise the executor.
+
+        :param max_workers: (int) number of worker threads/processes
+        :param queue_depth: (int) number of submissions that may wait for a free worker
+        :param processes: (bool) use worker processes instead of threads. Processes don't
+            compete for the GIL but the request and the result have to be pickled.
+        """
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        if processes:
+            self._executor = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='xi2annotator')
+        self._slots = threading.BoundedSemaphore(max_workers + queue_depth)
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) without blocking.
+
+        :param fn: (callable) function to execute (must be picklable for processes)
+        :raises ExecutorBusy: if all worker and queue slots are taken
+        :rtype: concurrent.futures.Future
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy(f"All {self.max_workers} workers and {self.queue_depth} queue "
+                               f"slots are busy.")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Execute fn(*args, **kwargs) in the executor and await the result.
+
+        :param fn: (callable) function to execute (must be picklable for processes)
+        :raises ExecutorBusy: if all worker and queue slots are taken
+        :return: return value of fn
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the workers.
+
+        :param wait: (bool) wait for the pending submissions to finish
+        """
+        self._executor.shutdown(wait=wait)
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
@@ -0,0 +1,133 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+JSON provider with native NumPy support.
+
+Uses the standard library json module by default. orjson can be enabled if it is installed, it
+is faster but doesn't format floats like the standard library (same values, different bytes).
+"""
+import json
+import numpy as np
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def numpy_default(o):
+    """
+    Convert NumPy scalars and arrays (and bytes) into JSON serializable Python objects.
+
+    :param o: object that is not natively serializable
+    :return: JSON serializable representation of o
+    """
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, bytes):
+        return o.decode('ascii')
+    return _default(o)
+
+
+def dumps_bytes(obj, sort_keys=True, indent=False, use_orjson=False):
+    """
+    Serialize obj to UTF-8 encoded JSON in the format of the NumpyJSONProvider.
+
+    Can be used without a Flask app (e.g. in worker processes).
+
+    :param obj: object to serialize
+    :param sort_keys: (bool) sort the keys of dicts
+    :param indent: (bool) use a non-compact representation (indented by 2 spaces)
+    :param use_orjson: (bool) use orjson if it is installed
+    :rtype: bytes
+    """
+    if use_orjson and orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS | \
+            orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=numpy_default, option=option)
+    if indent:
+        return json.dumps(obj, default=numpy_default, sort_keys=sort_keys,
+                          indent=2).encode('utf-8')
+    return json.dumps(obj, default=numpy_default, sort_keys=sort_keys,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that serializes NumPy scalars and arrays directly.
+
+    The output has the same format as the DefaultJSONProvider (sorted keys, compact separators
+    unless in debug mode). If orjson is enabled and available it is used for dumping without
+    extra keyword arguments and for creating responses.
+    """
+
+    default = staticmethod(numpy_default)
+
+    def __init__(self, app, use_orjson=False):
+        """
+        Initialise the provider.
+
+        :param app: Flask app
+        :param use_orjson: (bool) use orjson if it is installed
+        """
+        super().__init__(app)
+        self.use_orjson = use_orjson and orjson is not None
+
+    def dumps_bytes(self, obj, indent=False):
+        """
+        Serialize obj to UTF-8 encoded JSON.
+
+        :param obj: object to serialize
+        :param indent: (bool) use a non-compact representation (indented by 2 spaces)
+        :rtype: bytes
+        """
+        if self.use_orjson:
+            return dumps_bytes(obj, self.sort_keys, indent, use_orjson=True)
+        if indent:
+            return super().dumps(obj, indent=2).encode('utf-8')
+        return super().dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize obj to a JSON string.
+
+        :param obj: object to serialize
+        :param kwargs: passed to json.dumps, if given the standard library is used
+        :rtype: str
+        """
+        if self.use_orjson and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """
+        Serialize the arguments as JSON and return a response object with it.
+
+        See `DefaultJSONProvider.response`.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n',
+                                        mimetype=self.mimetype)
@@ -0,0 +1,384 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Prometheus style metrics of the annotation requests.
+
+The metrics are kept in process (per worker process) and exposed in the Prometheus text
+format on the /metrics endpoint. All metric updates are protected by locks, so they can be
+shared by the waitress threads.
+"""
+import bisect
+import threading
+import time
+from flask import request, current_app
+from xi2annotator.timing import STAGE_TIMER_KEY
+
+# default histogram buckets for durations (seconds) and payload sizes (bytes)
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# WSGI environ key of the metrics state of a request
+METRICS_KEY = 'xi2annotator.metrics'
+
+
+def format_labels(label_names, label_values, extra=()):
+    """
+    Format the labels of a sample.
+
+    :param label_names: (tuple of str) label names
+    :param label_values: (tuple of str) label values
+    :param extra: (tuple of tuple) additional (name, value) pairs
+    :rtype: str
+    """
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for n, v in pairs]
+    return '{' + ','.join(f'{n}="{v}"' for n, v in escaped) + '}'
+
+
+def format_value(value):
+    """
+    Format a sample value.
+
+    :param value: (float) value
+    :rtype: str
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class of the metrics holding one value per label combination."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, label_names=()):
+        """
+        Initialise the metric.
+
+        :param name: (str) metric name
+        :param documentation: (str) help text
+        :param label_names: (tuple of str) names of the labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def clear(self):
+        """Reset all values."""
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        """
+        Render the metric in the Prometheus text format.
+
+        :rtype: list of str
+        """
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += [line for key, value in items for line in self._samples(key, value)]
+        return lines
+
+    def _samples(self, key, value):
+        return [f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}']
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the counter.
+
+        :param amount: (float) increment
+        :param labels: label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """Return the current value for the labels."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    type_name = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        """
+        Decrease the gauge.
+
+        :param amount: (float) decrement
+        :param labels: label values
+        """
+        self.inc(-amount, **labels)
+
+
+class CallbackGauge(Metric):
+    """Gauge whose values are collected by a callback when the metrics are rendered."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, label_names, callback):
+        """
+        Initialise the gauge.
+
+        :param name: (str) metric name
+        :param documentation: (str) help text
+        :param label_names: (tuple of str) names of the labels
+        :param callback: (callable) returns the current values as dict of label values (tuple)
+            to value
+        """
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+
+    def render(self):
+        values = self.callback()
+        with self._lock:
+            self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().render()
+
+
+class Histogram(Metric):
+    """Histogram counting the observations in cumulative buckets."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DURATION_BUCKETS):
+        """
+        Initialise the histogram.
+
+        :param name: (str) metric name
+        :param documentation: (str) help text
+        :param label_names: (tuple of str) names of the labels
+        :param buckets: (tuple of float) upper bounds of the buckets (without +Inf)
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value, **labels):
+        """
+        Record an observation.
+
+        :param value: (float) observed value
+        :param labels: label values
+        """
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # bucket counts (last is +Inf), sum of the observations
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][idx] += 1
+            counts[1] += value
+
+    def get(self, **labels):
+        """
+        Return the number and sum of the observations for the labels.
+
+        :rtype: tuple
+        """
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            if counts is None:
+                return 0, 0.0
+            return sum(counts[0]), counts[1]
+
+    def _samples(self, key, value):
+        bucket_counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), bucket_counts):
+            cumulative += count
+            labels = format_labels(self.label_names, key, (('le', format_value(bound)),))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = format_labels(self.label_names, key)
+        lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        """Initialise an empty registry."""
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        :param metric: (Metric) metric to add
+        :return: the metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text format.
+
+        :rtype: str
+        """
+        return '\n'.join(line for m in self.metrics for line in m.render()) + '\n'
+
+    def clear(self):
+        """Reset all metrics."""
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = MetricsRegistry()
+requests_total = registry.register(Counter(
+    'xi2annotator_requests_total', 'Number of annotation requests.', ('route', 'status')))
+request_errors = registry.register(Counter(
+    'xi2annotator_request_errors_total', 'Number of failed annotation requests.', ('route',)))
+requests_in_flight = registry.register(Gauge(
+    'xi2annotator_requests_in_flight', 'Number of annotation requests being processed.',
+    ('route',)))
+request_duration = registry.register(Histogram(
+    'xi2annotator_request_duration_seconds', 'Duration of the annotation requests.',
+    ('route',)))
+stage_duration = registry.register(Histogram(
+    'xi2annotator_stage_duration_seconds', 'Duration of the annotation stages per request.',
+    ('route', 'stage')))
+request_size = registry.register(Histogram(
+    'xi2annotator_request_size_bytes', 'Size of the annotation request bodies.', ('route',),
+    buckets=SIZE_BUCKETS))
+response_size = registry.register(Histogram(
+    'xi2annotator_response_size_bytes', 'Size of the annotation response bodies.', ('route',),
+    buckets=SIZE_BUCKETS))
+
+
+def cache_stats():
+    """
+    Return the statistics of the in-process caches.
+
+    :return: cache name to LRUCache.stats
+    :rtype: dict
+    """
+    from xi2annotator.cache import setup_cache, fragment_cache, isotope_cache
+    from xi2annotator.routes import response_cache
+    return {'setup': setup_cache.stats(), 'fragment': fragment_cache.stats(),
+            'isotope': isotope_cache.stats(), 'response': response_cache.stats()}
+
+
+def _cache_stat(stat):
+    return lambda: {(cache,): stats[stat] for cache, stats in cache_stats().items()}
+
+
+cache_hits = registry.register(CallbackGauge(
+    'xi2annotator_cache_hits', 'Number of cache hits.', ('cache',), _cache_stat('hits')))
+cache_misses = registry.register(CallbackGauge(
+    'xi2annotator_cache_misses', 'Number of cache misses.', ('cache',), _cache_stat('misses')))
+cache_entries = registry.register(CallbackGauge(
+    'xi2annotator_cache_entries', 'Number of cached entries.', ('cache',), _cache_stat('size')))
+cache_bytes = registry.register(CallbackGauge(
+    'xi2annotator_cache_bytes', 'Summed size of the cached entries (caches bounded by memory).',
+    ('cache',), _cache_stat('bytes')))
+
+
+def _route():
+    endpoint = request.endpoint or ''
+    if not endpoint.startswith('xi2annotator.'):
+        return None
+    return endpoint.split('.', 1)[1]
+
+
+# the state is kept in the WSGI environ as g may be shared by several requests (e.g. when
+# requests are made in the app context of another request)
+def _before_request():
+    route = _route()
+    if route is None:
+        return
+    request.environ[METRICS_KEY] = {'route': route, 'start': time.perf_counter(),
+                                    'recorded': False}
+    requests_in_flight.inc(route=route)
+    if request.content_length is not None:
+        request_size.observe(request.content_length, route=route)
+
+
+def _after_request(response):
+    state = request.environ.get(METRICS_KEY)
+    if state is None:
+        return response
+    route = state['route']
+    state['recorded'] = True
+    request_duration.observe(time.perf_counter() - state['start'], route=route)
+    requests_total.inc(route=route, status=response.status_code)
+    if response.status_code >= 400:
+        request_errors.inc(route=route)
+    if response.content_length is not None:
+        response_size.observe(response.content_length, route=route)
+    timer = request.environ.get(STAGE_TIMER_KEY)
+    if timer is not None:
+        for stage, duration in timer.durations.items():
+            stage_duration.observe(duration, route=route, stage=stage)
+    return response
+
+
+def _teardown_request(exc):
+    state = request.environ.pop(METRICS_KEY, None)
+    if state is None:
+        return
+    route = state['route']
+    requests_in_flight.dec(route=route)
+    # unhandled exceptions propagated without an error response
+    if not state['recorded']:
+        request_duration.observe(time.perf_counter() - state['start'], route=route)
+        requests_total.inc(route=route, status=500)
+        request_errors.inc(route=route)
+
+
+def metrics_view():
+    """Return the metrics in the Prometheus text format."""
+    return current_app.response_class(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app):
+    """
+    Record the metrics of the annotation routes and register the /metrics endpoint.
+
+    :param app: Flask app
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
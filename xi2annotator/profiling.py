@@ -0,0 +1,218 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Sampled cProfile capture of annotation requests.
+
+Every Nth annotation is profiled. Once an annotation is slower than a threshold, the next
+annotations are profiled and those that are slow themselves are dumped, so the profiles show
+slow annotations as they actually ran (cold caches included). The profile (.prof, readable
+with pstats or snakeviz) is written next to the JSON request that caused it, so the request
+can be replayed. The disk usage of the dump directory is capped by removing the oldest dumps.
+
+The profiled call is a module level function returning the profile statistics, so it can run
+in the annotation executor (threads or processes).
+"""
+import cProfile
+import glob
+import json
+import marshal
+import os
+import threading
+import time
+
+# only one profiler can be active at a time (per process)
+_profile_lock = threading.Lock()
+
+
+def timed_call(func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) and measure its duration.
+
+    :param func: (callable) function to call
+    :return: return value of func, duration in seconds and None (no profile statistics)
+    :rtype: tuple
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start, None
+
+
+def profiled_call(func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) under cProfile.
+
+    If another call is being profiled in this process the call is only timed.
+
+    :param func: (callable) function to call
+    :return: return value of func, duration in seconds and the profile statistics (None if
+        the call was not profiled)
+    :rtype: tuple
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return timed_call(func, *args, **kwargs)
+    try:
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        result = profile.runcall(func, *args, **kwargs)
+        duration = time.perf_counter() - start
+        profile.create_stats()
+        return result, duration, profile.stats
+    finally:
+        _profile_lock.release()
+
+
+class RequestProfiler:
+    """Profile sampled annotation calls and dump the profiles with their requests."""
+
+    def __init__(self, directory, every=0, slower_than=None, max_bytes=512 * 1024 * 1024,
+                 slow_samples=8):
+        """
+        Initialise the profiler.
+
+        :param directory: (str) directory the requests and profiles are written to
+        :param every: (int) profile every Nth call (0 to disable)
+        :param slower_than: (float) dump profiles of calls slower than this (seconds, None to
+            disable). After an unprofiled call exceeded it the next slow_samples calls are
+            profiled.
+        :param max_bytes: (int) maximal disk usage of the dumps
+        :param slow_samples: (int) number of calls profiled after a slow call
+        """
+        self.directory = directory
+        self.every = every
+        self.slower_than = slower_than
+        self.max_bytes = max_bytes
+        self.slow_samples = slow_samples
+        self.calls = 0
+        self.dumps = 0
+        # number of calls still to be profiled after a slow call
+        self.armed = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def sample(self, json_request):
+        """
+        Decide if the next call gets profiled.
+
+        :param json_request: JSON annotation request of the call
+        :return: None if the call is not profiled, else the reason ('sampled' or 'slow') and
+            the serialized request (taken before the call may modify it)
+        :rtype: tuple
+        """
+        with self._lock:
+            self.calls += 1
+            if self.every > 0 and self.calls % self.every == 0:
+                reason = 'sampled'
+            elif self.armed > 0:
+                self.armed -= 1
+                reason = 'slow'
+            else:
+                return None
+        return reason, json.dumps(json_request)
+
+    def record(self, sample, duration, stats):
+        """
+        Record a finished call: dump its profile or arm the profiling after a slow call.
+
+        :param sample: return value of `sample` for the call
+        :param duration: (float) duration of the call in seconds
+        :param stats: (dict) profile statistics of the call (None if not profiled)
+        """
+        is_slow = self.slower_than is not None and duration > self.slower_than
+        if sample is None:
+            if is_slow:
+                with self._lock:
+                    self.armed = self.slow_samples
+            return
+        reason, request_json = sample
+        if stats is not None and (reason == 'sampled' or is_slow):
+            self.dump(request_json, stats, duration, reason)
+
+    def run(self, func, json_request, **kwargs):
+        """
+        Call func(json_request, **kwargs) and profile the call if it is sampled.
+
+        :param func: (callable) annotation function
+        :param json_request: JSON annotation request
+        :param kwargs: additional arguments of the call
+        :return: return value of func
+        """
+        sample = self.sample(json_request)
+        call = timed_call if sample is None else profiled_call
+        result, duration, stats = call(func, json_request, **kwargs)
+        self.record(sample, duration, stats)
+        return result
+
+    async def run_in_executor(self, executor, func, json_request):
+        """
+        Run func(json_request) in the executor and profile the call if it is sampled.
+
+        :param executor: (BoundedExecutor) annotation executor
+        :param func: (callable) annotation function (must be picklable for processes)
+        :param json_request: JSON annotation request
+        :return: return value of func
+        """
+        sample = self.sample(json_request)
+        call = timed_call if sample is None else profiled_call
+        result, duration, stats = await executor.run(call, func, json_request)
+        self.record(sample, duration, stats)
+        return result
+
+    def dump(self, request_json, stats, duration, reason):
+        """
+        Write the request and its profile to the dump directory.
+
+        :param request_json: (str) serialized request
+        :param stats: (dict) profile statistics of the annotation (see `profiled_call`)
+        :param duration: (float) duration of the annotation in seconds
+        :param reason: (str) why the call was profiled (sampled or slow)
+        :return: path of the profile
+        :rtype: str
+        """
+        with self._lock:
+            self.dumps += 1
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{self.dumps}_{reason}_" \
+                   f"{duration * 1000:.0f}ms"
+        base_path = os.path.join(self.directory, name)
+        with open(base_path + '.json', 'w') as f:
+            f.write(request_json)
+        # same format as cProfile.Profile.dump_stats
+        with open(base_path + '.prof', 'wb') as f:
+            marshal.dump(stats, f)
+        self.enforce_disk_cap()
+        return base_path + '.prof'
+
+    def enforce_disk_cap(self):
+        """Remove the oldest dumps until the dump directory is smaller than max_bytes."""
+        paths = glob.glob(os.path.join(self.directory, '*.prof')) + \
+            glob.glob(os.path.join(self.directory, '*.json'))
+        files = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        total = sum(f[2] for f in files)
+        for _, path, size in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,183 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Create annotation requests from peak list files and xi result (PSM) CSV files.
+"""
+import csv
+import re
+from xicommon.mock_context import MockContext
+from xicommon.spectra_reader import MGFReader
+
+# Xmod amino acid (upper case letter followed by the lower case modification name)
+XMOD_AMINO_ACID_RE = re.compile(r'([A-Z])([^A-Z]*)')
+
+
+def read_psms(csv_path):
+    """
+    Read the PSMs of a xi result CSV file.
+
+    :param csv_path: (str) path to the CSV file
+    :return: PSMs as dictionaries of the CSV columns
+    :rtype: list
+    """
+    with open(csv_path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def iter_spectra(mgf_path, config):
+    """
+    Iterate over the spectra of a MGF file.
+
+    :param mgf_path: (str) path to the MGF file
+    :param config: (Config) config defining the run name and scan number regex of the titles
+    :return: generator of Spectrum
+    """
+    reader = MGFReader(MockContext(config))
+    reader.load(mgf_path)
+    return reader.spectra
+
+
+def read_spectra(mgf_path, config):
+    """
+    Read the spectra of a MGF file indexed by run name and scan number.
+
+    :param mgf_path: (str) path to the MGF file
+    :param config: (Config) config defining the run name and scan number regex of the titles
+    :return: spectra indexed by (run_name, scan_number)
+    :rtype: dict
+    """
+    return {(s.run_name, s.scan_number): s for s in iter_spectra(mgf_path, config)}
+
+
+def psm_key(psm):
+    """
+    Return the (run_name, scan_number) key of a PSM used to join it to its spectrum.
+
+    :param psm: (dict) PSM row of a xi result CSV
+    :rtype: tuple
+    """
+    return psm['run'], int(psm['scan'])
+
+
+def peptide_json(sequence, modification_names):
+    """
+    Convert a Xmod peptide sequence into a xi2 format peptide.
+
+    :param sequence: (str) Xmod peptide sequence (modification names following the residue,
+        e.g. 'MoxPCcmK')
+    :param modification_names: (list of str) names of the config modifications
+    :return: peptide with base_sequence, modification_ids and modification_positions
+    :rtype: dict
+    """
+    base_sequence = ''
+    mod_ids = []
+    mod_positions = []
+    for i, (aa, mod) in enumerate(XMOD_AMINO_ACID_RE.findall(sequence)):
+        base_sequence += aa
+        if mod:
+            if mod not in modification_names:
+                raise ValueError(f"Modification {mod} of {sequence} is not defined in the "
+                                 f"config.")
+            mod_ids.append(modification_names.index(mod))
+            # modification positions are 1-based (0 is n-terminal)
+            mod_positions.append(i + 1)
+    return {
+        'base_sequence': base_sequence,
+        'modification_ids': mod_ids,
+        'modification_positions': mod_positions,
+    }
+
+
+def spectrum_request(spectrum, peptides, link_sites, config_json, precursor_charge=None,
+                     return_mod_syntax='Xmod'):
+    """
+    Create a xi2 format FULL annotation request.
+
+    :param spectrum: (Spectrum) spectrum to annotate
+    :param peptides: (list of dict) xi2 format peptides
+    :param link_sites: (list of int) 0-based link sites of the peptides (empty for linears)
+    :param config_json: (dict) xi2 config
+    :param precursor_charge: (int) precursor charge, defaults to the spectrum precursor charge
+    :param return_mod_syntax: (str) modification syntax of the response
+    :rtype: dict
+    """
+    if precursor_charge is None:
+        precursor_charge = spectrum.precursor_charge
+    return {
+        'Peptides': peptides,
+        'LinkSite': [{'id': 0, 'peptideId': i, 'linkSite': site}
+                     for i, site in enumerate(link_sites)],
+        'peaks': [{'mz': m, 'intensity': i}
+                  for m, i in zip(spectrum.mz_values.tolist(), spectrum.int_values.tolist())],
+        'annotation': {
+            'config': config_json,
+            'precursorCharge': int(precursor_charge),
+            'precursorMZ': float(spectrum.precursor_mz),
+            'returnModSyntax': return_mod_syntax,
+        },
+    }
+
+
+def psm_peptides(psm, config_json):
+    """
+    Return the xi2 format peptides and the 0-based link sites of a xi result PSM.
+
+    :param psm: (dict) PSM row of a xi result CSV (PepSeq1/2, LinkPos1/2 1-based)
+    :param config_json: (dict) xi2 config
+    :return: peptides and link sites (empty for linears)
+    :rtype: tuple
+    """
+    modification_names = [m['name'] for m in
+                          config_json.get('modification', {}).get('modifications', [])]
+    peptides = [peptide_json(psm[col], modification_names)
+                for col in ('PepSeq1', 'PepSeq2') if psm.get(col)]
+    link_sites = [int(psm[col]) - 1 for col in ('LinkPos1', 'LinkPos2')] \
+        if len(peptides) == 2 else []
+    return peptides, link_sites
+
+
+def psm_request(psm, spectrum, config_json):
+    """
+    Create the FULL annotation request of a xi result PSM.
+
+    :param psm: (dict) PSM row of a xi result CSV (PepSeq1/2, LinkPos1/2 1-based, Charge)
+    :param spectrum: (Spectrum) spectrum of the PSM
+    :param config_json: (dict) xi2 config
+    :rtype: dict
+    """
+    peptides, link_sites = psm_peptides(psm, config_json)
+    return spectrum_request(spectrum, peptides, link_sites, config_json, psm.get('Charge'))
+
+
+def psm_requests(psms, spectra, config_json):
+    """
+    Join the PSMs to their spectra and create the FULL annotation requests.
+
+    PSMs without a spectrum are skipped.
+
+    :param psms: (list of dict) PSM rows of a xi result CSV
+    :param spectra: (dict) spectra indexed by (run_name, scan_number)
+    :param config_json: (dict) xi2 config
+    :rtype: list
+    """
+    requests = []
+    for psm in psms:
+        spectrum = spectra.get(psm_key(psm))
+        if spectrum is not None:
+            requests.append(psm_request(psm, spectrum, config_json))
+    return requests
@@ -15,16 +15,240 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
 # USA
 
-from flask import request
+import traceback
+from flask import request, current_app, jsonify, stream_with_context
 from xi2annotator import bp
-from xi2annotator.annotation import annotate_request
+# xi2annotator.annotation (and with it xicommon) is imported in the views to keep the import
+# of the app fast, it's loaded by the warm-up or the first request
+from xi2annotator.cache import LRUCache, canonical_hash
+from xi2annotator.executor import ExecutorBusy
+from xi2annotator.timing import request_stage_timer, server_timing_header
+
+# serialized FULL responses keyed by the ETag of the request
+response_cache = LRUCache(maxsize=256, max_bytes=256 * 1024 * 1024, sizeof=len, ttl=3600)
+
+
+def request_etag(content):
+    """
+    Create the ETag of an annotation request.
+
+    The annotation is deterministic, so the ETag is the hash of the normalized request and the
+    xi version.
+    :param content: parsed JSON request
+    :rtype: str
+    """
+    from xicommon import const
+    return canonical_hash({'request': content, 'xiVersion': const.VERSION})
+
+
+def apply_accept_header(content):
+    """
+    Select the response format of the request based on the Accept header.
+
+    :param content: parsed JSON request
+    """
+    from xi2annotator.annotation import COLUMNAR_MIMETYPE
+    if COLUMNAR_MIMETYPE in request.accept_mimetypes.values():
+        content['annotation']['responseFormat'] = 'columnar'
+
+
+def server_timing_requested():
+    """
+    Return True if the request asks for the Server-Timing header.
+
+    Enabled by the ``timing`` query parameter or the ``X-Server-Timing`` request header.
+    """
+    value = request.args.get('timing', request.headers.get('X-Server-Timing'))
+    return value is not None and value.lower() not in ('0', 'false')
+
+
+def etag_response(etag, data=None, cached=False):
+    """
+    Create a FULL response (or 304 response if data is None) carrying the ETag.
+
+    If requested the Server-Timing header with the stage durations is added.
+
+    :param etag: (str) ETag of the request
+    :param data: (bytes) serialized annotation response
+    :param cached: (bool) data was taken from the response cache
+    """
+    if data is None:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(data, mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    if server_timing_requested():
+        timer = request_stage_timer()
+        if cached:
+            timer.count('cached', 1)
+        response.headers['Server-Timing'] = server_timing_header(timer)
+    return response
+
+
+def busy_response(message):
+    """
+    Create the response for a request rejected because the annotation executor is saturated.
+
+    :param message: (str) error message
+    """
+    response = jsonify({'error': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(current_app.config['ANNOTATION_RETRY_AFTER'])
+    return response
 
 
 @bp.route('/xiAnnotator/annotate/FULL', methods=['POST'])
 def annotate():
+    from xi2annotator.annotation import annotate_request
+    if not request.is_json:
+        return "Invalid JSON", 400
+    timer = request_stage_timer()
+    # get the content of the json request
+    content = request.get_json()
+    apply_accept_header(content)
+    timer.lap('parse')
+
+    etag = request_etag(content)
+    if request.if_none_match.contains_weak(etag):
+        return etag_response(etag)
+
+    data = response_cache.get(etag)
+    if data is not None:
+        return etag_response(etag, data, cached=True)
+
+    response = annotate_request(content, timer)
+    # don't cache error responses
+    if isinstance(response, tuple):
+        return response
+    data = response.get_data()
+    response_cache.put(etag, data)
+
+    return etag_response(etag, data)
+
+
+async def annotate_async():
+    """
+    FULL annotation view running the annotation in the bounded annotation executor.
+
+    Replaces the synchronous view if ANNOTATION_EXECUTOR is configured. Requests exceeding
+    the executor's worker and queue slots are rejected with 503 and a Retry-After header.
+    """
+    from xi2annotator.annotation import annotate_json_timed, is_debug
+    if not request.is_json:
+        return "Invalid JSON", 400
+    timer = request_stage_timer()
+    # get the content of the json request
+    content = request.get_json()
+    apply_accept_header(content)
+    timer.lap('parse')
+
+    etag = request_etag(content)
+    if request.if_none_match.contains_weak(etag):
+        return etag_response(etag)
+
+    data = response_cache.get(etag)
+    if data is not None:
+        return etag_response(etag, data, cached=True)
+
+    executor = current_app.extensions['xi2annotator.executor']
+    profiler = current_app.extensions.get('xi2annotator.profiler')
+    try:
+        if profiler is None:
+            result, executor_timer = await executor.run(annotate_json_timed, content)
+        else:
+            result, executor_timer = await profiler.run_in_executor(
+                executor, annotate_json_timed, content)
+    except ExecutorBusy as e:
+        return busy_response(str(e))
+    except Exception as e:
+        if is_debug():
+            return jsonify({'error': str(e), "stacktrace": traceback.format_exc()}), 400
+        raise e
+    # the time not spent in the annotation stages was spent waiting for a worker
+    timer.merge(executor_timer, 'queue')
+    data = current_app.json.response(result).get_data()
+    timer.lap('jsonify')
+    response_cache.put(etag, data)
+
+    return etag_response(etag, data)
+
+
+@bp.route('/xiAnnotator/annotate/BATCH', methods=['POST'])
+def annotate_batch():
+    from xi2annotator.annotation import annotate_batch_request
+    if not request.is_json:
+        return "Invalid JSON", 400
+    timer = request_stage_timer()
+    # get the content of the json request
+    content = request.get_json()
+    apply_accept_header(content)
+    timer.lap('parse')
+
+    return annotate_batch_request(content, timer)
+
+
+@bp.route('/xiAnnotator/annotate/CANDIDATES', methods=['POST'])
+def annotate_candidates():
+    from xi2annotator.annotation import annotate_candidates_request
+    if not request.is_json:
+        return "Invalid JSON", 400
+    timer = request_stage_timer()
+    # get the content of the json request
+    content = request.get_json()
+    apply_accept_header(content)
+    timer.lap('parse')
+
+    return annotate_candidates_request(content, timer)
+
+
+@bp.route('/xiAnnotator/annotate/LINKSITES', methods=['POST'])
+def annotate_link_sites():
+    from xi2annotator.annotation import annotate_link_sites_request
+    if not request.is_json:
+        return "Invalid JSON", 400
+    timer = request_stage_timer()
+    # get the content of the json request
+    content = request.get_json()
+    apply_accept_header(content)
+    timer.lap('parse')
+
+    return annotate_link_sites_request(content, timer)
+
+
+@bp.route('/xiAnnotator/annotate/MODSITES', methods=['POST'])
+def annotate_modification_sites():
+    from xi2annotator.annotation import annotate_modification_sites_request
     if not request.is_json:
         return "Invalid JSON", 400
+    timer = request_stage_timer()
     # get the content of the json request
     content = request.get_json()
+    apply_accept_header(content)
+    timer.lap('parse')
+
+    return annotate_modification_sites_request(content, timer)
+
+
+@bp.route('/xiAnnotator/annotate/STREAM', methods=['POST'])
+def annotate_ndjson_stream():
+    """
+    Annotate a NDJSON stream of FULL requests and stream the NDJSON responses back.
+
+    The query parameter ``workers`` sets the number of annotation threads (capped by
+    STREAM_WORKERS) and ``ordered=0`` returns the responses as soon as they are finished.
+    The ``id`` of each request (default: its index in the stream) is echoed in its response.
+    """
+    from xi2annotator.annotation import annotate_stream
+    max_workers = current_app.config['STREAM_WORKERS']
+    workers = max(1, min(request.args.get('workers', 1, type=int), max_workers))
+    ordered = request.args.get('ordered', '1').lower() not in ('0', 'false')
+    lines = request.stream
+    json_provider = current_app.json
+
+    def generate():
+        for response in annotate_stream(lines, workers, ordered):
+            yield json_provider.dumps_bytes(response) + b'\n'
 
-    return annotate_request(content)
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype='application/x-ndjson')
@@ -0,0 +1,114 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Timing of the annotation stages.
+"""
+import time
+from flask import request
+
+# annotation stages in processing order
+STAGES = ['parse', 'queue', 'config', 'peptide_db', 'isotope_detection', 'fragmentation',
+          'annotation', 'response', 'jsonify']
+
+# WSGI environ key of the StageTimer of a request
+STAGE_TIMER_KEY = 'xi2annotator.stage_timer'
+
+
+class StageTimer:
+    """
+    Accumulate the wall time spent in the annotation stages.
+
+    Each call to lap attributes the time since the previous lap (or the creation of the timer)
+    to the given stage. Stages can be lapped several times, the durations are summed up.
+    Additionally, the sizes of the processed data (peaks, fragments, ...) can be counted.
+    """
+
+    def __init__(self):
+        """Initialise the timer and start the first lap."""
+        self.durations = {}
+        self.counts = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        """
+        Attribute the time since the last lap to stage.
+
+        :param stage: (str) name of the stage
+        :return: duration of the lap in seconds
+        :rtype: float
+        """
+        now = time.perf_counter()
+        duration = now - self._last
+        self.durations[stage] = self.durations.get(stage, 0.0) + duration
+        self._last = now
+        return duration
+
+    def restart(self):
+        """Start a new lap without attributing the elapsed time to a stage."""
+        self._last = time.perf_counter()
+
+    def count(self, name, value):
+        """
+        Add value to the count name.
+
+        :param name: (str) name of the count (e.g. peaks)
+        :param value: (int) value to add
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def merge(self, timer, remainder_stage):
+        """
+        Attribute the time since the last lap to stages timed elsewhere (e.g. in an executor).
+
+        :param timer: (StageTimer) timer that recorded stages during the lap
+        :param remainder_stage: (str) stage the untimed rest of the lap is attributed to
+        """
+        self.lap(remainder_stage)
+        for stage, duration in timer.durations.items():
+            self.durations[stage] = self.durations.get(stage, 0.0) + duration
+            self.durations[remainder_stage] -= duration
+        for name, value in timer.counts.items():
+            self.count(name, value)
+
+
+def server_timing_header(timer):
+    """
+    Create the Server-Timing header value of the stage durations and counts.
+
+    Durations are given in milliseconds, counts as description of a metric without duration.
+
+    :param timer: (StageTimer) timer of the request
+    :rtype: str
+    """
+    stages = [s for s in STAGES if s in timer.durations]
+    stages += [s for s in timer.durations if s not in STAGES]
+    metrics = [f'{s};dur={timer.durations[s] * 1000:.3f}' for s in stages]
+    metrics += [f'{name};desc="{value}"' for name, value in timer.counts.items()]
+    return ', '.join(metrics)
+
+
+def request_stage_timer():
+    """
+    Return the StageTimer of the current request (created on first use).
+
+    :rtype: StageTimer
+    """
+    timer = request.environ.get(STAGE_TIMER_KEY)
+    if timer is None:
+        timer = request.environ[STAGE_TIMER_KEY] = StageTimer()
+    return timer
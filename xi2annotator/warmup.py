@@ -0,0 +1,129 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Startup of the annotation service: warm-up, readiness and startup times.
+
+The heavy imports (xicommon) are deferred until the first annotation. The warm-up runs a
+bundled annotation request in a background thread after the app is created, so the imports,
+the first context and the NumPy code paths are loaded before the first user request. The
+/ready endpoint returns 200 once the warm-up has finished.
+"""
+import json
+import os
+import threading
+import time
+from flask import current_app, jsonify, request
+
+# bundled request used for the warm-up
+WARMUP_REQUEST = os.path.join(os.path.dirname(__file__), 'data', 'warmup_request.json')
+
+
+class Startup:
+    """Warm-up state and startup times of an app."""
+
+    def __init__(self, import_start, import_time):
+        """
+        Initialise the startup state.
+
+        :param import_start: (float) time.perf_counter() at the start of the package import
+        :param import_time: (float) duration of the package import in seconds
+        """
+        self.import_start = import_start
+        self.import_time = import_time
+        self.ready = threading.Event()
+        self.warmup_time = None
+        self.warmup_error = None
+        self.first_request_time = None
+
+    def warm_up(self, request_path=WARMUP_REQUEST):
+        """
+        Annotate the warm-up request and mark the app as ready.
+
+        A failing warm-up is reported but doesn't keep the app from becoming ready.
+
+        :param request_path: (str) path to the JSON annotation request
+        """
+        start = time.perf_counter()
+        try:
+            from xi2annotator.annotation import annotate_json
+            from xi2annotator.json_provider import dumps_bytes
+            with open(request_path) as f:
+                json_request = json.load(f)
+            dumps_bytes(annotate_json(json_request))
+        except Exception as e:
+            self.warmup_error = str(e)
+        finally:
+            self.warmup_time = time.perf_counter() - start
+            self.ready.set()
+        if self.warmup_error is None:
+            print(f"Warm-up finished in {self.warmup_time:.3f}s", flush=True)
+        else:
+            print(f"Warm-up failed after {self.warmup_time:.3f}s: {self.warmup_error}",
+                  flush=True)
+
+    def report(self):
+        """
+        Return the readiness and the startup times (seconds).
+
+        :rtype: dict
+        """
+        report = {
+            'ready': self.ready.is_set(),
+            'importTime': self.import_time,
+            'warmupTime': self.warmup_time,
+            'timeToFirstRequest': self.first_request_time,
+        }
+        if self.warmup_error is not None:
+            report['warmupError'] = self.warmup_error
+        return report
+
+
+def ready_view():
+    """Return 200 with the startup times once the app is warmed up, 503 before."""
+    startup = current_app.extensions['xi2annotator.startup']
+    response = jsonify(startup.report())
+    response.status_code = 200 if startup.ready.is_set() else 503
+    return response
+
+
+def _record_first_request(response):
+    startup = current_app.extensions['xi2annotator.startup']
+    if startup.first_request_time is None and request.endpoint is not None and \
+            request.endpoint.startswith('xi2annotator.'):
+        # time from the start of the package import to the first annotation response
+        startup.first_request_time = time.perf_counter() - startup.import_start
+    return response
+
+
+def init_startup(app):
+    """
+    Register the /ready endpoint and start the warm-up if enabled (WARMUP config).
+
+    :param app: Flask app
+    """
+    import xi2annotator
+    startup = Startup(xi2annotator.IMPORT_START, xi2annotator.IMPORT_TIME)
+    app.extensions['xi2annotator.startup'] = startup
+    app.add_url_rule('/ready', 'ready', ready_view)
+    app.after_request(_record_first_request)
+    if app.config['WARMUP']:
+        threading.Thread(target=startup.warm_up, name='xi2annotator-warmup',
+                         daemon=True).start()
+    else:
+        startup.ready.set()
+    return startup
@@ -0,0 +1,166 @@
+# Copyright (C) 2025  Technische Universitaet Berlin
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+
+"""
+Pre-fork supervisor running several waitress worker processes on a shared listening socket.
+
+Annotation is CPU bound, so the threads of a single waitress process compete for the GIL.
+The supervisor binds the listening socket once, forks the worker processes (each creating its
+own app and serving the shared socket), restarts crashed workers and shuts the workers down
+gracefully on SIGTERM/SIGINT.
+"""
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from waitress.server import create_server
+
+# workers exiting faster than this (seconds) are restarted with a delay to avoid restart loops
+MIN_WORKER_LIFETIME = 1
+
+
+def create_listen_socket(host, port, backlog=1024):
+    """
+    Create the listening socket shared by the workers.
+
+    :param host: (str) host to bind to
+    :param port: (int) port to bind to
+    :param backlog: (int) listen backlog
+    :rtype: socket.socket
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class WorkerSupervisor:
+    """Supervisor forking and monitoring the waitress worker processes."""
+
+    def __init__(self, app_factory, sock, workers, graceful_timeout=30, **serve_kwargs):
+        """
+        Initialise the supervisor.
+
+        :param app_factory: (callable) creates the WSGI app, called in each worker process
+        :param sock: (socket.socket) listening socket shared by the workers
+        :param workers: (int) number of worker processes
+        :param graceful_timeout: (int) seconds to wait for workers to finish on shutdown before
+            they get killed
+        :param serve_kwargs: additional waitress adjustments (e.g. threads)
+        """
+        self.app_factory = app_factory
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.serve_kwargs = serve_kwargs
+        self.children = {}
+        self.stopping = False
+
+    def run(self):
+        """Start the workers and supervise them until all have exited after a shutdown."""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGALRM, self._kill)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, "
+                  f"restarting", flush=True)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not self.stopping:
+                self._spawn()
+
+        signal.alarm(0)
+        self.sock.close()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._run_worker()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        self.children[pid] = time.monotonic()
+        print(f"Started worker {pid}", flush=True)
+
+    def _run_worker(self):
+        # waitress shuts down its task threads (finishing running requests) on SystemExit
+        signal.signal(signal.SIGTERM, _exit_worker)
+        signal.signal(signal.SIGINT, _exit_worker)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        app = self.app_factory()
+        server = create_server(app, sockets=[self.sock], **self.serve_kwargs)
+        server.run()
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        print(f"Stopping {len(self.children)} workers", flush=True)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.alarm(self.graceful_timeout)
+
+    def _kill(self, signum, frame):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+def _exit_worker(signum, frame):
+    sys.exit(0)
+
+
+def serve_workers(app_factory, host, port, workers, **serve_kwargs):
+    """
+    Serve the app with several worker processes sharing one listening socket.
+
+    :param app_factory: (callable) creates the WSGI app, called in each worker process
+    :param host: (str) host to bind to
+    :param port: (int) port to bind to
+    :param workers: (int) number of worker processes
+    :param serve_kwargs: additional waitress adjustments (e.g. threads)
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Multiple workers require a platform supporting fork.")
+    sock = create_listen_socket(host, port)
+    WorkerSupervisor(app_factory, sock, workers, **serve_kwargs).run()